@@ -6,3 +6,9 @@ load_dotenv()
 token = getenv('TOKEN')
 
 administrators = [int(id) for id in getenv('ADMINISTRATORS')[1:-1].split(',')]
+
+# Службовий чат (канал/група з ботом), куди cron_daemon.py заздалегідь завантажує медіа з налаштувань
+MEDIA_STORAGE_CHAT_ID = int(getenv('MEDIA_STORAGE_CHAT_ID')) if getenv('MEDIA_STORAGE_CHAT_ID') else None
+
+# Чат для шаблонів розсилок у режимі copy_message (за замовчуванням - той самий службовий чат)
+MAILING_TEMPLATE_CHAT_ID = int(getenv('MAILING_TEMPLATE_CHAT_ID')) if getenv('MAILING_TEMPLATE_CHAT_ID') else MEDIA_STORAGE_CHAT_ID
@@ -7,13 +7,23 @@ import pytz
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from database.settings_db import update_mailing_status, get_scheduled_mailings
+from database.settings_db import (
+    update_mailing_status, get_scheduled_mailings, enqueue_mailing_job, claim_next_mailing_job, finish_mailing_job, requeue_interrupted_mailing_jobs,
+    save_settings_media_file_id
+)
+from database.media_db import (
+    claim_next_media_job, finish_media_job, requeue_interrupted_media_jobs
+)
+from database.migrations import run_migrations
 from utils.cron_functions import send_mailing_to_users
+from utils.video_cache import materialize_media
 from aiogram import Bot
 
-from config import token
+from config import token, MEDIA_STORAGE_CHAT_ID
 
 
+JOB_POLL_INTERVAL = 2
+
 
 class MailingCronDaemon:
     def __init__(self, token: str):
@@ -84,24 +94,15 @@ class MailingCronDaemon:
                     scheduled_at_minutes = scheduled_at.replace(second=0, microsecond=0)
                     
                     if current_time_minutes >= scheduled_at_minutes:
-                        print(f"📤 Sending mailing '{mailing_name}' (ID: {mailing_id})")
+                        print(f"📤 Queueing mailing '{mailing_name}' (ID: {mailing_id})")
                         print(f"   Current time: {current_time_minutes.strftime('%Y-%m-%d %H:%M')} (Киев)")
                         print(f"   Scheduled time: {scheduled_at_minutes.strftime('%Y-%m-%d %H:%M')} (Киев)")
                         
-                        success = await send_mailing_to_users(self.bot, mailing_id)
-                        
-                        if success:
-                            # Для обычных рассылок обновляем статус на 'sent'
-                            # Для повторяющихся рассылок schedule_next_recurring уже вызывается в send_mailing_to_users
-                            from database.settings_db import get_mailing_by_id
-                            mailing_data = get_mailing_by_id(mailing_id)
-                            if not mailing_data.get('is_recurring'):
-                                update_mailing_status(mailing_id, 'sent')
-                            
-                            print(f"✅ Mailing '{mailing_name}' sent successfully")
-                        else:
-                            update_mailing_status(mailing_id, 'failed')
-                            print(f"❌ Failed to send mailing '{mailing_name}'")
+                        # Статус 'queued' не дає взяти розсилку повторно на наступній перевірці,
+                        # саму відправку виконує process_mailing_jobs
+                        update_mailing_status(mailing_id, 'queued')
+                        job_id = enqueue_mailing_job(mailing_id, restart=True)
+                        print(f"✅ Mailing '{mailing_name}' queued as job {job_id}")
                     else:
                         time_diff = scheduled_at_minutes - current_time_minutes
                         minutes_left = int(time_diff.total_seconds() / 60)
@@ -114,6 +115,84 @@ class MailingCronDaemon:
         except Exception as e:
             print(f"❌ Error checking scheduled mailings: {e}")
     
+    async def run_mailing_job(self, job):
+        job_id = job['id']
+        mailing_id = job['mailing_id']
+        print(f"📤 Running job {job_id} for mailing {mailing_id}")
+        
+        try:
+            success = await send_mailing_to_users(self.bot, mailing_id)
+        except Exception as e:
+            print(f"❌ Job {job_id} crashed: {e}")
+            update_mailing_status(mailing_id, 'failed')
+            finish_mailing_job(job_id, 'failed', str(e))
+            return
+        
+        if success:
+            # Для повторюваних розсилок schedule_next_recurring вже викликається в send_mailing_to_users
+            from database.settings_db import get_mailing_by_id
+            mailing_data = get_mailing_by_id(mailing_id)
+            if mailing_data and not mailing_data.get('is_recurring'):
+                update_mailing_status(mailing_id, 'sent')
+            elif mailing_data and mailing_data.get('status') == 'queued':
+                # Нікому не відправили - все одно плануємо наступний запуск
+                from database.settings_db import schedule_next_recurring
+                schedule_next_recurring(mailing_id)
+            finish_mailing_job(job_id, 'done')
+            print(f"✅ Job {job_id} for mailing {mailing_id} finished")
+        else:
+            update_mailing_status(mailing_id, 'failed')
+            finish_mailing_job(job_id, 'failed', 'Розсилка не відправлена')
+            print(f"❌ Job {job_id} for mailing {mailing_id} failed")
+    
+    async def process_mailing_jobs(self):
+        """Виконує розсилки з черги mailing_jobs по одній, щоб усі
+        відправки ділили один ліміт швидкості Telegram"""
+        requeued = requeue_interrupted_mailing_jobs()
+        if requeued:
+            print(f"🔁 Requeued {requeued} interrupted mailing jobs")
+        
+        while True:
+            try:
+                job = claim_next_mailing_job()
+                if not job:
+                    await asyncio.sleep(JOB_POLL_INTERVAL)
+                    continue
+                await self.run_mailing_job(job)
+            except Exception as e:
+                print(f"❌ Error processing mailing jobs: {e}")
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+    
+    async def process_media_jobs(self):
+        """Завантажує медіа, збережені у веб-панелі, в службовий чат,
+        щоб користувачі одразу отримували їх за file_id"""
+        if not MEDIA_STORAGE_CHAT_ID:
+            print("⚠️ MEDIA_STORAGE_CHAT_ID is not set, media pre-upload is disabled")
+            return
+        
+        requeued = requeue_interrupted_media_jobs()
+        if requeued:
+            print(f"🔁 Requeued {requeued} interrupted media jobs")
+        
+        while True:
+            try:
+                job = claim_next_media_job()
+                if not job:
+                    await asyncio.sleep(JOB_POLL_INTERVAL)
+                    continue
+                
+                try:
+                    file_id = await materialize_media(self.bot, MEDIA_STORAGE_CHAT_ID, job['media_type'], job['url'])
+                    finish_media_job(job['id'], 'done', file_id=file_id)
+                    save_settings_media_file_id(job['media_type'], job['url'], file_id)
+                    print(f"🎞 Media {job['media_type']} {job['url']} uploaded")
+                except Exception as e:
+                    finish_media_job(job['id'], 'failed', error=str(e))
+                    print(f"❌ Media job {job['id']} failed: {e}")
+            except Exception as e:
+                print(f"❌ Error processing media jobs: {e}")
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+    
     async def run_daemon(self):
         print("🚀 Starting cron daemon for mailings...")
         
@@ -121,6 +200,9 @@ class MailingCronDaemon:
             print("❌ Failed to initialize bot. Stopping...")
             return
         
+        jobs_task = asyncio.create_task(self.process_mailing_jobs())
+        media_task = asyncio.create_task(self.process_media_jobs())
+        
         try:
             while True:
                 await self.check_and_send_scheduled_mailings()
@@ -133,12 +215,15 @@ class MailingCronDaemon:
         except Exception as e:
             print(f"❌ Critical error in daemon: {e}")
         finally:
+            jobs_task.cancel()
+            media_task.cancel()
             await self.close_bot()
             print("✅ Daemon stopped")
 
 
 def main():
     print("📢 Cron daemon for scheduled mailings")
+    run_migrations()
 
     daemon = MailingCronDaemon(token)
     
@@ -1,20 +1,12 @@
-import sqlite3
-from contextlib import contextmanager
+from database.db import get_connection
 
-@contextmanager
-def get_connection():
-    conn = sqlite3.connect('data/data.db')
-    try:
-        yield conn
-    finally:
-        conn.close()
 
 def get_users_count():
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users")
-        count = cursor.fetchone()[0]
-        return count
+        cursor.execute("SELECT cnt FROM user_counters WHERE kind = 'total' AND key = ''")
+        row = cursor.fetchone()
+        return row[0] if row else 0
 
 def get_all_user_ids():
     with get_connection() as conn:
@@ -0,0 +1,149 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from database import client_db, settings_db
+
+
+# Всі звернення до БД з обробників йдуть в один окремий потік:
+# fsync при записі не зупиняє event loop, а з'єднання з SQLite в цьому потоці одне
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+
+async def run_db(func, *args, **kwargs):
+    """Виконує синхронну функцію БД у потоці БД і чекає результат"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def _to_async(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+
+async def flush_db() -> None:
+    """Чекає, поки потік БД виконає всі поставлені раніше запити (при зупинці бота)"""
+    await run_db(lambda: None)
+
+
+class UserUpdatesBuffer:
+    """Write-behind буфер для last_activity, статусів та підписки.
+
+    Оновлення одного користувача зливаються в пам'яті (останній час активності,
+    статус з найвищим пріоритетом, останній статус підписки) і записуються
+    однією транзакцією кожні flush_interval секунд або при max_pending рядках.
+    """
+
+    def __init__(self, flush_interval: float = 0.5, max_pending: int = 500):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._activity = {}
+        self._statuses = {}
+        self._subscriptions = {}
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self._activity) + len(self._statuses) + len(self._subscriptions)
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def _added(self) -> None:
+        if self._wakeup is not None and len(self) >= self.max_pending:
+            self._wakeup.set()
+
+    def touch(self, user_id: int) -> None:
+        self._activity[user_id] = self._now()
+        self._added()
+
+    def set_status_by_action(self, user_id: int, action: str) -> bool:
+        if action not in client_db.STATUS_MAPPING:
+            return False
+        pending = self._statuses.get(user_id)
+        if pending is None or client_db.STATUS_PRIORITY[action] >= client_db.STATUS_PRIORITY[pending[0]]:
+            self._statuses[user_id] = (action, self._now())
+        self._added()
+        return True
+
+    def set_subscription(self, user_id: int, subscription_status: str) -> None:
+        self._subscriptions[user_id] = (subscription_status, self._now())
+        self._added()
+
+    async def flush(self) -> None:
+        if not len(self):
+            return
+        activity = list(self._activity.items())
+        statuses = [(user_id, action, at) for user_id, (action, at) in self._statuses.items()]
+        subscriptions = [(user_id, status, at) for user_id, (status, at) in self._subscriptions.items()]
+        self._activity, self._statuses, self._subscriptions = {}, {}, {}
+        await run_db(client_db.apply_user_updates, activity, statuses, subscriptions)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Помилка запису оновлень користувачів: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Зупиняє фоновий запис і зберігає все, що залишилось у буфері"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        await self.flush()
+
+
+user_updates = UserUpdatesBuffer()
+
+
+# Користувачі
+add_user = _to_async(client_db.add_user)
+
+
+async def update_user_activity(user_id: int) -> None:
+    user_updates.touch(user_id)
+
+
+async def update_user_status_by_action(user_id: int, action: str) -> bool:
+    return user_updates.set_status_by_action(user_id, action)
+
+
+async def update_subscription_status(user_id: int, subscription_status: str) -> None:
+    user_updates.set_subscription(user_id, subscription_status)
+
+# Налаштування
+get_start_message_config = _to_async(settings_db.get_start_message_config)
+get_subscription_message = _to_async(settings_db.get_subscription_message)
+get_welcome_without_subscription = _to_async(settings_db.get_welcome_without_subscription)
+get_captcha_settings = _to_async(settings_db.get_captcha_settings)
+get_channel_leave_config = _to_async(settings_db.get_channel_leave_config)
+get_channel_invite_link_by_chat_id = _to_async(settings_db.get_channel_invite_link_by_chat_id)
+get_answers_config = _to_async(settings_db.get_answers_config)
+get_private_lesson_config = _to_async(settings_db.get_private_lesson_config)
+get_tariffs_config = _to_async(settings_db.get_tariffs_config)
+get_clothes_tariff_config = _to_async(settings_db.get_clothes_tariff_config)
+get_tech_tariff_config = _to_async(settings_db.get_tech_tariff_config)
+get_clothes_payment_config = _to_async(settings_db.get_clothes_payment_config)
+get_tech_payment_config = _to_async(settings_db.get_tech_payment_config)
+get_tariff_selection_buttons_config = _to_async(settings_db.get_tariff_selection_buttons_config)
+get_settings_media_file_ids = _to_async(settings_db.get_settings_media_file_ids)
@@ -1,95 +1,64 @@
-import sqlite3
-import os
-from datetime import datetime
-from contextlib import contextmanager
-from typing import Optional, List, Tuple
+from datetime import datetime, timezone
+from database.db import get_connection
+from typing import Optional, List, Tuple, Iterator
 
 
-os.makedirs('data', exist_ok=True)
+def _to_ts(value: Optional[str]) -> Optional[int]:
+    """'YYYY-MM-DD[ HH:MM:SS]' -> ціле число секунд.
+    Час зберігається як є, без перерахунку поясу, тож datetime(ts, 'unixepoch')
+    у view users повертає той самий рядок.
+    """
+    if not value:
+        return None
+    return int(datetime.fromisoformat(str(value)).replace(tzinfo=timezone.utc).timestamp())
 
-@contextmanager
-def get_connection():
-    conn = sqlite3.connect('data/data.db')
-    try:
-        yield conn
-    finally:
-        conn.close()
 
+def _now_ts() -> int:
+    """Поточний локальний час у тому ж форматі, що й join_ts/activity_ts"""
+    return _to_ts(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+
+# Порядок сторінок користувачів: без активності (NULL) - в кінці списку
+USERS_PAGE_ORDER = 'COALESCE(activity_ts, 0), user_id'
 
-def create_table():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER UNIQUE NOT NULL,
-                user_name TEXT,
-                join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        try:
-            cursor.execute('ALTER TABLE users ADD COLUMN start_param TEXT')
-        except sqlite3.OperationalError:        
-            pass
-        
-        try:
-            cursor.execute('ALTER TABLE users ADD COLUMN status TEXT DEFAULT "active"')
-        except sqlite3.OperationalError:
-            pass
-        
-        try:
-            cursor.execute('ALTER TABLE users ADD COLUMN subscription_status TEXT DEFAULT "❌Не подписан"')
-        except sqlite3.OperationalError:        
-            pass
-        
-        conn.commit()
+
+# Рядок у форматі старої таблиці users (для SELECT замість *)
+USER_ROW_COLUMNS = 'id, user_id, user_name, join_date, last_activity, start_param, status, subscription_status, stage'
 
 
 def check_user(user_id):
     with get_connection() as conn:
         cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+        cursor.execute(f'SELECT {USER_ROW_COLUMNS} FROM users WHERE user_id = ?', (user_id,))
         user = cursor.fetchone()
         
         return user
 
 
 def add_user(user_id, username, start_param=None):
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    now_ts = _now_ts()
     
-    try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO users (user_id, user_name, join_date, last_activity, status, start_param, subscription_status)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, username, current_time, current_time, 'active', start_param, '❌Не подписан'))
-            conn.commit()
-    except sqlite3.IntegrityError:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Оновлюємо тільки last_activity, start_param залишаємо без змін
-            cursor.execute('''
-                UPDATE users SET last_activity = ? WHERE user_id = ?
-            ''', (current_time, user_id))
-            
-            conn.commit()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Існуючому користувачу оновлюємо тільки last_activity, start_param залишаємо без змін
+        cursor.execute('''
+            INSERT INTO users_data (user_id, user_name, join_ts, activity_ts, start_param, stage, subscribed)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET activity_ts = excluded.activity_ts
+        ''', (user_id, username, now_ts, now_ts, start_param,
+              USER_STATUS_CODES['active'], SUBSCRIPTION_CODES['❌Не подписан']))
+        conn.commit()
+
 
 def update_user_activity(user_id):
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    
     with get_connection() as conn:
         cursor = conn.cursor()
         
         cursor.execute('''
-            UPDATE users SET last_activity = ? WHERE user_id = ?
-        ''', (current_time, user_id))
+            UPDATE users_data SET activity_ts = ? WHERE user_id = ?
+        ''', (_now_ts(), user_id))
         
         conn.commit()
 
@@ -99,7 +68,7 @@ def update_user_start_param(user_id, start_param):
         cursor = conn.cursor()
         
         cursor.execute('''
-            UPDATE users SET start_param = ? WHERE user_id = ?
+            UPDATE users_data SET start_param = ? WHERE user_id = ?
         ''', (start_param, user_id))
         
         conn.commit()
@@ -117,43 +86,20 @@ def get_user_start_param(user_id):
 def get_users_by_status(status: str) -> List[Tuple]:
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE status = ?', (status,))
+        cursor.execute(f'SELECT {USER_ROW_COLUMNS} FROM users '
+                       f'WHERE stage = (SELECT code FROM user_statuses WHERE name = ?)', (status,))
         return cursor.fetchall()
 
 
 
-def change_user_channel_status(user_id: int, channel_status: str) -> bool:
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET channel_status = ? WHERE user_id = ?', (channel_status, user_id))
-        conn.commit()
-        return cursor.rowcount > 0
-
-
 def get_start_params_stats():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT start_param, COUNT(*) as count 
-            FROM users 
-            WHERE start_param IS NOT NULL 
-            GROUP BY start_param 
-            ORDER BY count DESC
-        ''') 
-        
-        stats = cursor.fetchall()
-        return stats
+    stats = get_user_counters('start_param')
+    stats.pop(None, None)
+    return sorted(stats.items(), key=lambda item: item[1], reverse=True)
 
 
 def get_users_count():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM users')
-        count = cursor.fetchone()[0]
-        
-        return count
+    return get_user_counter('total')
 
 def get_users_list(page=1, per_page=100):
     with get_connection() as conn:
@@ -164,7 +110,7 @@ def get_users_list(page=1, per_page=100):
         cursor.execute('''
             SELECT user_id, user_name, join_date, last_activity, start_param
             FROM users 
-            ORDER BY join_date DESC
+            ORDER BY join_ts DESC
             LIMIT ? OFFSET ?
         ''', (per_page, offset))
         
@@ -184,21 +130,135 @@ def get_all_users():
         cursor.execute('''
             SELECT user_id, user_name, join_date, last_activity, start_param
             FROM users 
-            ORDER BY join_date DESC
+            ORDER BY join_ts DESC
         ''')
         
         users = cursor.fetchall()
         return users
 
 
+def iter_user_id_chunks(where: str = None, params: tuple = (), chunk_size: int = 1000) -> Iterator[List[int]]:
+    """Порціями віддає user_id (keyset по унікальному індексу user_id).
+    На кожну порцію - окремий короткий запит, тож пам'ять не залежить від кількості користувачів.
+    where - додаткова умова з плейсхолдерами, params - значення для неї
+    """
+    condition = f"AND ({where})" if where else ""
+    last_user_id = 0
+    while True:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT user_id FROM users_data 
+                WHERE user_id > ? {condition}
+                ORDER BY user_id LIMIT ?
+            ''', (last_user_id, *params, chunk_size))
+            chunk = [row[0] for row in cursor.fetchall()]
+        
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_user_id = chunk[-1]
+
+
+def iter_users_for_export(chunk_size: int = 1000) -> Iterator[List[Tuple]]:
+    """Порціями віддає всіх користувачів для вигрузки (keyset по user_id, як iter_user_id_chunks)"""
+    last_user_id = 0
+    while True:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, user_name, join_date, last_activity, start_param, status, subscription_status
+                FROM users
+                WHERE user_id > ?
+                ORDER BY user_id LIMIT ?
+            ''', (last_user_id, chunk_size))
+            chunk = cursor.fetchall()
+        
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_user_id = chunk[-1][0]
+
+
+def compile_audience_filter(statuses: List[str] = None, start_params: List[str] = None,
+                            subscription_statuses: List[str] = None,
+                            joined_from: str = None, joined_to: str = None,
+                            active_from: str = None, active_to: str = None) -> Tuple[str, tuple]:
+    """Збирає фільтри аудиторії в одну параметризовану умову WHERE для users_data.
+    Статуси та підписка перетворюються на коди (статуси - через user_statuses),
+    дати - 'YYYY-MM-DD' (включно) - на діапазон join_ts/activity_ts, щоб працювали індекси.
+    Повертає (where, params); порожній where - всі користувачі
+    """
+    conditions = []
+    params = []
+    
+    for column, values, codes in (("stage", statuses, None),
+                                  ("start_param", start_params, None),
+                                  ("subscribed", subscription_statuses, SUBSCRIPTION_CODES)):
+        values = [value for value in (values or []) if value]
+        if codes is not None and values:
+            # Невідомий статус, як і раніше, не відбирає нікого
+            values = [codes[value] for value in values if value in codes] or [None]
+        if not values:
+            continue
+        placeholders = ', '.join('?' * len(values))
+        if column == "stage":
+            conditions.append(f"stage IN (SELECT code FROM user_statuses WHERE name IN ({placeholders}))")
+        else:
+            conditions.append(f"{column} IN ({placeholders})")
+        params.extend(values)
+    
+    for column, date_from, date_to in (("join_ts", joined_from, joined_to),
+                                       ("activity_ts", active_from, active_to)):
+        if date_from:
+            conditions.append(f"{column} >= ?")
+            params.append(_to_ts(f"{date_from} 00:00:00"))
+        if date_to:
+            conditions.append(f"{column} <= ?")
+            params.append(_to_ts(f"{date_to} 23:59:59"))
+    
+    return " AND ".join(conditions), tuple(params)
+
+
+def count_users_where(where: str = None, params: tuple = ()) -> int:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT COUNT(*) FROM users_data {"WHERE " + where if where else ""}', params)
+        return cursor.fetchone()[0]
+
+
+def _user_status_code(cursor, status: str) -> int:
+    """Код статусу; для нового статусу додає в user_statuses наступний від'ємний код"""
+    code = USER_STATUS_CODES.get(status)
+    if code is not None:
+        return code
+    
+    cursor.execute('SELECT code FROM user_statuses WHERE name = ?', (status,))
+    row = cursor.fetchone()
+    if row is None:
+        # OR IGNORE - той самий статус міг щойно додати інший процес
+        cursor.execute('''
+            INSERT OR IGNORE INTO user_statuses (code, name)
+            SELECT MIN(MIN(code), 0) - 1, ? FROM user_statuses
+        ''', (status,))
+        cursor.execute('SELECT code FROM user_statuses WHERE name = ?', (status,))
+        row = cursor.fetchone()
+    return row[0]
+
+
 def update_user_status(user_id: int, status: str) -> bool:
     with get_connection() as conn:
         cursor = conn.cursor()
+        stage = _user_status_code(cursor, status)
         cursor.execute('''
-            UPDATE users 
-            SET status = ?, last_activity = CURRENT_TIMESTAMP
+            UPDATE users_data 
+            SET stage = ?, activity_ts = ?
             WHERE user_id = ?
-        ''', (status, user_id))
+        ''', (stage, _now_ts(), user_id))
         conn.commit()
         return cursor.rowcount > 0
 
@@ -212,72 +272,114 @@ def get_user_status(user_id: int) -> Optional[str]:
 
 
 
+# Коди етапів воронки (users.stage, user_events.stage). Статуси 1-11 збігаються з номерами етапів у панелі
+STAGE_JOIN = 0
+FUNNEL_STAGES = {
+    'Нажал старт': 1,
+    'Прошел капчу': 2,
+    'Посмотрел ответы': 3,
+    'Посмотрел приватный урок': 4,
+    'Посмотрел тарифы': 5,
+    'Посмотрел тарифы одежда': 6,
+    'Посмотрел тарифы техника': 7,
+    'Нажал оплатить техника': 8,
+    'Нажал оплатить одежда': 9,
+    'Оплатил одежду': 10,
+    'Оплатил технику': 11,
+    '✅Подписан': 20,
+    '❌Не подписан': 21,
+}
+FUNNEL_STAGE_NAMES = {code: name for name, code in FUNNEL_STAGES.items()}
+STATUS_STAGE_CODES = frozenset(range(1, 12))
+
+# Коди в users_data: статус - це етап (0 - ще не пройшов жодного), підписка - 0/1.
+# Інші статуси (адмін може задати будь-який) отримують у user_statuses від'ємні коди -
+# нижче за всі етапи, тож дії користувача, як і раніше, переводять його далі по воронці
+USER_STATUS_CODES = {'active': 0, **{name: code for name, code in FUNNEL_STAGES.items() if code in STATUS_STAGE_CODES}}
+SUBSCRIPTION_CODES = {'❌Не подписан': 0, '✅Подписан': 1}
+
+STATUS_MAPPING = {
+    "start": "Нажал старт",
+    "captcha_passed": "Прошел капчу",
+    "answers_viewed": "Посмотрел ответы", 
+    "private_lesson_viewed": "Посмотрел приватный урок",
+    "tariffs_viewed": "Посмотрел тарифы",
+    "clothes_tariff_viewed": "Посмотрел тарифы одежда",
+    "tech_tariff_viewed": "Посмотрел тарифы техника",
+    "tech_payment_clicked": "Нажал оплатить техника",
+    "clothes_payment_clicked": "Нажал оплатить одежда"
+}
+
+# Пріоритет дії - код етапу її статусу: етап користувача не може знизитись
+STATUS_PRIORITY = {action: FUNNEL_STAGES[status] for action, status in STATUS_MAPPING.items()}
+
+
 def update_user_status_by_action(user_id: int, action: str) -> bool:
-    status_priority = {
-        "start": 1,
-        "captcha_passed": 2,
-        "answers_viewed": 3, 
-        "private_lesson_viewed": 4,
-        "tariffs_viewed": 5,
-        "clothes_tariff_viewed": 6,
-        "tech_tariff_viewed": 7,
-        "tech_payment_clicked": 8,
-        "clothes_payment_clicked": 9
-    }
-    
-    status_mapping = {
-        "start": "Нажал старт",
-        "captcha_passed": "Прошел капчу",
-        "answers_viewed": "Посмотрел ответы", 
-        "private_lesson_viewed": "Посмотрел приватный урок",
-        "tariffs_viewed": "Посмотрел тарифы",
-        "clothes_tariff_viewed": "Посмотрел тарифы одежда",
-        "tech_tariff_viewed": "Посмотрел тарифы техника",
-        "tech_payment_clicked": "Нажал оплатить техника",
-        "clothes_payment_clicked": "Нажал оплатить одежда"
-    }
-    
-    new_status = status_mapping.get(action)
+    """Переводить користувача на етап дії одним UPDATE: умова stage <= ? в тому ж
+    запиті гарантує, що етап не знизиться навіть при паралельних callback'ах
+    """
+    new_status = STATUS_MAPPING.get(action)
     if not new_status:
         return False
     
-    current_status = get_user_status(user_id)
-    if not current_status:
-        return update_user_status(user_id, new_status)
-    
-    current_priority = 0
-    for action_key, priority in status_priority.items():
-        if status_mapping[action_key] == current_status:
-            current_priority = priority
-            break
-    
-    new_priority = status_priority.get(action, 0)
-    
-    if new_priority >= current_priority:
-        return update_user_status(user_id, new_status)
+    stage = STATUS_PRIORITY[action]
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE users_data 
+            SET stage = ?, activity_ts = ?
+            WHERE user_id = ? AND stage <= ?
+        ''', (stage, _now_ts(), user_id, stage))
+        conn.commit()
+        if cursor.rowcount > 0:
+            return True
     
-    print(f"⚠️ Не можна змінити статус з '{current_status}' (пріоритет {current_priority}) на '{new_status}' (пріоритет {new_priority})")
+    print(f"⚠️ Не можна змінити етап користувача {user_id} на '{new_status}' (етап {stage}): поточний етап вищий або користувача немає")
     return False
 
 
-def admin_update_user_status(user_id: int, new_status: str) -> bool:
+def apply_user_updates(activity: List[Tuple[int, str]] = (), statuses: List[Tuple[int, str, str]] = (),
+                       subscriptions: List[Tuple[int, str, str]] = ()) -> None:
+    """Записує накопичені оновлення користувачів однією транзакцією.
+    activity - (user_id, last_activity), statuses - (user_id, action, last_activity),
+    subscriptions - (user_id, subscription_status, last_activity)
+    """
+    # Час з черги може бути старішим за вже записаний - активність не повертається назад
+    activity_sql = 'activity_ts = MAX(COALESCE(activity_ts, 0), ?)'
+    
     with get_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE users 
-            SET status = ?, last_activity = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-        ''', (new_status, user_id))
+        
+        cursor.executemany(f'''
+            UPDATE users_data SET {activity_sql} WHERE user_id = ?
+        ''', [(_to_ts(last_activity), user_id) for user_id, last_activity in activity])
+        
+        # Статус змінюється тільки якщо новий етап не нижчий за поточний
+        cursor.executemany(f'''
+            UPDATE users_data SET stage = ?, {activity_sql}
+            WHERE user_id = ? AND stage <= ?
+        ''', [(STATUS_PRIORITY[action], _to_ts(last_activity), user_id, STATUS_PRIORITY[action])
+              for user_id, action, last_activity in statuses if action in STATUS_MAPPING])
+        
+        cursor.executemany(f'''
+            UPDATE users_data SET subscribed = ?, {activity_sql} WHERE user_id = ?
+        ''', [(SUBSCRIPTION_CODES[subscription_status], _to_ts(last_activity), user_id)
+              for user_id, subscription_status, last_activity in subscriptions
+              if subscription_status in SUBSCRIPTION_CODES])
+        
         conn.commit()
-        return cursor.rowcount > 0
+
+
+def admin_update_user_status(user_id: int, new_status: str) -> bool:
+    # Адмін може перевести користувача на будь-який етап, у тому числі нижчий
+    return update_user_status(user_id, new_status)
 
 
 def get_users_with_statuses(page: int = 1, per_page: int = 20) -> tuple:
     with get_connection() as conn:
         cursor = conn.cursor()
         
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
+        total_users = get_users_count()
         
         total_pages = (total_users + per_page - 1) // per_page
         
@@ -285,7 +387,7 @@ def get_users_with_statuses(page: int = 1, per_page: int = 20) -> tuple:
         cursor.execute('''
             SELECT user_id, user_name, join_date, last_activity, start_param, status, subscription_status
             FROM users 
-            ORDER BY last_activity DESC 
+            ORDER BY activity_ts DESC 
             LIMIT ? OFFSET ?
         ''', (per_page, offset))
         
@@ -293,14 +395,79 @@ def get_users_with_statuses(page: int = 1, per_page: int = 20) -> tuple:
         return users, total_users, total_pages, page, per_page
 
 
+def get_users_page(limit: int = 100, cursor: Optional[str] = None, status: Optional[str] = None,
+                   subscription_status: Optional[str] = None, start_param: Optional[str] = None,
+                   search: Optional[str] = None) -> Tuple[List[Tuple], Optional[str]]:
+    """Сторінка користувачів за last_activity DESC з keyset-пагінацією.
+
+    cursor - значення з попередньої сторінки ('activity_ts|user_id'), тож
+    будь-яка сторінка читається з індексу (USERS_PAGE_ORDER) без OFFSET.
+    search - user_id (лише цифри) або префікс username.
+    Повертає (рядки, cursor наступної сторінки або None).
+    ValueError - якщо cursor пошкоджений.
+    """
+    conditions, params = [], []
+    if status:
+        conditions.append('stage = (SELECT code FROM user_statuses WHERE name = ?)')
+        params.append(status)
+    for column, value, codes in (('subscribed', subscription_status, SUBSCRIPTION_CODES),
+                                 ('start_param', start_param, None)):
+        if value:
+            conditions.append(f'{column} = ?')
+            params.append(value if codes is None else codes.get(value))
+
+    if search:
+        search = search.strip().lstrip('@')
+        if search.isdigit():
+            conditions.append('user_id = ?')
+            params.append(int(search))
+        elif search:
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("user_name LIKE ? ESCAPE '\\'")
+            params.append(escaped + '%')
+
+    if cursor:
+        activity_ts, separator, user_id = cursor.partition('|')
+        if not (separator and activity_ts.isdigit() and user_id.isdigit()):
+            raise ValueError(f"Некоректний cursor: {cursor!r}")
+        # Те саме, що (COALESCE(activity_ts, 0), user_id) < (?, ?), але з row value
+        # на виразі SQLite не бере діапазон по індексу - перша умова дає діапазон
+        conditions.append('COALESCE(activity_ts, 0) <= ? AND (COALESCE(activity_ts, 0) < ? OR user_id < ?)')
+        params.extend([int(activity_ts), int(activity_ts), int(user_id)])
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f'''
+            SELECT user_id, user_name, join_date, last_activity, start_param, status, subscription_status,
+                   COALESCE(activity_ts, 0)
+            FROM users
+            {where}
+            ORDER BY COALESCE(activity_ts, 0) DESC, user_id DESC
+            LIMIT ?
+        ''', (*params, limit + 1))
+        rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1][7]}|{rows[-1][0]}"
+    return [row[:7] for row in rows], next_cursor
+
+
 def update_subscription_status(user_id: int, subscription_status: str) -> bool:
+    subscribed = SUBSCRIPTION_CODES.get(subscription_status)
+    if subscribed is None:
+        print(f"❌ Невідомий статус підписки: {subscription_status}")
+        return False
+    
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            UPDATE users 
-            SET subscription_status = ?, last_activity = CURRENT_TIMESTAMP
+            UPDATE users_data 
+            SET subscribed = ?, activity_ts = ?
             WHERE user_id = ?
-        ''', (subscription_status, user_id))
+        ''', (subscribed, _now_ts(), user_id))
         conn.commit()
         return cursor.rowcount > 0
 
@@ -317,8 +484,7 @@ def get_users_with_subscription_statuses(page: int = 1, per_page: int = 20) -> t
     with get_connection() as conn:
         cursor = conn.cursor()
         
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
+        total_users = get_users_count()
         
         total_pages = (total_users + per_page - 1) // per_page
         
@@ -326,7 +492,7 @@ def get_users_with_subscription_statuses(page: int = 1, per_page: int = 20) -> t
         cursor.execute('''
             SELECT user_id, user_name, join_date, last_activity, start_param, status, subscription_status
             FROM users 
-            ORDER BY last_activity DESC 
+            ORDER BY activity_ts DESC 
             LIMIT ? OFFSET ?
         ''', (per_page, offset))
         
@@ -335,27 +501,14 @@ def get_users_with_subscription_statuses(page: int = 1, per_page: int = 20) -> t
 
 
 def get_subscription_stats() -> dict:
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT subscription_status, COUNT(*) as count
-            FROM users 
-            GROUP BY subscription_status
-        ''')
-        
-        stats = {}
-        for row in cursor.fetchall():
-            status, count = row
-            stats[status] = count
-        
-        return stats
+    return get_user_counters('subscription_status')
 
 
 def admin_delete_user(user_id: int) -> bool:
     try:
         with get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+            cursor.execute('DELETE FROM users_data WHERE user_id = ?', (user_id,))
             conn.commit()
             return cursor.rowcount > 0
     except Exception as e:
@@ -363,6 +516,26 @@ def admin_delete_user(user_id: int) -> bool:
         return False
 
 
+# =========================
+# User counters
+# =========================
+
+def get_user_counter(kind: str, key: str = '') -> int:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT cnt FROM user_counters WHERE kind = ? AND key = ?', (kind, key))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+
+def get_user_counters(kind: str) -> dict:
+    """Розбивка {значення: кількість}; користувачі без значення - під ключем None"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT key, cnt FROM user_counters WHERE kind = ? AND cnt > 0', (kind,))
+        return {key if key != '' else None: cnt for key, cnt in cursor.fetchall()}
+
+
 # =========================
 # Analytics helpers
 # =========================
@@ -392,220 +565,68 @@ def _normalize_date_range(start_date: Optional[str], end_date: Optional[str]) ->
     return (start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
 
 
-def get_analytics_counts(start_date: Optional[str] = None, end_date: Optional[str] = None, param: Optional[str] = None) -> dict:
-    """Return total counts: joined via links, moved to payment, paid within date range.
-    - joined: users with start_param not null, filtered by join_date
-    - to_payment: users whose current status is one of payment-clicked, filtered by last_activity
-    - paid: users whose current status is one of paid, filtered by last_activity
-    Optionally filter by specific start_param.
-    """
-    start_iso, end_iso = _normalize_date_range(start_date, end_date)
-
-    params: List = [start_iso, end_iso]
-    param_clause = ""
-    if param:
-        param_clause = " AND start_param = ?"
-        params.append(param)
-
-    with get_connection() as conn:
-        cursor = conn.cursor()
-
-        # Joined via links (start_param present) within join_date window
-        cursor.execute(
-            f"""
-            SELECT COUNT(*)
-            FROM users
-            WHERE start_param IS NOT NULL
-              AND date(join_date) BETWEEN date(?) AND date(?)
-              {param_clause}
-            """,
-            tuple(params)
-        )
-        joined_count = cursor.fetchone()[0]
-
-        # Moved to payment stage
-        pay_params: List = [start_iso, end_iso]
-        pay_clause = ""
-        if param:
-            pay_clause = " AND start_param = ?"
-            pay_params.append(param)
-        cursor.execute(
-            f"""
-            SELECT COUNT(*)
-            FROM users
-            WHERE status IN ('Нажал оплатить техника','Нажал оплатить одежда')
-              AND date(last_activity) BETWEEN date(?) AND date(?)
-              {pay_clause}
-            """,
-            tuple(pay_params)
-        )
-        to_payment_count = cursor.fetchone()[0]
-
-        # Paid
-        paid_params: List = [start_iso, end_iso]
-        paid_clause = ""
-        if param:
-            paid_clause = " AND start_param = ?"
-            paid_params.append(param)
-        cursor.execute(
-            f"""
-            SELECT COUNT(*)
-            FROM users
-            WHERE status IN ('Оплатил одежду','Оплатил технику')
-              AND date(last_activity) BETWEEN date(?) AND date(?)
-              {paid_clause}
-            """,
-            tuple(paid_params)
-        )
-        paid_count = cursor.fetchone()[0]
-
-        return {
-            "joined": joined_count,
-            "to_payment": to_payment_count,
-            "paid": paid_count,
-            "start_date": start_iso,
-            "end_date": end_iso,
-            "param": param or None
-        }
-
+PAYMENT_STATUSES = ('Нажал оплатить техника', 'Нажал оплатить одежда')
+PAID_STATUSES = ('Оплатил одежду', 'Оплатил технику')
 
-def get_analytics_timeseries(start_date: Optional[str] = None, end_date: Optional[str] = None, param: Optional[str] = None) -> List[Tuple[str, int, int, int]]:
-    """Return daily series: (day, joined, to_payment, paid) for each date in range.
-    If no data for a day, include zero row.
-    """
-    start_iso, end_iso = _normalize_date_range(start_date, end_date)
 
-    with get_connection() as conn:
-        cursor = conn.cursor()
+def get_analytics_all(start_date: Optional[str] = None, end_date: Optional[str] = None, param: Optional[str] = None) -> dict:
+    """Counts, daily series and both distributions from the user_funnel_daily rollup.
 
-        # Joined per day
-        join_params: List = [start_iso, end_iso]
-        join_clause = ""
-        if param:
-            join_clause = " AND start_param = ?"
-            join_params.append(param)
-        cursor.execute(
-            f"""
-            SELECT date(join_date) AS day, COUNT(*)
-            FROM users
-            WHERE start_param IS NOT NULL
-              AND date(join_date) BETWEEN date(?) AND date(?)
-              {join_clause}
-            GROUP BY day
-            ORDER BY day
-            """,
-            tuple(join_params)
-        )
-        join_rows = {row[0]: row[1] for row in cursor.fetchall()}
-
-        # Payment clicks per day
-        pay_params: List = [start_iso, end_iso]
-        pay_clause = ""
-        if param:
-            pay_clause = " AND start_param = ?"
-            pay_params.append(param)
-        cursor.execute(
-            f"""
-            SELECT date(last_activity) AS day, COUNT(*)
-            FROM users
-            WHERE status IN ('Нажал оплатить техника','Нажал оплатить одежда')
-              AND date(last_activity) BETWEEN date(?) AND date(?)
-              {pay_clause}
-            GROUP BY day
-            ORDER BY day
-            """,
-            tuple(pay_params)
-        )
-        pay_rows = {row[0]: row[1] for row in cursor.fetchall()}
-
-        # Paid per day
-        paid_params: List = [start_iso, end_iso]
-        paid_clause = ""
-        if param:
-            paid_clause = " AND start_param = ?"
-            paid_params.append(param)
-        cursor.execute(
-            f"""
-            SELECT date(last_activity) AS day, COUNT(*)
-            FROM users
-            WHERE status IN ('Оплатил одежду','Оплатил технику')
-              AND date(last_activity) BETWEEN date(?) AND date(?)
-              {paid_clause}
-            GROUP BY day
-            ORDER BY day
-            """,
-            tuple(paid_params)
-        )
-        paid_rows = {row[0]: row[1] for row in cursor.fetchall()}
-
-        # Build complete range
-        from datetime import datetime, timedelta
-        start_dt = datetime.strptime(start_iso, "%Y-%m-%d")
-        end_dt = datetime.strptime(end_iso, "%Y-%m-%d")
-        days: List[Tuple[str, int, int, int]] = []
-        current = start_dt
-        while current <= end_dt:
-            day_str = current.strftime("%Y-%m-%d")
-            days.append((day_str, join_rows.get(day_str, 0), pay_rows.get(day_str, 0), paid_rows.get(day_str, 0)))
-            current += timedelta(days=1)
-
-        return days
-
-
-def get_param_distribution(start_date: Optional[str] = None, end_date: Optional[str] = None, param: Optional[str] = None) -> List[Tuple[str, int]]:
-    """Return (param_name, count) of users joined in date range grouped by start_param.
-    Only includes users who actually joined via a param in the range.
-    Optionally filter by specific start_param.
+    Every number is the count of stage events (join, status reached) on the day
+    they happened, so the cost depends on the number of days in the range, not
+    on the number of users. The param filter applies to everything except
+    param_dist, which always covers all params.
     """
     start_iso, end_iso = _normalize_date_range(start_date, end_date)
 
     with get_connection() as conn:
         cursor = conn.cursor()
-        params: List = [start_iso, end_iso]
-        param_clause = ""
-        if param:
-            param_clause = " AND start_param = ?"
-            params.append(param)
-        
         cursor.execute(
-            f"""
-            SELECT start_param, COUNT(*) as cnt
-            FROM users
-            WHERE start_param IS NOT NULL
-              AND date(join_date) BETWEEN date(?) AND date(?)
-              {param_clause}
-            GROUP BY start_param
-            ORDER BY cnt DESC
+            """
+            SELECT day, start_param, stage, cnt
+            FROM user_funnel_daily
+            WHERE day BETWEEN ? AND ?
             """,
-            tuple(params)
+            (start_iso, end_iso)
         )
-        return [(row[0], row[1]) for row in cursor.fetchall()]
-
-
-def get_status_distribution(start_date: Optional[str] = None, end_date: Optional[str] = None, param: Optional[str] = None) -> List[Tuple[str, int]]:
-    """Return (status, count) for users filtered by last_activity window and optional start_param.
-    Useful to show funnel stages distribution (Этап (с ID)).
-    """
-    start_iso, end_iso = _normalize_date_range(start_date, end_date)
-
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        params: List = [start_iso, end_iso]
-        param_clause = ""
-        if param:
-            param_clause = " AND start_param = ?"
-            params.append(param)
+        rows = cursor.fetchall()
 
-        cursor.execute(
-            f"""
-            SELECT status, COUNT(*) as cnt
-            FROM users
-            WHERE status IS NOT NULL
-              AND date(last_activity) BETWEEN date(?) AND date(?)
-              {param_clause}
-            GROUP BY status
-            ORDER BY cnt DESC
-            """,
-            tuple(params)
-        )
-        return [(row[0], row[1]) for row in cursor.fetchall()]
\ No newline at end of file
+    from datetime import datetime, timedelta
+    series = {}
+    current = datetime.strptime(start_iso, "%Y-%m-%d")
+    end_dt = datetime.strptime(end_iso, "%Y-%m-%d")
+    while current <= end_dt:
+        series[current.strftime("%Y-%m-%d")] = [0, 0, 0]
+        current += timedelta(days=1)
+
+    counts = {"joined": 0, "to_payment": 0, "paid": 0}
+    param_dist = {}
+    status_dist = {}
+    for day, start_param, stage, cnt in rows:
+        # Вхід без мітки не рахується як "зашли по мітках"
+        if stage == STAGE_JOIN and start_param:
+            param_dist[start_param] = param_dist.get(start_param, 0) + cnt
+        if param and start_param != param:
+            continue
+        if stage == STAGE_JOIN:
+            if start_param:
+                counts["joined"] += cnt
+                series[day][0] += cnt
+            continue
+        status = FUNNEL_STAGE_NAMES.get(stage)
+        if status in PAYMENT_STATUSES:
+            counts["to_payment"] += cnt
+            series[day][1] += cnt
+        elif status in PAID_STATUSES:
+            counts["paid"] += cnt
+            series[day][2] += cnt
+        if stage in STATUS_STAGE_CODES:
+            status_dist[status] = status_dist.get(status, 0) + cnt
+
+    counts.update({"start_date": start_iso, "end_date": end_iso, "param": param or None})
+    return {
+        "counts": counts,
+        "timeseries": [(day, *values) for day, values in series.items()],
+        "param_dist": sorted(param_dist.items(), key=lambda item: item[1], reverse=True),
+        "status_dist": sorted(status_dist.items(), key=lambda item: item[1], reverse=True)
+    }
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+DB_PATH = 'data/data.db'
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024
+
+os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+    # WAL: читачі не блокують записувача і навпаки (бот, веб-панель та cron пишуть в один файл)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    return conn
+
+
+@contextmanager
+def get_connection():
+    """Одне з'єднання на потік замість нового sqlite3.connect на кожен виклик.
+
+    Вкладені виклики отримують те саме з'єднання. Після виходу з зовнішнього
+    блоку незакомічена транзакція відкочується - як раніше при conn.close().
+    """
+    conn = getattr(_local, 'conn', None)
+    # Після fork (gunicorn) з'єднання батьківського процесу використовувати не можна
+    if conn is None or _local.pid != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.depth = 0
+
+    _local.depth += 1
+    try:
+        yield conn
+    finally:
+        _local.depth -= 1
+        if _local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+
+def close_connection() -> None:
+    """Закриває з'єднання поточного потоку (наприклад, при зупинці процесу)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
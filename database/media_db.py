@@ -0,0 +1,173 @@
+import hashlib
+from datetime import datetime
+from typing import Optional
+from database.db import get_connection
+
+
+def make_media_cache_key(bot_id: int, media_type: str, url: str) -> str:
+    return hashlib.sha256(f"{bot_id}:{media_type}:{url}".encode('utf-8')).hexdigest()
+
+
+def get_media_cache(cache_key: str) -> Optional[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT file_id, file_unique_id, file_size, last_verified
+            FROM media_cache
+            WHERE cache_key = ?
+        ''', (cache_key,))
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+    return {
+        'file_id': row[0],
+        'file_unique_id': row[1],
+        'file_size': row[2],
+        'last_verified': row[3]
+    }
+
+
+def save_media_cache(cache_key: str, bot_id: int, media_type: str, url: str, file_id: str,
+                     file_unique_id: str = None, file_size: int = None) -> None:
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO media_cache (cache_key, bot_id, media_type, url, file_id, file_unique_id,
+                                     file_size, last_verified, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET
+                file_id = excluded.file_id,
+                file_unique_id = excluded.file_unique_id,
+                file_size = excluded.file_size,
+                last_verified = excluded.last_verified
+        ''', (cache_key, bot_id, media_type, url, file_id, file_unique_id, file_size,
+              current_time, current_time))
+        conn.commit()
+
+
+def touch_media_cache(cache_key: str) -> None:
+    """Оновлює last_verified після успішної відправки за file_id"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE media_cache SET last_verified = ? WHERE cache_key = ?',
+                       (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), cache_key))
+        conn.commit()
+
+
+def delete_media_cache(cache_key: str) -> None:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM media_cache WHERE cache_key = ?', (cache_key,))
+        conn.commit()
+
+
+def get_media_cache_stats() -> dict:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT media_type, COUNT(*) FROM media_cache GROUP BY media_type')
+        by_type = dict(cursor.fetchall())
+    return {
+        'total_cached': sum(by_type.values()),
+        'by_type': by_type
+    }
+
+
+def _media_job_to_dict(row) -> dict:
+    return {
+        'id': row[0],
+        'media_type': row[1],
+        'url': row[2],
+        'status': row[3],
+        'file_id': row[4],
+        'error': row[5],
+        'created_at': row[6],
+        'started_at': row[7],
+        'finished_at': row[8]
+    }
+
+
+def enqueue_media_job(media_type: str, url: str) -> int:
+    """Ставить медіа в чергу на завантаження. Якщо цей URL уже чекає
+    або завантажується - повертає існуючу задачу."""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT id FROM media_jobs
+            WHERE url = ? AND media_type = ? AND status IN ('queued', 'running')
+            ORDER BY id DESC LIMIT 1
+        ''', (url, media_type))
+        existing = cursor.fetchone()
+        if existing:
+            return existing[0]
+
+        cursor.execute('''
+            INSERT INTO media_jobs (media_type, url, status) VALUES (?, ?, 'queued')
+        ''', (media_type, url))
+        job_id = cursor.lastrowid
+        conn.commit()
+        return job_id
+
+
+def claim_next_media_job() -> Optional[dict]:
+    """Забирає найстарішу задачу з черги і переводить її в 'running'"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+
+        while True:
+            cursor.execute('''
+                SELECT id FROM media_jobs
+                WHERE status = 'queued'
+                ORDER BY id LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            if not row:
+                return None
+
+            cursor.execute('''
+                UPDATE media_jobs
+                SET status = 'running', started_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'queued'
+            ''', (row[0],))
+            conn.commit()
+
+            if cursor.rowcount > 0:
+                return get_media_job(row[0])
+
+
+def finish_media_job(job_id: int, status: str, file_id: str = None, error: str = None) -> bool:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE media_jobs
+            SET status = ?, file_id = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (status, file_id, error, job_id))
+        conn.commit()
+        return cursor.rowcount > 0
+
+
+def requeue_interrupted_media_jobs() -> int:
+    """Повертає в чергу задачі, які виконувались під час падіння воркера"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE media_jobs
+            SET status = 'queued', started_at = NULL
+            WHERE status = 'running'
+        ''')
+        conn.commit()
+        return cursor.rowcount
+
+
+def get_media_job(job_id: int) -> Optional[dict]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, media_type, url, status, file_id, error, created_at, started_at, finished_at
+            FROM media_jobs WHERE id = ?
+        ''', (job_id,))
+        row = cursor.fetchone()
+        return _media_job_to_dict(row) if row else None
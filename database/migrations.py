@@ -0,0 +1,859 @@
+"""Версіонована схема БД.
+
+Кожен крок міграції має номер і застосовується один раз; застосовані версії
+записуються в schema_version. На старті бот, веб-панель і cron-демон роблять
+одну перевірку версії і нічого не змінюють, якщо схема актуальна.
+
+Якщо схема застаріла, процес бере ексклюзивне блокування файлу поруч з БД
+(data/migrations.lock) і вже під ним перечитує версію: кроки виконує лише
+перший процес, решта чекає і бачить актуальну схему.
+
+Запуск вручну (наприклад, перед оновленням, поки процеси зупинені):
+    python -m database.migrations            # застосувати нові кроки
+    python -m database.migrations --status   # показати поточну версію
+"""
+import argparse
+import os
+import sqlite3
+from contextlib import contextmanager
+
+from werkzeug.security import generate_password_hash
+
+from database.db import DB_PATH, get_connection
+
+
+# Кожен крок містить власний DDL, зафіксований на момент появи кроку: зміна
+# create-запитів чи констант у модулях не змінює історію міграцій.
+# Нова зміна схеми - це новий крок у кінці MIGRATIONS.
+
+
+def _add_missing_columns(conn, table: str, columns) -> None:
+    """Додає колонки, яких немає в таблиці, створеній до появи цих колонок"""
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    for name, definition in columns:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+
+def _settings_version_triggers(conn, table: str) -> None:
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE settings_version SET version = version + 1 WHERE id = 1;
+            END
+        """)
+
+
+_BASELINE_SETTINGS = {
+    'start_message': 'Привет! Добро пожаловать в наш магазин!',
+    'start_media_type': 'none',
+    'start_media_url': '',
+    'start_inline_buttons': '[]',
+    'start_inline_buttons_position': 'below',
+    'start_answers_button_text': '💡 Ответы',
+    'start_our_chat_button_text': '🎓 Приватный урок',
+    'start_shop_button_text': '💰 Тарифы',
+    'our_chat_message': 'Присоединяйтесь к нашему чату!',
+    'our_chat_media_type': 'none',
+    'our_chat_media_url': '',
+    'our_chat_subscription_button_text': '📢 Подписка',
+    'our_chat_subscription_channel_url': 'https://t.me/your_channel',
+    'our_chat_check_subscription_button_text': '✅ Проверить подписку',
+    'shop_message': 'Добро пожаловать в наш магазин! Выберите категорию товаров.',
+    'shop_media_type': 'none',
+    'shop_media_url': '',
+    'channel_join_message': 'Добро пожаловать в наш канал! Рады видеть вас!',
+    'channel_join_media_type': 'none',
+    'channel_join_media_url': '',
+    'channel_leave_message': 'Жаль, что вы покинули наш канал! Надеемся увидеть вас снова!',
+    'channel_leave_media_type': 'none',
+    'channel_leave_media_url': '',
+    'channel_leave_inline_buttons': '[]',
+    'channel_leave_leave_button_text': 'Уйти',
+    'channel_leave_leave_message': 'Вы уверены, что хотите уйти?',
+    'channel_leave_leave_media_type': 'none',
+    'channel_leave_leave_media_url': '',
+    'channel_leave_leave_inline_buttons': '[]',
+    'channel_leave_return_button_text': 'Возвращаюсь',
+    'channel_leave_return_url': 'https://t.me/your_channel',
+    'captcha_message': 'Я не робот',
+    'captcha_media_type': 'none',
+    'captcha_media_url': '',
+    'captcha_button_text': 'Я не робот',
+    'answers_message': 'Ответы на часто задаваемые вопросы',
+    'answers_media_type': 'none',
+    'answers_media_url': '',
+    'answers_inline_buttons': '[]',
+    'private_lesson_message': 'Добро пожаловать на приватный урок!',
+    'private_lesson_media_type': 'none',
+    'private_lesson_media_url': '',
+    'private_lesson_inline_buttons': '[]',
+    'tariffs_message': 'Наши тарифы и цены',
+    'tariffs_media_type': 'none',
+    'tariffs_media_url': '',
+    'tariffs_inline_buttons': '[]'
+}
+
+
+
+def _baseline():
+    """Схема, яку раніше створювали create_* функції при кожному старті.
+
+    Таблиці з БД, створених до міграцій, могли не мати пізніших колонок -
+    їх додає _add_missing_columns.
+    """
+    with get_connection() as conn:
+        # Налаштування бота та версія налаштувань для кешу процесів
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS bot_settings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                setting_key TEXT UNIQUE NOT NULL,
+                setting_value TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.executemany('INSERT OR IGNORE INTO bot_settings (setting_key, setting_value) VALUES (?, ?)',
+                         list(_BASELINE_SETTINGS.items()))
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS settings_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute('INSERT OR IGNORE INTO settings_version (id, version) VALUES (1, 0)')
+        _settings_version_triggers(conn, 'bot_settings')
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS start_links (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                start_param TEXT UNIQUE NOT NULL,
+                message_text TEXT NOT NULL,
+                media_type TEXT DEFAULT 'none',
+                media_url TEXT,
+                inline_buttons TEXT DEFAULT '[]',
+                is_active BOOLEAN DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS channel_invite_links (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                invite_link TEXT UNIQUE NOT NULL,
+                channel_name TEXT NOT NULL,
+                message_text TEXT NOT NULL,
+                media_type TEXT DEFAULT 'none',
+                media_url TEXT,
+                is_active BOOLEAN DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        _add_missing_columns(conn, 'channel_invite_links', [
+            ('captcha_message', "TEXT DEFAULT 'Я не робот'"),
+            ('captcha_media_type', "TEXT DEFAULT 'none'"),
+            ('captcha_media_url', "TEXT DEFAULT ''"),
+            ('captcha_button_text', "TEXT DEFAULT 'Я не робот'"),
+        ])
+
+        # Користувачі
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER UNIQUE NOT NULL,
+                user_name TEXT,
+                join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        _add_missing_columns(conn, 'users', [
+            ('start_param', 'TEXT'),
+            ('status', "TEXT DEFAULT 'active'"),
+            ('subscription_status', "TEXT DEFAULT '❌Не подписан'"),
+        ])
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_status ON users (status, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_start_param ON users (start_param, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_subscription_status ON users (subscription_status, user_id)')
+
+        # Розсилки
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS mailings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                message_text TEXT NOT NULL,
+                media_type TEXT DEFAULT 'none',
+                media_url TEXT,
+                inline_buttons TEXT,
+                is_active INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP,
+                users_count INTEGER DEFAULT 0
+            )
+        """)
+        _add_missing_columns(conn, 'mailings', [
+            ('scheduled_at', 'TIMESTAMP'),
+            ('is_scheduled', 'INTEGER DEFAULT 0'),
+            ('schedule_repeat', "TEXT DEFAULT 'once'"),
+            ('schedule_days', 'TEXT'),
+            ('status', "TEXT DEFAULT 'draft'"),
+            ('is_recurring', 'INTEGER DEFAULT 0'),
+            ('recurring_days', 'TEXT'),
+            ('recurring_time', 'TEXT'),
+            ('next_scheduled_at', 'TIMESTAMP'),
+            # Фільтри аудиторії (audience_filter - JSON з додатковими умовами)
+            ('user_filter', "TEXT DEFAULT 'all'"),
+            ('user_status', 'TEXT'),
+            ('start_param_filter', 'TEXT'),
+            ('audience_filter', 'TEXT'),
+            # Режим copy_message: шаблон розсилки публікується один раз у службовий чат
+            ('broadcast_mode', "TEXT DEFAULT 'send'"),
+            ('template_chat_id', 'INTEGER'),
+            ('template_message_id', 'INTEGER'),
+        ])
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS recurring_mailings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                mailing_id INTEGER NOT NULL,
+                recurring_days TEXT NOT NULL,
+                recurring_time TEXT NOT NULL,
+                next_scheduled_at TIMESTAMP,
+                is_active INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (mailing_id) REFERENCES mailings (id) ON DELETE CASCADE
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_recurring_mailing_id ON recurring_mailings (mailing_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_recurring_next_scheduled ON recurring_mailings (next_scheduled_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_recurring_active ON recurring_mailings (is_active)')
+        # Черга відправки: один рядок на отримувача
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS mailing_deliveries (
+                mailing_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                updated_at TIMESTAMP,
+                PRIMARY KEY (mailing_id, user_id)
+            ) WITHOUT ROWID
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_mailing_deliveries_status '
+                     'ON mailing_deliveries (mailing_id, status, user_id)')
+        # Запуски розсилок для cron_daemon.py
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS mailing_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                mailing_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_mailing_jobs_status ON mailing_jobs (status, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_mailing_jobs_mailing ON mailing_jobs (mailing_id, id)')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS mailing_progress (
+                mailing_id INTEGER PRIMARY KEY,
+                total INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                rate REAL NOT NULL DEFAULT 0,
+                started_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS admin_credentials (
+                id INTEGER PRIMARY KEY,
+                username TEXT NOT NULL,
+                password_hash TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        if not conn.execute('SELECT 1 FROM admin_credentials LIMIT 1').fetchone():
+            conn.execute("INSERT INTO admin_credentials (id, username, password_hash) VALUES (1, 'Woldemar', ?)",
+                         (generate_password_hash('SamaraBoy777', method='pbkdf2:sha256'),))
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS start_params (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                param_name TEXT UNIQUE NOT NULL,
+                description TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            )
+        """)
+
+        # Медіа: file_id у Telegram прив'язаний до бота, тому бот входить у ключ
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS media_cache (
+                cache_key TEXT PRIMARY KEY,
+                bot_id INTEGER NOT NULL,
+                media_type TEXT NOT NULL,
+                url TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT,
+                file_size INTEGER,
+                last_verified TEXT,
+                created_at TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS media_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                media_type TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                file_id TEXT,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_media_jobs_status ON media_jobs (status, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_media_jobs_url ON media_jobs (url, media_type)')
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS welcome_without_subscription (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_text TEXT NOT NULL,
+                media_type TEXT DEFAULT 'none',
+                media_url TEXT,
+                channel_url TEXT,
+                channel_id TEXT,
+                channel_button_text TEXT DEFAULT '📢 Подписаться на канал',
+                is_active INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        _add_missing_columns(conn, 'welcome_without_subscription', [
+            ('channel_button_text', "TEXT DEFAULT '📢 Подписаться на канал'"),
+        ])
+        conn.execute("UPDATE welcome_without_subscription SET channel_button_text = '📢 Подписаться на канал' "
+                     "WHERE channel_button_text IS NULL")
+        if not conn.execute('SELECT 1 FROM welcome_without_subscription LIMIT 1').fetchone():
+            conn.execute("""
+                INSERT INTO welcome_without_subscription
+                (message_text, media_type, media_url, channel_url, channel_id, channel_button_text, is_active)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, ('Добро пожаловать! Для доступа к боту необходимо подписаться на наш канал.',
+                  'none', '', 'https://t.me/your_channel', '@your_channel', '📢 Подписаться на канал', 1))
+        _settings_version_triggers(conn, 'welcome_without_subscription')
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS subscription_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_text TEXT NOT NULL,
+                media_type TEXT DEFAULT 'none',
+                media_url TEXT,
+                inline_buttons TEXT DEFAULT '[]',
+                inline_buttons_position TEXT DEFAULT 'below',
+                is_active INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        _add_missing_columns(conn, 'subscription_messages', [
+            ('back_button_text', 'TEXT'),
+            ('main_menu_button_text', 'TEXT'),
+            ('show_back_button', 'INTEGER DEFAULT 0'),
+            ('show_main_menu_button', 'INTEGER DEFAULT 0'),
+        ])
+        _settings_version_triggers(conn, 'subscription_messages')
+
+        conn.commit()
+
+
+def _users_analytics_indexes():
+    """Індекси під запити аналітики: діапазон дат + стартовий параметр або статус"""
+    with get_connection() as conn:
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_join_date ON users (join_date, start_param)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_start_param_join_date ON users (start_param, join_date)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users (last_activity, status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_status_last_activity ON users (status, last_activity)')
+        conn.execute('ANALYZE users')
+        conn.commit()
+
+
+def _users_activity_covering_index():
+    """Покриваючий індекс для get_analytics_all: активність за день у розрізі статусу та параметра"""
+    with get_connection() as conn:
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_activity_status_param '
+                     'ON users (last_activity, status, start_param)')
+        # Префікс нового індексу повністю його замінює
+        conn.execute('DROP INDEX IF EXISTS idx_users_last_activity')
+        conn.execute('ANALYZE users')
+        conn.commit()
+
+
+# Етапи воронки на момент появи журналу: 0 - вхід, 1-11 - статуси, 20/21 - підписка
+_FUNNEL_STAGES = {
+    'Нажал старт': 1,
+    'Прошел капчу': 2,
+    'Посмотрел ответы': 3,
+    'Посмотрел приватный урок': 4,
+    'Посмотрел тарифы': 5,
+    'Посмотрел тарифы одежда': 6,
+    'Посмотрел тарифы техника': 7,
+    'Нажал оплатить техника': 8,
+    'Нажал оплатить одежда': 9,
+    'Оплатил одежду': 10,
+    'Оплатил технику': 11,
+    '✅Подписан': 20,
+    '❌Не подписан': 21,
+}
+
+
+def _user_events_log():
+    """Журнал подій воронки та щоденне зведення для аналітики.
+
+    Початкові події беруться з поточного стану users: вхід, статус і підписка
+    (час статусу - last_activity, точнішої історії немає).
+    """
+    with get_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_events (
+                user_id INTEGER NOT NULL,
+                stage INTEGER NOT NULL,
+                ts TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS funnel_stages (
+                code INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            )
+        """)
+        conn.executemany('INSERT OR REPLACE INTO funnel_stages (code, name) VALUES (?, ?)',
+                         [(code, name) for name, code in _FUNNEL_STAGES.items()])
+        # start_param '' - користувач без мітки (NULL не може бути в ключі WITHOUT ROWID)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_funnel_daily (
+                day TEXT NOT NULL,
+                stage INTEGER NOT NULL,
+                start_param TEXT NOT NULL DEFAULT '',
+                cnt INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, stage, start_param)
+            ) WITHOUT ROWID
+        """)
+
+        if not conn.execute('SELECT 1 FROM user_events LIMIT 1').fetchone():
+            conn.execute("""
+                INSERT INTO user_events (user_id, stage, ts)
+                SELECT user_id, 0, join_date FROM users WHERE join_date IS NOT NULL
+            """)
+            # "Не подписан" - стан за замовчуванням, а не подія
+            conn.execute("""
+                INSERT INTO user_events (user_id, stage, ts)
+                SELECT u.user_id, f.code, u.last_activity
+                FROM users u JOIN funnel_stages f ON f.name = u.status OR f.name = u.subscription_status
+                WHERE u.last_activity IS NOT NULL AND f.name != '❌Не подписан'
+            """)
+            conn.execute("""
+                INSERT INTO user_funnel_daily (day, stage, start_param, cnt)
+                SELECT date(e.ts), e.stage, COALESCE(u.start_param, ''), COUNT(*)
+                FROM user_events e LEFT JOIN users u ON u.user_id = e.user_id
+                GROUP BY 1, 2, 3
+            """)
+        conn.commit()
+
+
+def _rebuild_user_counters(conn) -> None:
+    """Лічильники з view/таблиці users: загальна кількість і розбивка за статусом,
+    підпискою та стартовим параметром"""
+    conn.execute('DELETE FROM user_counters')
+    conn.execute("INSERT INTO user_counters (kind, key, cnt) SELECT 'total', '', COUNT(*) FROM users")
+    for column in ('status', 'subscription_status', 'start_param'):
+        conn.execute(f"""
+            INSERT INTO user_counters (kind, key, cnt)
+            SELECT '{column}', COALESCE({column}, ''), COUNT(*) FROM users GROUP BY 2
+        """)
+
+
+def _user_counters():
+    """Лічильники користувачів, які ведуть тригери"""
+    with get_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        # key '' - NULL у колонці users (NULL не може бути в ключі WITHOUT ROWID)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_counters (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL DEFAULT '',
+                cnt INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (kind, key)
+            ) WITHOUT ROWID
+        """)
+        _rebuild_user_counters(conn)
+        conn.commit()
+
+
+def _users_keyset_indexes():
+    """Індекси для сторінок користувачів: (фільтр, last_activity, user_id) і пошук за username"""
+    with get_connection() as conn:
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_activity_user ON users (last_activity, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_status_activity_user '
+                     'ON users (status, last_activity, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_start_param_activity_user '
+                     'ON users (start_param, last_activity, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_user_name ON users (user_name COLLATE NOCASE)')
+        # Аналітика тепер читає user_funnel_daily, а префікси цих індексів покриті новими
+        conn.execute('DROP INDEX IF EXISTS idx_users_activity_status_param')
+        conn.execute('DROP INDEX IF EXISTS idx_users_status_last_activity')
+        conn.execute('ANALYZE users')
+        conn.commit()
+
+
+def _users_stage_column():
+    """Числовий етап воронки поруч із текстовим статусом (коди статусів 1-11 з _FUNNEL_STAGES)"""
+    with get_connection() as conn:
+        _add_missing_columns(conn, 'users', [('stage', 'INTEGER NOT NULL DEFAULT 0')])
+        conn.executemany('UPDATE users SET stage = ? WHERE status = ? AND stage != ?',
+                         [(code, status, code) for status, code in _FUNNEL_STAGES.items() if code <= 11])
+        conn.commit()
+
+
+# Тригери на users_data, що ведуть user_counters і журнал user_events
+_USERS_DATA_TRIGGERS = {
+    'trg_users_counters_insert': """
+        AFTER INSERT ON users_data
+        BEGIN
+            INSERT INTO user_counters (kind, key, cnt) VALUES ('total', '', 1)
+            ON CONFLICT (kind, key) DO UPDATE SET cnt = cnt + 1;
+            INSERT INTO user_counters (kind, key, cnt)
+            VALUES ('status', COALESCE((SELECT name FROM user_statuses WHERE code = NEW.stage), ''), 1)
+            ON CONFLICT (kind, key) DO UPDATE SET cnt = cnt + 1;
+            INSERT INTO user_counters (kind, key, cnt)
+            VALUES ('subscription_status', COALESCE((SELECT name FROM subscription_statuses WHERE code = NEW.subscribed), ''), 1)
+            ON CONFLICT (kind, key) DO UPDATE SET cnt = cnt + 1;
+            INSERT INTO user_counters (kind, key, cnt) VALUES ('start_param', COALESCE(NEW.start_param, ''), 1)
+            ON CONFLICT (kind, key) DO UPDATE SET cnt = cnt + 1;
+        END""",
+    'trg_users_counters_delete': """
+        AFTER DELETE ON users_data
+        BEGIN
+            UPDATE user_counters SET cnt = cnt - 1 WHERE kind = 'total' AND key = '';
+            UPDATE user_counters SET cnt = cnt - 1
+            WHERE kind = 'status' AND key = COALESCE((SELECT name FROM user_statuses WHERE code = OLD.stage), '');
+            UPDATE user_counters SET cnt = cnt - 1
+            WHERE kind = 'subscription_status' AND key = COALESCE((SELECT name FROM subscription_statuses WHERE code = OLD.subscribed), '');
+            UPDATE user_counters SET cnt = cnt - 1 WHERE kind = 'start_param' AND key = COALESCE(OLD.start_param, '');
+        END""",
+    'trg_users_counters_status': """
+        AFTER UPDATE OF stage ON users_data
+        WHEN NEW.stage IS NOT OLD.stage
+        BEGIN
+            UPDATE user_counters SET cnt = cnt - 1
+            WHERE kind = 'status' AND key = COALESCE((SELECT name FROM user_statuses WHERE code = OLD.stage), '');
+            INSERT INTO user_counters (kind, key, cnt)
+            VALUES ('status', COALESCE((SELECT name FROM user_statuses WHERE code = NEW.stage), ''), 1)
+            ON CONFLICT (kind, key) DO UPDATE SET cnt = cnt + 1;
+        END""",
+    'trg_users_counters_subscription_status': """
+        AFTER UPDATE OF subscribed ON users_data
+        WHEN NEW.subscribed IS NOT OLD.subscribed
+        BEGIN
+            UPDATE user_counters SET cnt = cnt - 1
+            WHERE kind = 'subscription_status' AND key = COALESCE((SELECT name FROM subscription_statuses WHERE code = OLD.subscribed), '');
+            INSERT INTO user_counters (kind, key, cnt)
+            VALUES ('subscription_status', COALESCE((SELECT name FROM subscription_statuses WHERE code = NEW.subscribed), ''), 1)
+            ON CONFLICT (kind, key) DO UPDATE SET cnt = cnt + 1;
+        END""",
+    'trg_users_counters_start_param': """
+        AFTER UPDATE OF start_param ON users_data
+        WHEN NEW.start_param IS NOT OLD.start_param
+        BEGIN
+            UPDATE user_counters SET cnt = cnt - 1 WHERE kind = 'start_param' AND key = COALESCE(OLD.start_param, '');
+            INSERT INTO user_counters (kind, key, cnt) VALUES ('start_param', COALESCE(NEW.start_param, ''), 1)
+            ON CONFLICT (kind, key) DO UPDATE SET cnt = cnt + 1;
+        END""",
+    'trg_users_join_event': """
+        AFTER INSERT ON users_data
+        BEGIN
+            INSERT INTO user_events (user_id, stage, ts)
+            VALUES (NEW.user_id, 0, datetime('now', 'localtime'));
+        END""",
+    # Подія лише при реальній зміні: повторне натискання не дублює етап
+    'trg_users_status_event': """
+        AFTER UPDATE OF stage ON users_data
+        WHEN NEW.stage != OLD.stage AND NEW.stage BETWEEN 1 AND 11
+        BEGIN
+            INSERT INTO user_events (user_id, stage, ts)
+            VALUES (NEW.user_id, NEW.stage, datetime('now', 'localtime'));
+        END""",
+    'trg_users_subscription_status_event': """
+        AFTER UPDATE OF subscribed ON users_data
+        WHEN NEW.subscribed != OLD.subscribed
+        BEGIN
+            INSERT INTO user_events (user_id, stage, ts)
+            VALUES (NEW.user_id, CASE NEW.subscribed WHEN 1 THEN 20 ELSE 21 END, datetime('now', 'localtime'));
+        END""",
+    'trg_user_events_rollup': """
+        AFTER INSERT ON user_events
+        BEGIN
+            INSERT INTO user_funnel_daily (day, stage, start_param, cnt)
+            VALUES (date(NEW.ts), NEW.stage,
+                    COALESCE((SELECT start_param FROM users_data WHERE user_id = NEW.user_id), ''), 1)
+            ON CONFLICT (day, stage, start_param) DO UPDATE SET cnt = cnt + 1;
+        END""",
+}
+
+
+def _compact_users():
+    """users -> users_data з user_id як rowid, кодами статусів і цілими мітками часу.
+
+    На місці старої таблиці лишається view users з тими ж колонками, тож читачі
+    працюють без змін, а запис іде в users_data.
+    """
+    with get_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users_data (
+                user_id INTEGER PRIMARY KEY,
+                user_name TEXT,
+                join_ts INTEGER,
+                activity_ts INTEGER,
+                start_param TEXT,
+                stage INTEGER NOT NULL DEFAULT 0,
+                subscribed INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # Статус - це етап воронки (0 - ще не пройшов жодного), підписка - 0/1
+        for table in ('user_statuses', 'subscription_statuses'):
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    code INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                )
+            """)
+        conn.executemany('INSERT OR REPLACE INTO user_statuses (code, name) VALUES (?, ?)',
+                         [(0, 'active')] + [(code, name) for name, code in _FUNNEL_STAGES.items() if code <= 11])
+        conn.executemany('INSERT OR REPLACE INTO subscription_statuses (code, name) VALUES (?, ?)',
+                         [(0, '❌Не подписан'), (1, '✅Подписан')])
+
+        kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'users'").fetchone()
+        if kind and kind[0] == 'table':
+            # Підписку задає лише код бота; інше значення без втрат не перенести
+            unknown = conn.execute("""
+                SELECT DISTINCT subscription_status FROM users
+                WHERE subscription_status IS NOT NULL AND subscription_status NOT IN (SELECT name FROM subscription_statuses)
+            """).fetchall()
+            if unknown:
+                raise RuntimeError(f"Невідомі статуси підписки: {[row[0] for row in unknown]}")
+
+            # Статуси не з воронки (їх міг задати адмін) отримують власні від'ємні коди
+            added = conn.execute("""
+                INSERT INTO user_statuses (code, name)
+                SELECT (SELECT MIN(MIN(code), 0) FROM user_statuses) - ROW_NUMBER() OVER (ORDER BY status), status
+                FROM (SELECT DISTINCT status FROM users
+                      WHERE status IS NOT NULL AND status NOT IN (SELECT name FROM user_statuses))
+            """).rowcount
+            if added:
+                print(f"ℹ️ Додано статусів поза воронкою: {added}")
+
+            # NULL у status - це 'active' (значення за замовчуванням колонки)
+            conn.execute("""
+                INSERT OR IGNORE INTO users_data (user_id, user_name, join_ts, activity_ts, start_param, stage, subscribed)
+                SELECT u.user_id, u.user_name,
+                       CAST(strftime('%s', u.join_date) AS INTEGER),
+                       CAST(strftime('%s', u.last_activity) AS INTEGER),
+                       u.start_param, COALESCE(s.code, 0),
+                       CASE u.subscription_status WHEN '✅Подписан' THEN 1 ELSE 0 END
+                FROM users u LEFT JOIN user_statuses s ON s.name = u.status
+            """)
+            # Разом з таблицею зникають її індекси та тригери
+            conn.execute('DROP TABLE users')
+        # Колонки старої таблиці users (id тепер дорівнює user_id) + сирі колонки для швидких фільтрів
+        conn.execute("""
+            CREATE VIEW IF NOT EXISTS users AS
+            SELECT u.user_id AS id, u.user_id, u.user_name,
+                   datetime(u.join_ts, 'unixepoch') AS join_date,
+                   datetime(u.activity_ts, 'unixepoch') AS last_activity,
+                   u.start_param,
+                   s.name AS status,
+                   ss.name AS subscription_status,
+                   u.stage, u.join_ts, u.activity_ts, u.subscribed
+            FROM users_data u
+            LEFT JOIN user_statuses s ON s.code = u.stage
+            LEFT JOIN subscription_statuses ss ON ss.code = u.subscribed
+        """)
+        for name, body in _USERS_DATA_TRIGGERS.items():
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            conn.execute(f'CREATE TRIGGER {name} {body}')
+
+        # Фільтри аудиторії розсилок: (фільтр, user_id) - рахувати та гортати аудиторію по індексу
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_stage ON users_data (stage, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_start_param ON users_data (start_param, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_subscribed ON users_data (subscribed, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_join ON users_data (join_ts)')
+        # Сторінки /api/users: (фільтр, activity_ts, user_id) і пошук за username
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_activity ON users_data (activity_ts, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_stage_activity '
+                     'ON users_data (stage, activity_ts, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_start_param_activity '
+                     'ON users_data (start_param, activity_ts, user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_user_name ON users_data (user_name COLLATE NOCASE)')
+
+        _rebuild_user_counters(conn)
+        conn.commit()
+        conn.execute('ANALYZE')
+        conn.commit()
+
+
+def _user_states():
+    """Стани користувачів (капча, очікування заявки в канал), що переживають перезапуск бота"""
+    with get_connection() as conn:
+        # channel_id без типу: з налаштувань приходить і число, і @username
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_states (
+                user_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                chat_id INTEGER,
+                channel_id,
+                captcha_message_id INTEGER,
+                expires_at INTEGER NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_states_expires_at ON user_states (expires_at)')
+        conn.commit()
+
+
+def _users_page_indexes():
+    """Індекси сторінок користувачів за COALESCE(activity_ts, 0): користувачі без активності теж у списку.
+    Вираз має збігатися з client_db.USERS_PAGE_ORDER, інакше SQLite не використає індекс
+    """
+    with get_connection() as conn:
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_page ON users_data (COALESCE(activity_ts, 0), user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_stage_page '
+                     'ON users_data (stage, COALESCE(activity_ts, 0), user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_data_start_param_page '
+                     'ON users_data (start_param, COALESCE(activity_ts, 0), user_id)')
+        conn.execute('DROP INDEX IF EXISTS idx_users_data_stage_activity')
+        conn.execute('DROP INDEX IF EXISTS idx_users_data_start_param_activity')
+        conn.execute('ANALYZE users_data')
+        conn.commit()
+
+
+# (версія, опис, функція). Нові кроки додаються лише в кінець списку
+MIGRATIONS = [
+    (1, 'Базова схема: таблиці користувачів, налаштувань, розсилок та медіа', _baseline),
+    (2, 'Індекси users для аналітики за датами', _users_analytics_indexes),
+    (3, 'Покриваючий індекс активності для зведеної аналітики', _users_activity_covering_index),
+    (4, 'Журнал подій воронки user_events та щоденне зведення', _user_events_log),
+    (5, 'Лічильники користувачів user_counters на тригерах', _user_counters),
+    (6, 'Індекси keyset-пагінації та пошуку користувачів', _users_keyset_indexes),
+    (7, 'Числовий етап воронки users.stage', _users_stage_column),
+    (8, 'Компактна схема users_data з кодами статусів і view users', _compact_users),
+    (9, 'Стани користувачів user_states з терміном дії', _user_states),
+    (10, 'Індекси сторінок користувачів з урахуванням порожньої активності', _users_page_indexes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version() -> int:
+    with get_connection() as conn:
+        try:
+            row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+        except sqlite3.OperationalError:
+            return 0  # Таблиці ще немає - БД до появи міграцій або нова
+    return row[0] or 0
+
+
+def _record_version(version: int, description: str) -> None:
+    with get_connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('INSERT OR IGNORE INTO schema_version (version, description) VALUES (?, ?)',
+                     (version, description))
+        conn.commit()
+
+
+@contextmanager
+def _migration_lock():
+    """Ексклюзивне блокування між процесами на весь час міграції.
+    Транзакція БД не підходить: кроки самі комітять у тому ж з'єднанні.
+    """
+    path = os.path.join(os.path.dirname(DB_PATH), 'migrations.lock')
+    with open(path, 'a+b') as lock_file:
+        if os.name == 'nt':
+            import msvcrt
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK здається після ~10 секунд - чекаємо далі
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def run_migrations() -> int:
+    """Застосовує кроки, новіші за поточну версію схеми. Повертає версію після міграції"""
+    current = get_schema_version()
+    if current >= LATEST_VERSION:
+        return current
+
+    with _migration_lock():
+        # Поки чекали блокування, міграцію міг завершити інший процес
+        current = get_schema_version()
+        if current >= LATEST_VERSION:
+            return current
+        return _apply_migrations(current)
+
+
+def _apply_migrations(current: int) -> int:
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"🛠 Міграція {version}: {description}")
+        step()
+        _record_version(version, description)
+        current = version
+
+    print(f"✅ Схема БД оновлена до версії {current}")
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Міграції схеми БД')
+    parser.add_argument('--status', action='store_true', help='лише показати поточну версію схеми')
+    args = parser.parse_args()
+
+    if args.status:
+        current = get_schema_version()
+        print(f"Версія схеми: {current}, остання: {LATEST_VERSION}")
+        for version, description, _ in MIGRATIONS:
+            mark = '✅' if version <= current else '⏳'
+            print(f"  {mark} {version}: {description}")
+        return
+
+    run_migrations()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,147 +1,92 @@
 import sqlite3
 import json
-import os
-from typing import Dict, Any
-from contextlib import contextmanager
+import time
+import functools
+import threading
+from database.db import get_connection
 from typing import Dict, Any, List, Tuple, Optional
-from datetime import datetime, timedelta
+from datetime import datetime
 import pytz
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.security import check_password_hash
 
 
-os.makedirs('data', exist_ok=True)
+SETTINGS_CHECK_INTERVAL = 2.0
 
-@contextmanager
-def get_connection():
-    conn = sqlite3.connect('data/data.db')
-    try:
-        yield conn
-    finally:
-        conn.close()
+# Кеш налаштувань процесу: bot_settings та готові конфіги геттерів.
+# Будь-яка зміна таблиць налаштувань (з бота, веб-панелі чи вручну) збільшує
+# settings_version тригером; версію перевіряємо не частіше SETTINGS_CHECK_INTERVAL
+_settings_cache = {"version": None, "checked_at": 0.0, "settings": None, "configs": {}}
+_settings_cache_lock = threading.Lock()
 
 
-def create_settings_table():
+def _get_settings_version() -> Optional[int]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT version FROM settings_version WHERE id = 1')
+        except sqlite3.OperationalError:
+            return None  # Таблиця ще не створена - перечитуємо щоразу після інтервалу
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+def _load_all_settings() -> Dict[str, Any]:
     with get_connection() as conn:
         cursor = conn.cursor()
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bot_settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                setting_key TEXT UNIQUE NOT NULL,
-                setting_value TEXT NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        
-        default_settings = {
-            'start_message': 'Привет! Добро пожаловать в наш магазин!',
-            'start_media_type': 'none',
-            'start_media_url': '',
-            'start_inline_buttons': '[]',
-            'start_inline_buttons_position': 'below',
-            'start_answers_button_text': '💡 Ответы',
-            'start_our_chat_button_text': '🎓 Приватный урок',
-            'start_shop_button_text': '💰 Тарифы',
-            'our_chat_message': 'Присоединяйтесь к нашему чату!',
-            'our_chat_media_type': 'none',
-            'our_chat_media_url': '',
-            'our_chat_subscription_button_text': '📢 Подписка',
-            'our_chat_subscription_channel_url': 'https://t.me/your_channel',
-            'our_chat_check_subscription_button_text': '✅ Проверить подписку',
-            'shop_message': 'Добро пожаловать в наш магазин! Выберите категорию товаров.',
-            'shop_media_type': 'none',
-            'shop_media_url': '',
-            'channel_join_message': 'Добро пожаловать в наш канал! Рады видеть вас!',
-            'channel_join_media_type': 'none',
-            'channel_join_media_url': '',
-            'channel_leave_message': 'Жаль, что вы покинули наш канал! Надеемся увидеть вас снова!',
-            'channel_leave_media_type': 'none',
-            'channel_leave_media_url': '',
-            'channel_leave_inline_buttons': '[]',
-            'channel_leave_leave_button_text': 'Уйти',
-            'channel_leave_leave_message': 'Вы уверены, что хотите уйти?',
-            'channel_leave_leave_media_type': 'none',
-            'channel_leave_leave_media_url': '',
-            'channel_leave_leave_inline_buttons': '[]',
-            'channel_leave_return_button_text': 'Возвращаюсь',
-            'channel_leave_return_url': 'https://t.me/your_channel',
-            'captcha_message': 'Я не робот',
-            'captcha_media_type': 'none',
-            'captcha_media_url': '',
-            'captcha_button_text': 'Я не робот',
-            'answers_message': 'Ответы на часто задаваемые вопросы',
-            'answers_media_type': 'none',
-            'answers_media_url': '',
-            'answers_inline_buttons': '[]',
-            'private_lesson_message': 'Добро пожаловать на приватный урок!',
-            'private_lesson_media_type': 'none',
-            'private_lesson_media_url': '',
-            'private_lesson_inline_buttons': '[]',
-            'tariffs_message': 'Наши тарифы и цены',
-            'tariffs_media_type': 'none',
-            'tariffs_media_url': '',
-            'tariffs_inline_buttons': '[]'
-        }
+        cursor.execute('SELECT setting_key, setting_value FROM bot_settings')
+        results = cursor.fetchall()
         
-        for key, value in default_settings.items():
-            cursor.execute('''
-                INSERT OR IGNORE INTO bot_settings (setting_key, setting_value)
-                VALUES (?, ?)
-            ''', (key, value))
+        settings = {}
+        for key, value in results:
+            if key == 'start_inline_buttons' and value:
+                try:
+                    import json
+                    parsed_value = json.loads(value)
+                    settings[key] = parsed_value
+                except (json.JSONDecodeError, TypeError):
+                    settings[key] = []
+            else:
+                settings[key] = value
         
-        conn.commit()
+        return settings
+
+
+def _refresh_settings_cache() -> None:
+    now = time.monotonic()
+    if _settings_cache["settings"] is not None and now - _settings_cache["checked_at"] < SETTINGS_CHECK_INTERVAL:
+        return
     
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS start_links (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                start_param TEXT UNIQUE NOT NULL,
-                message_text TEXT NOT NULL,
-                media_type TEXT DEFAULT 'none',
-                media_url TEXT,
-                inline_buttons TEXT DEFAULT '[]',
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS channel_invite_links (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                invite_link TEXT UNIQUE NOT NULL,
-                channel_name TEXT NOT NULL,
-                message_text TEXT NOT NULL,
-                media_type TEXT DEFAULT 'none',
-                media_url TEXT,
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        try:
-            cursor.execute('SELECT captcha_message FROM channel_invite_links LIMIT 1')
-        except:
-            cursor.execute('ALTER TABLE channel_invite_links ADD COLUMN captcha_message TEXT DEFAULT "Я не робот"')
-            
-        try:
-            cursor.execute('SELECT captcha_media_type FROM channel_invite_links LIMIT 1')
-        except:
-            cursor.execute('ALTER TABLE channel_invite_links ADD COLUMN captcha_media_type TEXT DEFAULT "none"')
-            
-        try:
-            cursor.execute('SELECT captcha_media_url FROM channel_invite_links LIMIT 1')
-        except:
-            cursor.execute('ALTER TABLE channel_invite_links ADD COLUMN captcha_media_url TEXT DEFAULT ""')
-            
-        try:
-            cursor.execute('SELECT captcha_button_text FROM channel_invite_links LIMIT 1')
-        except:
-            cursor.execute('ALTER TABLE channel_invite_links ADD COLUMN captcha_button_text TEXT DEFAULT "Я не робот"')
-        
-        conn.commit()
-        
+    with _settings_cache_lock:
+        if _settings_cache["settings"] is not None and now - _settings_cache["checked_at"] < SETTINGS_CHECK_INTERVAL:
+            return
+        
+        # Версію читаємо до даних: зміна між запитами лише спричинить зайве перечитування
+        version = _get_settings_version()
+        if version is None or version != _settings_cache["version"] or _settings_cache["settings"] is None:
+            _settings_cache["settings"] = _load_all_settings()
+            _settings_cache["configs"] = {}
+            _settings_cache["version"] = version
+        _settings_cache["checked_at"] = now
+
+
+def invalidate_settings_cache() -> None:
+    """Змушує перевірити версію налаштувань при наступному зверненні"""
+    _settings_cache["checked_at"] = 0.0
+
+
+def cached_settings(func):
+    """Кешує результат геттера конфігу до наступної зміни налаштувань.
+    Повертається спільний об'єкт - викликачі його не змінюють
+    """
+    @functools.wraps(func)
+    def wrapper():
+        _refresh_settings_cache()
+        configs = _settings_cache["configs"]
+        if func.__name__ not in configs:
+            configs[func.__name__] = func()
+        return configs[func.__name__]
+    return wrapper
 
 
 def update_setting(key: str, value: Any) -> None:
@@ -153,35 +98,71 @@ def update_setting(key: str, value: Any) -> None:
         else:
             setting_value = str(value)
         
+        # file_id завантаженого медіа лежить поруч (..._media_file_id) і чинний,
+        # лише поки URL і тип медіа не змінились
+        if key.endswith(('media_url', 'media_type')):
+            cursor.execute('''
+                DELETE FROM bot_settings
+                WHERE setting_key = ?
+                  AND EXISTS (SELECT 1 FROM bot_settings WHERE setting_key = ? AND setting_value != ?)
+            ''', (key.rsplit('_', 1)[0] + '_file_id', key, setting_value))
+        
         cursor.execute('''
             INSERT OR REPLACE INTO bot_settings (setting_key, setting_value, updated_at)
             VALUES (?, ?, CURRENT_TIMESTAMP)
         ''', (key, setting_value))
         
         conn.commit()
+    
+    invalidate_settings_cache()
 
 
 def get_all_settings() -> Dict[str, Any]:
+    _refresh_settings_cache()
+    return dict(_settings_cache["settings"])
+
+
+def save_settings_media_file_id(media_type: str, url: str, file_id: str) -> int:
+    """Записує file_id поруч з кожним налаштуванням, де збережено це медіа
+    (start_media_url -> start_media_file_id). Повертає кількість налаштувань"""
     with get_connection() as conn:
         cursor = conn.cursor()
-        
-        cursor.execute('SELECT setting_key, setting_value FROM bot_settings')
-        results = cursor.fetchall()
-        
-        settings = {}
-        for key, value in results:
-            if key == 'start_inline_buttons' and value:
-                try:
-                    import json
-                    parsed_value = json.loads(value)
-                    settings[key] = parsed_value
-                except (json.JSONDecodeError, TypeError):
-                    settings[key] = []
-            else:
-                settings[key] = value
-        
-        return settings
+        cursor.execute('''
+            SELECT u.setting_key
+            FROM bot_settings u
+            JOIN bot_settings t ON t.setting_key = substr(u.setting_key, 1, length(u.setting_key) - 3) || 'type'
+            WHERE u.setting_key LIKE '%media_url' AND u.setting_value = ? AND t.setting_value = ?
+        ''', (url, media_type))
+        keys = [row[0][:-len('url')] + 'file_id' for row in cursor.fetchall()]
+        for key in keys:
+            cursor.execute('''
+                INSERT OR REPLACE INTO bot_settings (setting_key, setting_value, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            ''', (key, file_id))
+        conn.commit()
+    
+    if keys:
+        invalidate_settings_cache()
+    return len(keys)
+
 
+@cached_settings
+def get_settings_media_file_ids() -> Dict[Tuple[str, str], str]:
+    """(media_type, url) -> file_id для медіа з налаштувань, уже завантажених у Telegram"""
+    settings = get_all_settings()
+    
+    file_ids = {}
+    for key, file_id in settings.items():
+        if not key.endswith('media_file_id') or not file_id:
+            continue
+        prefix = key[:-len('file_id')]
+        media_type = settings.get(prefix + 'type')
+        url = settings.get(prefix + 'url')
+        if media_type and url:
+            file_ids[(media_type, url)] = file_id
+    return file_ids
+
+@cached_settings
 def get_start_message_config() -> Dict[str, Any]:
     settings = get_all_settings()
     
@@ -225,6 +206,7 @@ def get_start_message_config() -> Dict[str, Any]:
     }
 
 
+@cached_settings
 def get_channel_leave_config() -> Dict[str, Any]:
     settings = get_all_settings()
     
@@ -467,140 +449,14 @@ def get_channel_invite_link_by_chat_id(chat_id: int) -> dict:
         return None
 
 
-def create_mailings_table():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS mailings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                message_text TEXT NOT NULL,
-                media_type TEXT DEFAULT 'none',
-                media_url TEXT,
-                inline_buttons TEXT,
-                is_active INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                sent_at TIMESTAMP,
-                users_count INTEGER DEFAULT 0,
-                scheduled_at TIMESTAMP,
-                is_scheduled INTEGER DEFAULT 0,
-                schedule_repeat TEXT DEFAULT 'once',
-                schedule_days TEXT,
-                status TEXT DEFAULT 'draft',
-                is_recurring INTEGER DEFAULT 0,
-                recurring_days TEXT,
-                recurring_time TEXT,
-                next_scheduled_at TIMESTAMP
-            )
-        ''')
-        
-        try:
-            cursor.execute('SELECT scheduled_at FROM mailings LIMIT 1')
-        except:
-            
-            try:
-                cursor.execute('ALTER TABLE mailings ADD COLUMN scheduled_at TIMESTAMP')
-            except Exception as e:
-                print(f"❌ Помилка додавання scheduled_at: {e}")
-                
-            try:
-                cursor.execute('ALTER TABLE mailings ADD COLUMN is_scheduled INTEGER DEFAULT 0')
-            except Exception as e:
-                print(f"❌ Помилка додавання is_scheduled: {e}")
-                
-            try:
-                cursor.execute('ALTER TABLE mailings ADD COLUMN schedule_repeat TEXT DEFAULT "once"')
-            except Exception as e:
-                print(f"❌ Помилка додавання schedule_repeat: {e}")
-                
-            try:
-                cursor.execute('ALTER TABLE mailings ADD COLUMN schedule_days TEXT')
-            except Exception as e:
-                print(f"❌ Помилка додавання schedule_days: {e}")
-                
-            try:
-                cursor.execute('ALTER TABLE mailings ADD COLUMN status TEXT DEFAULT "draft"')
-            except Exception as e:
-                print(f"❌ Помилка додавання status: {e}")
-        
-        try:
-            cursor.execute('SELECT is_recurring FROM mailings LIMIT 1')
-        except:
-            
-            try:
-                cursor.execute('ALTER TABLE mailings ADD COLUMN is_recurring INTEGER DEFAULT 0')
-            except Exception as e:
-                print(f"❌ Помилка додавання is_recurring: {e}")
-                
-            try:
-                cursor.execute('ALTER TABLE mailings ADD COLUMN recurring_days TEXT')
-            except Exception as e:
-                print(f"❌ Помилка додавання recurring_days: {e}")
-                
-            try:
-                cursor.execute('ALTER TABLE mailings ADD COLUMN recurring_time TEXT')
-            except Exception as e:
-                print(f"❌ Помилка додавання recurring_time: {e}")
-                
-            try:
-                cursor.execute('ALTER TABLE mailings ADD COLUMN next_scheduled_at TIMESTAMP')
-            except Exception as e:
-                print(f"❌ Помилка додавання next_scheduled_at: {e}")
-        
-            try:
-                cursor.execute('PRAGMA table_info(mailings)')
-                columns = cursor.fetchall()
-            except:
-                pass
-        
-        conn.commit()
-
-
 def add_mailing(name: str, message_text: str, media_type: str = "none", 
                 media_url: str = None, inline_buttons: str = None, 
                 user_filter: str = "all", user_status: str = None, 
-                start_param_filter: str = None) -> int:
+                start_param_filter: str = None, audience_filter: str = None,
+                broadcast_mode: str = "send") -> int:
     with get_connection() as conn:
         cursor = conn.cursor()
         
-        # Додаємо нові поля до таблиці mailings, якщо їх немає
-        try:
-            cursor.execute('ALTER TABLE mailings ADD COLUMN user_filter TEXT DEFAULT "all"')
-        except:
-            pass  # Колонка вже існує
-            
-        try:
-            cursor.execute('ALTER TABLE mailings ADD COLUMN user_status TEXT')
-        except:
-            pass  # Колонка вже існує
-            
-        try:
-            cursor.execute('ALTER TABLE mailings ADD COLUMN start_param_filter TEXT')
-        except:
-            pass  # Колонка вже існує
-        
-        # Додаємо колонки для subscription_messages
-        try:
-            cursor.execute('ALTER TABLE subscription_messages ADD COLUMN back_button_text TEXT')
-        except:
-            pass  # Колонка вже існує
-        
-        try:
-            cursor.execute('ALTER TABLE subscription_messages ADD COLUMN main_menu_button_text TEXT')
-        except:
-            pass  # Колонка вже існує
-        
-        try:
-            cursor.execute('ALTER TABLE subscription_messages ADD COLUMN show_back_button INTEGER DEFAULT 0')
-        except:
-            pass  # Колонка вже існує
-        
-        try:
-            cursor.execute('ALTER TABLE subscription_messages ADD COLUMN show_main_menu_button INTEGER DEFAULT 0')
-        except:
-            pass  # Колонка вже існує
-        
         try:
             from datetime import datetime
             import pytz
@@ -612,11 +468,11 @@ def add_mailing(name: str, message_text: str, media_type: str = "none",
                     name, message_text, media_type, media_url, inline_buttons, 
                     is_active, is_scheduled, status, is_recurring, 
                     recurring_days, recurring_time, next_scheduled_at,
-                    user_filter, user_status, start_param_filter, created_at
+                    user_filter, user_status, start_param_filter, audience_filter, broadcast_mode, created_at
                 )
-                VALUES (?, ?, ?, ?, ?, 0, 0, 'draft', 0, NULL, NULL, NULL, ?, ?, ?, ?)
+                VALUES (?, ?, ?, ?, ?, 0, 0, 'draft', 0, NULL, NULL, NULL, ?, ?, ?, ?, ?, ?)
             ''', (name, message_text, media_type, media_url, inline_buttons, 
-                  user_filter, user_status, start_param_filter, kyiv_time))
+                  user_filter, user_status, start_param_filter, audience_filter, broadcast_mode, kyiv_time))
         except Exception as e:
             from datetime import datetime
             import pytz
@@ -648,7 +504,8 @@ def get_all_mailings() -> List[Dict]:
                        m.is_scheduled, m.status, 
                        CASE WHEN r.mailing_id IS NOT NULL THEN 1 ELSE 0 END as is_recurring,
                        r.recurring_days, r.recurring_time, r.next_scheduled_at,
-                       m.user_filter, m.user_status, m.start_param_filter
+                       m.user_filter, m.user_status, m.start_param_filter, m.audience_filter,
+                       m.broadcast_mode, m.template_chat_id, m.template_message_id
                 FROM mailings m
                 LEFT JOIN recurring_mailings r ON m.id = r.mailing_id AND r.is_active = 1
                 ORDER BY m.created_at DESC
@@ -661,7 +518,8 @@ def get_all_mailings() -> List[Dict]:
                            is_active, created_at, sent_at, users_count, scheduled_at, 
                            is_scheduled, status, 0 as is_recurring, NULL as recurring_days, 
                            NULL as recurring_time, NULL as next_scheduled_at,
-                           user_filter, user_status, start_param_filter
+                           user_filter, user_status, start_param_filter, audience_filter,
+                           broadcast_mode, template_chat_id, template_message_id
                 FROM mailings ORDER BY created_at DESC
                 ''')
                 results = cursor.fetchall()
@@ -691,7 +549,11 @@ def get_all_mailings() -> List[Dict]:
                 "next_scheduled_at": row[16],
                 "user_filter": row[17] if len(row) > 17 else "all",
                 "user_status": row[18] if len(row) > 18 else None,
-                "start_param_filter": row[19] if len(row) > 19 else None
+                "start_param_filter": row[19] if len(row) > 19 else None,
+                "audience_filter": row[20] if len(row) > 20 else None,
+                "broadcast_mode": row[21] or "send",
+                "template_chat_id": row[22],
+                "template_message_id": row[23]
             }
             mailings.append(mailing)
         
@@ -709,7 +571,8 @@ def get_mailing_by_id(mailing_id: int) -> Optional[Dict[str, Any]]:
                        m.is_scheduled, m.status, 
                        CASE WHEN r.mailing_id IS NOT NULL THEN 1 ELSE 0 END as is_recurring,
                        r.recurring_days, r.recurring_time, r.next_scheduled_at,
-                       m.user_filter, m.user_status, m.start_param_filter
+                       m.user_filter, m.user_status, m.start_param_filter, m.audience_filter,
+                       m.broadcast_mode, m.template_chat_id, m.template_message_id
                 FROM mailings m
                 LEFT JOIN recurring_mailings r ON m.id = r.mailing_id AND r.is_active = 1
                 WHERE m.id = ?
@@ -736,7 +599,11 @@ def get_mailing_by_id(mailing_id: int) -> Optional[Dict[str, Any]]:
                     "next_scheduled_at": result[16],
                     "user_filter": result[17] if len(result) > 17 else "all",
                     "user_status": result[18] if len(result) > 18 else None,
-                    "start_param_filter": result[19] if len(result) > 19 else None
+                    "start_param_filter": result[19] if len(result) > 19 else None,
+                    "audience_filter": result[20] if len(result) > 20 else None,
+                    "broadcast_mode": result[21] or "send",
+                    "template_chat_id": result[22],
+                    "template_message_id": result[23]
                 }
         except Exception as e:
             print(f"Помилка при отриманні розсилки з JOIN: {e}")
@@ -992,7 +859,6 @@ def get_all_start_links():
     
     links = []
     for row in rows:
-        import json
         links.append({
             'id': row[0],
             'start_param': row[1],
@@ -1026,89 +892,7 @@ def toggle_start_link_status(link_id, is_active):
         
         conn.commit()
 
-def create_subscription_messages_table():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS subscription_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                message_text TEXT NOT NULL,
-                media_type TEXT DEFAULT 'none',
-                media_url TEXT,
-                inline_buttons TEXT DEFAULT '[]',
-                inline_buttons_position TEXT DEFAULT 'below',
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Додаємо нові колонки, якщо вони не існують
-        try:
-            cursor.execute('ALTER TABLE subscription_messages ADD COLUMN back_button_text TEXT')
-        except:
-            pass  # Колонка вже існує
-        
-        try:
-            cursor.execute('ALTER TABLE subscription_messages ADD COLUMN main_menu_button_text TEXT')
-        except:
-            pass  # Колонка вже існує
-        
-        try:
-            cursor.execute('ALTER TABLE subscription_messages ADD COLUMN show_back_button INTEGER DEFAULT 0')
-        except:
-            pass  # Колонка вже існує
-        
-        try:
-            cursor.execute('ALTER TABLE subscription_messages ADD COLUMN show_main_menu_button INTEGER DEFAULT 0')
-        except:
-            pass  # Колонка вже існує
-        
-        conn.commit()
-
-
-def create_welcome_without_subscription_table():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS welcome_without_subscription (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                message_text TEXT NOT NULL,
-                media_type TEXT DEFAULT 'none',
-                media_url TEXT,
-                channel_url TEXT,
-                channel_id TEXT,
-                channel_button_text TEXT DEFAULT '📢 Подписаться на канал',
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Перевіряємо чи існує колонка channel_button_text
-        cursor.execute("PRAGMA table_info(welcome_without_subscription)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'channel_button_text' not in columns:
-            cursor.execute('ALTER TABLE welcome_without_subscription ADD COLUMN channel_button_text TEXT DEFAULT "📢 Подписаться на канал"')
-            # Оновлюємо існуючі записи, які мають NULL значення
-            cursor.execute('UPDATE welcome_without_subscription SET channel_button_text = "📢 Подписаться на канал" WHERE channel_button_text IS NULL')
-        
-        # Додаємо запис за замовчуванням, якщо таблиця порожня
-        cursor.execute('SELECT COUNT(*) FROM welcome_without_subscription')
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('''
-                INSERT INTO welcome_without_subscription 
-                (message_text, media_type, media_url, channel_url, channel_id, channel_button_text, is_active)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                'Добро пожаловать! Для доступа к боту необходимо подписаться на наш канал.',
-                'none', '', 'https://t.me/your_channel', '@your_channel', '📢 Подписаться на канал', 1
-            ))
-        
-        conn.commit()
-
-
+@cached_settings
 def get_subscription_message() -> Optional[Dict[str, Any]]:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -1162,6 +946,7 @@ def save_subscription_message(message_text: str, media_type: str = "none",
         ''', (message_text, media_type, media_url, json.dumps(inline_buttons)))
         
         conn.commit()
+        invalidate_settings_cache()
         return cursor.rowcount > 0
 
 
@@ -1183,6 +968,7 @@ def update_subscription_message(message_id: int, message_text: str, media_type:
             WHERE id = ?
         ''', (message_text, media_type, media_url, json.dumps(inline_buttons), message_id))
         conn.commit()
+        invalidate_settings_cache()
         return cursor.rowcount > 0
 
 
@@ -1191,6 +977,7 @@ def delete_subscription_message(message_id: int) -> bool:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM subscription_messages WHERE id = ?', (message_id,))
         conn.commit()
+        invalidate_settings_cache()
         return cursor.rowcount > 0
 
 
@@ -1225,33 +1012,6 @@ def get_all_subscription_messages() -> List[Dict[str, Any]]:
         return messages
 
 
-def create_recurring_mailings_table():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS recurring_mailings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                mailing_id INTEGER NOT NULL,
-                recurring_days TEXT NOT NULL,
-                recurring_time TEXT NOT NULL,
-                next_scheduled_at TIMESTAMP,
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (mailing_id) REFERENCES mailings (id) ON DELETE CASCADE
-            )
-        ''')
-        
-        try:
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_recurring_mailing_id ON recurring_mailings (mailing_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_recurring_next_scheduled ON recurring_mailings (next_scheduled_at)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_recurring_active ON recurring_mailings (is_active)')
-        except Exception as e:
-            print(f"❌ Помилка створення індексів: {e}")
-        
-        conn.commit()
-
-
 def add_recurring_mailing(mailing_id: int, recurring_days: str, recurring_time: str) -> bool:
     print(f"🔍 DEBUG: add_recurring_mailing called for mailing_id: {mailing_id}, days: {recurring_days}, time: {recurring_time}")
     with get_connection() as conn:
@@ -1336,36 +1096,6 @@ def check_password(password: str) -> bool:
         return False
 
 
-def create_admin_credentials_table():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admin_credentials (
-                id INTEGER PRIMARY KEY,
-                username TEXT NOT NULL,
-                password_hash TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('SELECT COUNT(*) FROM admin_credentials')
-        count = cursor.fetchone()[0]
-        
-        if count == 0:
-            default_password = "SamaraBoy777"
-            password_hash = generate_password_hash(default_password, method='pbkdf2:sha256')
-            
-            cursor.execute('''
-                INSERT INTO admin_credentials (id, username, password_hash)
-                VALUES (1, 'Woldemar', ?)
-            ''', (password_hash,))
-            
-        
-        conn.commit()
-
-
-
 def update_mailing_data(mailing_id: int, name: str, message_text: str, 
                        media_type: str, media_url: str, inline_buttons: str) -> bool:   
     with get_connection() as conn:
@@ -1374,7 +1104,8 @@ def update_mailing_data(mailing_id: int, name: str, message_text: str,
         try:
             cursor.execute('''
                 UPDATE mailings 
-                SET name = ?, message_text = ?, media_type = ?, media_url = ?, inline_buttons = ?
+                SET name = ?, message_text = ?, media_type = ?, media_url = ?, inline_buttons = ?,
+                    template_chat_id = NULL, template_message_id = NULL
                 WHERE id = ?
             ''', (name, message_text, media_type, media_url, inline_buttons, mailing_id))
             
@@ -1386,6 +1117,17 @@ def update_mailing_data(mailing_id: int, name: str, message_text: str,
             return False
 
 
+def set_mailing_template(mailing_id: int, chat_id: int, message_id: int) -> None:
+    """Запам'ятовує повідомлення-шаблон у службовому чаті для режиму copy_message"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE mailings SET template_chat_id = ?, template_message_id = ?
+            WHERE id = ?
+        ''', (chat_id, message_id, mailing_id))
+        conn.commit()
+
+
 def update_mailing_scheduled_time(mailing_id: int, scheduled_time: str) -> bool:
     """Оновлення запланованого часу розсилки"""
     print(f"DEBUG: update_mailing_scheduled_time called with mailing_id={mailing_id}, scheduled_time='{scheduled_time}'")
@@ -1414,6 +1156,7 @@ def update_mailing_scheduled_time(mailing_id: int, scheduled_time: str) -> bool:
             return False
 
 
+@cached_settings
 def get_welcome_without_subscription() -> Optional[Dict[str, Any]]:
     with get_connection() as conn:
         cursor = conn.cursor()
@@ -1456,6 +1199,7 @@ def save_welcome_without_subscription(message_text: str, media_type: str = "none
         ''', (message_text, media_type, media_url, channel_url, channel_id, channel_button_text))
         
         conn.commit()
+        invalidate_settings_cache()
         return cursor.rowcount > 0
 
 
@@ -1471,6 +1215,7 @@ def update_welcome_without_subscription(message_id: int, message_text: str, medi
             WHERE id = ?
         ''', (message_text, media_type, media_url, channel_url, channel_id, channel_button_text, message_id))
         conn.commit()
+        invalidate_settings_cache()
         return cursor.rowcount > 0
 
 
@@ -1518,6 +1263,7 @@ def save_subscription_message_with_buttons(message_text: str, media_type: str =
               back_button_text, main_menu_button_text, 1 if show_back_button else 0, 1 if show_main_menu_button else 0))
         
         conn.commit()
+        invalidate_settings_cache()
         return cursor.rowcount > 0
 
 
@@ -1537,6 +1283,7 @@ def update_subscription_message_with_buttons(message_id: int, message_text: str,
         ''', (message_text, media_type, media_url, json.dumps(inline_buttons or []), inline_buttons_position,
               back_button_text, main_menu_button_text, 1 if show_back_button else 0, 1 if show_main_menu_button else 0, message_id))
         conn.commit()
+        invalidate_settings_cache()
         return cursor.rowcount > 0
 
 
@@ -1590,6 +1337,7 @@ def mark_captcha_verified(user_id, chat_id):
         conn.commit()
 
 
+@cached_settings
 def get_captcha_settings() -> Dict[str, Any]:
     settings = get_all_settings()
     
@@ -1614,6 +1362,7 @@ def save_captcha_settings(captcha_message: str, captcha_media_type: str = "none"
         return False
 
 
+@cached_settings
 def get_answers_config() -> Dict[str, Any]:
     settings = get_all_settings()
     
@@ -1638,6 +1387,7 @@ def save_answers_config(message: str, media_type: str = "none",
         return False
 
 
+@cached_settings
 def get_private_lesson_config() -> Dict[str, Any]:
     settings = get_all_settings()
     
@@ -1662,6 +1412,7 @@ def save_private_lesson_config(message: str, media_type: str = "none",
         return False
 
 
+@cached_settings
 def get_tariffs_config() -> Dict[str, Any]:
     settings = get_all_settings()
     
@@ -1687,6 +1438,7 @@ def save_tariffs_config(message: str, media_type: str = "none",
         return False
 
 
+@cached_settings
 def get_clothes_tariff_config() -> Dict[str, Any]:
     settings = get_all_settings()
     
@@ -1710,6 +1462,7 @@ def save_clothes_tariff_config(message: str, media_type: str = "none", media_url
         return False
 
 
+@cached_settings
 def get_tech_tariff_config() -> Dict[str, Any]:
     settings = get_all_settings()
     
@@ -1733,6 +1486,7 @@ def save_tech_tariff_config(message: str, media_type: str = "none", media_url: s
         return False
 
 
+@cached_settings
 def get_clothes_payment_config() -> Dict[str, Any]:
     settings = get_all_settings()
     
@@ -1764,6 +1518,7 @@ def save_clothes_payment_config(message: str, media_type: str = "none", media_ur
         return False
 
 
+@cached_settings
 def get_tech_payment_config() -> Dict[str, Any]:
     settings = get_all_settings()
     
@@ -1795,6 +1550,7 @@ def save_tech_payment_config(message: str, media_type: str = "none", media_url:
         return False
 
 
+@cached_settings
 def get_tariff_selection_buttons_config() -> Dict[str, Any]:
     """Получает настройки кнопок выбора тарифов в сообщении 'Посмотреть тарифы'"""
     settings = get_all_settings()
@@ -1818,11 +1574,19 @@ def save_tariff_selection_buttons_config(clothes_button_text: str = None, tech_b
         return False
 
 
-def update_mailing_users_count(mailing_id: int, users_count: int) -> bool:
-    """Обновляет количество пользователей, получивших рассылку"""
+def update_mailing_users_count(mailing_id: int, users_count: Optional[int] = None) -> bool:
+    """Обновляет количество пользователей, получивших рассылку.
+    Без users_count считает его по таблице mailing_deliveries.
+    """
     try:
         with get_connection() as conn:
             cursor = conn.cursor()
+            if users_count is None:
+                cursor.execute('''
+                    SELECT COUNT(*) FROM mailing_deliveries
+                    WHERE mailing_id = ? AND status = 'sent'
+                ''', (mailing_id,))
+                users_count = cursor.fetchone()[0]
             cursor.execute('''
                 UPDATE mailings 
                 SET users_count = ?, sent_at = CURRENT_TIMESTAMP
@@ -1835,6 +1599,268 @@ def update_mailing_users_count(mailing_id: int, users_count: int) -> bool:
         return False
 
 
+def fill_mailing_deliveries(mailing_id: int, user_ids) -> int:
+    """Заповнює чергу відправки. Повторні user_id ігноруються"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR IGNORE INTO mailing_deliveries (mailing_id, user_id)
+            VALUES (?, ?)
+        ''', ((mailing_id, user_id) for user_id in user_ids))
+        conn.commit()
+        return cursor.rowcount
+
+
+def reset_mailing_deliveries(mailing_id: int) -> bool:
+    """Очищає чергу перед новим запуском розсилки"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM mailing_deliveries WHERE mailing_id = ?', (mailing_id,))
+        conn.commit()
+        return cursor.rowcount > 0
+
+
+def has_pending_deliveries(mailing_id: int) -> bool:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT 1 FROM mailing_deliveries 
+            WHERE mailing_id = ? AND status = 'pending' 
+            LIMIT 1
+        ''', (mailing_id,))
+        return cursor.fetchone() is not None
+
+
+def get_pending_deliveries(mailing_id: int, after_user_id: int = 0, limit: int = 1000) -> List[int]:
+    """Наступна порція неотриманих user_id (keyset по user_id)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id FROM mailing_deliveries
+            WHERE mailing_id = ? AND status = 'pending' AND user_id > ?
+            ORDER BY user_id
+            LIMIT ?
+        ''', (mailing_id, after_user_id, limit))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def mark_mailing_deliveries(mailing_id: int, results: List[Tuple[int, str, Optional[str]]]) -> None:
+    """Зберігає результати відправки пачкою: (user_id, status, error)"""
+    if not results:
+        return
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            UPDATE mailing_deliveries 
+            SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE mailing_id = ? AND user_id = ?
+        ''', [(status, error, mailing_id, user_id) for user_id, status, error in results])
+        conn.commit()
+
+
+def get_mailing_delivery_stats(mailing_id: int) -> Dict[str, int]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT status, COUNT(*) FROM mailing_deliveries
+            WHERE mailing_id = ?
+            GROUP BY status
+        ''', (mailing_id,))
+        stats = {'pending': 0, 'sent': 0, 'failed': 0, 'blocked': 0}
+        for status, count in cursor.fetchall():
+            stats[status] = count
+        return stats
+
+
+def _mailing_job_to_dict(row) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "mailing_id": row[1],
+        "status": row[2],
+        "error": row[3],
+        "created_at": row[4],
+        "started_at": row[5],
+        "finished_at": row[6]
+    }
+
+
+def enqueue_mailing_job(mailing_id: int, restart: bool = False) -> int:
+    """Ставить розсилку в чергу воркера. Якщо вона вже в черзі або
+    відправляється - повертає існуючу задачу.
+    restart=True очищає mailing_deliveries, щоб відправити всім заново.
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT id FROM mailing_jobs 
+            WHERE mailing_id = ? AND status IN ('queued', 'running')
+            ORDER BY id DESC LIMIT 1
+        ''', (mailing_id,))
+        existing = cursor.fetchone()
+        if existing:
+            return existing[0]
+        
+        if restart:
+            cursor.execute('DELETE FROM mailing_deliveries WHERE mailing_id = ?', (mailing_id,))
+            cursor.execute('DELETE FROM mailing_progress WHERE mailing_id = ?', (mailing_id,))
+        
+        cursor.execute('''
+            INSERT INTO mailing_jobs (mailing_id, status) VALUES (?, 'queued')
+        ''', (mailing_id,))
+        job_id = cursor.lastrowid
+        conn.commit()
+        return job_id
+
+
+def claim_next_mailing_job() -> Optional[Dict[str, Any]]:
+    """Забирає найстарішу задачу з черги і переводить її в 'running'"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        
+        while True:
+            cursor.execute('''
+                SELECT id FROM mailing_jobs 
+                WHERE status = 'queued' 
+                ORDER BY id LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            if not row:
+                return None
+            
+            cursor.execute('''
+                UPDATE mailing_jobs 
+                SET status = 'running', started_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'queued'
+            ''', (row[0],))
+            conn.commit()
+            
+            # Інший воркер міг забрати задачу між SELECT та UPDATE
+            if cursor.rowcount > 0:
+                return get_mailing_job(row[0])
+
+
+def finish_mailing_job(job_id: int, status: str, error: str = None) -> bool:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE mailing_jobs 
+            SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (status, error, job_id))
+        conn.commit()
+        return cursor.rowcount > 0
+
+
+def requeue_interrupted_mailing_jobs() -> int:
+    """Повертає в чергу задачі, які виконувались під час падіння воркера"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE mailing_jobs 
+            SET status = 'queued', started_at = NULL
+            WHERE status = 'running'
+        ''')
+        conn.commit()
+        return cursor.rowcount
+
+
+def get_mailing_job(job_id: int) -> Optional[Dict[str, Any]]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, mailing_id, status, error, created_at, started_at, finished_at
+            FROM mailing_jobs WHERE id = ?
+        ''', (job_id,))
+        row = cursor.fetchone()
+        return _mailing_job_to_dict(row) if row else None
+
+
+def get_latest_mailing_job(mailing_id: int) -> Optional[Dict[str, Any]]:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, mailing_id, status, error, created_at, started_at, finished_at
+            FROM mailing_jobs WHERE mailing_id = ?
+            ORDER BY id DESC LIMIT 1
+        ''', (mailing_id,))
+        row = cursor.fetchone()
+        return _mailing_job_to_dict(row) if row else None
+
+
+def start_mailing_progress(mailing_id: int, stats: Dict[str, int]) -> None:
+    """Починає новий запуск. stats - результат get_mailing_delivery_stats,
+    тож при продовженні розсилки вже відправлені враховуються одразу
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO mailing_progress 
+            (mailing_id, total, sent, failed, blocked, rate, started_at, updated_at, finished_at)
+            VALUES (?, ?, ?, ?, ?, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, NULL)
+        ''', (mailing_id, sum(stats.values()), stats['sent'], stats['failed'], stats['blocked']))
+        conn.commit()
+
+
+def update_mailing_progress(mailing_id: int, sent: int, failed: int, blocked: int,
+                            rate: float, finished: bool = False) -> None:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE mailing_progress 
+            SET sent = ?, failed = ?, blocked = ?, rate = ?, updated_at = CURRENT_TIMESTAMP,
+                finished_at = CASE WHEN ? THEN CURRENT_TIMESTAMP ELSE finished_at END
+            WHERE mailing_id = ?
+        ''', (sent, failed, blocked, rate, finished, mailing_id))
+        conn.commit()
+
+
+def get_mailing_progress(mailing_id: int) -> Optional[Dict[str, Any]]:
+    """Прогрес останнього запуску розсилки разом зі статусом її задачі"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT total, sent, failed, blocked, rate, started_at, updated_at, finished_at
+            FROM mailing_progress WHERE mailing_id = ?
+        ''', (mailing_id,))
+        row = cursor.fetchone()
+    
+    job = get_latest_mailing_job(mailing_id)
+    if not row and not job:
+        return None
+    
+    total, sent, failed, blocked, rate, started_at, updated_at, finished_at = row or (0, 0, 0, 0, 0, None, None, None)
+    remaining = max(total - sent - failed - blocked, 0)
+    running = job is not None and job["status"] == "running" and not finished_at
+    
+    return {
+        "mailing_id": mailing_id,
+        "job_id": job["id"] if job else None,
+        "job_status": job["status"] if job else None,
+        "total": total,
+        "sent": sent,
+        "failed": failed,
+        "blocked": blocked,
+        "remaining": remaining,
+        "rate": round(rate, 2),
+        "eta_seconds": int(remaining / rate) if running and rate > 0 else None,
+        "started_at": started_at,
+        "updated_at": updated_at,
+        "finished_at": finished_at
+    }
+
+
+def get_active_mailing_ids() -> List[int]:
+    """Розсилки, задачі яких зараз у черзі або відправляються"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT DISTINCT mailing_id FROM mailing_jobs 
+            WHERE status IN ('queued', 'running')
+        ''')
+        return [row[0] for row in cursor.fetchall()]
+
+
 def delete_mailing(mailing_id: int) -> bool:
     """Удаляет рассылку и все связанные с ней данные"""
     try:
@@ -1843,6 +1869,9 @@ def delete_mailing(mailing_id: int) -> bool:
             
             # Сначала удаляем связанные записи из таблицы recurring_mailings
             cursor.execute('DELETE FROM recurring_mailings WHERE mailing_id = ?', (mailing_id,))
+            cursor.execute('DELETE FROM mailing_deliveries WHERE mailing_id = ?', (mailing_id,))
+            cursor.execute('DELETE FROM mailing_jobs WHERE mailing_id = ?', (mailing_id,))
+            cursor.execute('DELETE FROM mailing_progress WHERE mailing_id = ?', (mailing_id,))
             
             # Затем удаляем саму рассылку
             cursor.execute('DELETE FROM mailings WHERE id = ?', (mailing_id,))
@@ -1,34 +1,6 @@
-import sqlite3
-import json
-import os
-from contextlib import contextmanager
+from database.db import get_connection
 from datetime import datetime
 
-os.makedirs('data', exist_ok=True)
-
-@contextmanager
-def get_connection():
-    conn = sqlite3.connect('data/data.db')
-    try:
-        yield conn
-    finally:
-        conn.close()
-
-def create_start_params_table():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS start_params (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                param_name TEXT UNIQUE NOT NULL,
-                description TEXT,
-                created_at TEXT,
-                updated_at TEXT
-            )
-        ''')
-        
-        conn.commit()
 
 def add_start_param(param_name, description=None):
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -104,11 +76,11 @@ def get_start_params_stats():
     with get_connection() as conn:
         cursor = conn.cursor()
         
+        # Кількість користувачів береться з лічильників, які ведуть тригери на users
         cursor.execute('''
-            SELECT sp.param_name, COALESCE(COUNT(u.user_id), 0) as user_count
+            SELECT sp.param_name, COALESCE(uc.cnt, 0) as user_count
             FROM start_params sp
-            LEFT JOIN users u ON sp.param_name = u.start_param
-            GROUP BY sp.param_name
+            LEFT JOIN user_counters uc ON uc.kind = 'start_param' AND uc.key = sp.param_name
             ORDER BY user_count DESC
         ''')
         
@@ -128,7 +100,10 @@ def get_users_with_start_params():
     with get_connection() as conn:
         cursor = conn.cursor()
         
-        cursor.execute('SELECT COUNT(*) FROM users WHERE start_param IS NOT NULL')
+        cursor.execute('''
+            SELECT COALESCE(SUM(cnt), 0) FROM user_counters
+            WHERE kind = 'start_param' AND key != ''
+        ''')
         count = cursor.fetchone()[0]
         
         return count
@@ -0,0 +1,38 @@
+from typing import List, Tuple
+from database.db import get_connection
+
+
+def save_user_state(user_id: int, state: str, chat_id: int = None, channel_id=None,
+                    captcha_message_id: int = None, expires_at: int = 0) -> None:
+    with get_connection() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO user_states (user_id, state, chat_id, channel_id, captcha_message_id, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, state, chat_id, channel_id, captcha_message_id, expires_at))
+        conn.commit()
+
+
+def delete_user_state(user_id: int) -> None:
+    with get_connection() as conn:
+        conn.execute('DELETE FROM user_states WHERE user_id = ?', (user_id,))
+        conn.commit()
+
+
+def load_user_states(now: int) -> List[Tuple]:
+    """Непрострочені стани: (user_id, state, chat_id, channel_id, captcha_message_id, expires_at)"""
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id, state, chat_id, channel_id, captcha_message_id, expires_at
+            FROM user_states
+            WHERE expires_at > ?
+        ''', (now,))
+        return cursor.fetchall()
+
+
+def delete_expired_user_states(now: int) -> int:
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM user_states WHERE expires_at <= ?', (now,))
+        conn.commit()
+        return cursor.rowcount
@@ -1,11 +1,14 @@
+import asyncio
+import os
 from aiogram import Router, types
+from aiogram.types import FSInputFile
 from config import administrators
 from main import bot
 from utils.filters import IsAdmin
 from aiogram.fsm.context import FSMContext
 from keyboards.admin_keyboards import admin_keyboard
 from database.admin_db import get_users_count, get_all_user_ids
-import pandas as pd
+from utils.user_export import export_users_xlsx
 
 
 router = Router()
@@ -38,16 +41,12 @@ async def export_database(message: types.Message):
         )
     await message.answer(response_message, parse_mode="HTML")
     
-    # Отримуємо дані користувачів через функцію
-    from database.client_db import get_all_users
-    users_data = get_all_users()
-    
-    # Створюємо DataFrame
-    users_df = pd.DataFrame(users_data, columns=['user_id', 'user_name', 'join_date', 'last_activity'])
-
-    with pd.ExcelWriter('database_export.xlsx', engine='openpyxl') as writer:
-        users_df.to_excel(writer, sheet_name='Users', index=False)
-
-    with open('database_export.xlsx', 'rb') as file:
-        await bot.send_document(message.chat.id, file, caption="База даних користувачів")
+    # Файл формується в окремому потоці у власний тимчасовий файл,
+    # тож бот не блокується, а паралельні вигрузки не перезаписують одна одну
+    path = await asyncio.to_thread(export_users_xlsx)
+    try:
+        await bot.send_document(message.chat.id, FSInputFile(path, filename='database_export.xlsx'),
+                                caption="База даних користувачів")
+    finally:
+        os.remove(path)
         
@@ -305,7 +305,7 @@ async def handle_publish_confirmation(callback_query: types.CallbackQuery):
                     await bot.send_photo(recipient_id, media_info, caption=content_info, parse_mode='HTML', reply_markup=post_keyboard(user_data, user_id, url_buttons), disable_notification=disable_notification)
                 elif media_type == 'video':
                     # Використовуємо кешування для відео
-                    from utils.cron_functions import send_video_with_caching_for_mailing
+                    from utils.video_cache import send_video_with_caching_for_mailing
                     
                     cache_key = f"mailing_video_{user_id}_{recipient_id}"
                     success = await send_video_with_caching_for_mailing(
@@ -3,25 +3,23 @@ from aiogram import Router, types, F
 from main import bot
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from database.client_db import (
-    add_user, update_user_activity, create_table, 
-    update_user_status_by_action, update_subscription_status
+from database.async_db import (
+    add_user, update_user_activity, update_user_status_by_action, update_subscription_status,
+    get_start_message_config, get_subscription_message, get_channel_leave_config,
+    get_welcome_without_subscription, get_captcha_settings, get_channel_invite_link_by_chat_id,
+    flush_db, user_updates
 )
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database.settings_db import (get_start_message_config, create_settings_table, get_subscription_message,
-                                create_welcome_without_subscription_table, create_subscription_messages_table,
-                                get_channel_leave_config, create_mailings_table, create_recurring_mailings_table, create_admin_credentials_table, get_welcome_without_subscription, get_captcha_settings, get_channel_invite_link_by_chat_id)
+from database.migrations import run_migrations
 from keyboards.client_keyboards import get_subscription_message_keyboard, create_combined_keyboard, create_captcha_keyboard, create_inline_only_keyboard
-from database.start_params_db import create_start_params_table
-from utils.video_cache import send_video_with_caching
+from utils.video_cache import send_video_with_caching, cached_media
+from utils.user_state_store import user_states
 from states.client_states import MediaStates
 from utils.client_functions import check_user_subscription, send_welcome_without_subscription, send_answers_message_with_sequence, send_private_lesson_message_with_sequence, send_tariffs_message_with_sequence, send_clothes_tariff_message, send_tech_tariff_message, send_clothes_payment_message, send_tech_payment_message
 
 
 router = Router()
 
-user_states = {}
-
 class UserStates:
     WAITING_FOR_CHANNEL_REQUEST = "waiting_for_channel_request"
     WAITING_FOR_CAPTCHA = "waiting_for_captcha"
@@ -36,29 +34,25 @@ async def start(message: types.Message, state: FSMContext):
         start_param = None
         
     user_id = message.from_user.id
-    user_data = user_states.get(user_id, {})
-    current_state = user_data.get('state')
+    user_state = user_states.get(user_id)
+    current_state = user_state.state if user_state else None
 
 
     print(f"🔍 Current state: {current_state}")
     
-    add_user(user_id, message.from_user.username, start_param)
-    update_user_activity(user_id)
+    await add_user(user_id, message.from_user.username, start_param)
+    await update_user_activity(user_id)
     
-    update_user_status_by_action(user_id, "start")
+    await update_user_status_by_action(user_id, "start")
     
-    welcome_without_subscription = get_welcome_without_subscription()
+    welcome_without_subscription = await get_welcome_without_subscription()
     if welcome_without_subscription and welcome_without_subscription.get("channel_id"):
         channel_id = welcome_without_subscription["channel_id"]
         is_subscribed = await check_user_subscription(bot, user_id, channel_id)
         
         if not is_subscribed:
             print(f"🔍 Setting custom state to {UserStates.WAITING_FOR_CHANNEL_REQUEST}")
-            user_states[user_id] = {
-                'state': UserStates.WAITING_FOR_CHANNEL_REQUEST,
-                'channel_id': channel_id,
-                'user_id': user_id
-            }
+            await user_states.set(user_id, UserStates.WAITING_FOR_CHANNEL_REQUEST, channel_id=channel_id)
 
             await send_welcome_without_subscription(message, welcome_without_subscription)
             return
@@ -66,7 +60,7 @@ async def start(message: types.Message, state: FSMContext):
 
     if current_state == UserStates.WAITING_FOR_CAPTCHA:
 
-        captcha_settings = get_captcha_settings()
+        captcha_settings = await get_captcha_settings()
         
         captcha_message = captcha_settings["captcha_message"]
         captcha_media_type = captcha_settings["captcha_media_type"]
@@ -81,7 +75,7 @@ async def start(message: types.Message, state: FSMContext):
                 if captcha_media_url.startswith(('http://', 'https://')):
                     sent_message = await bot.send_photo(
                         chat_id=user_id,
-                        photo=captcha_media_url,
+                        photo=await cached_media('photo', captcha_media_url),
                         caption=captcha_message,
                         parse_mode="HTML",
                         reply_markup=captcha_keyboard
@@ -89,7 +83,7 @@ async def start(message: types.Message, state: FSMContext):
                 else:
                     sent_message = await bot.send_photo(
                         chat_id=user_id,
-                        photo=captcha_media_url,
+                        photo=await cached_media('photo', captcha_media_url),
                         caption=captcha_message,
                         parse_mode="HTML",
                         reply_markup=captcha_keyboard
@@ -119,14 +113,14 @@ async def start(message: types.Message, state: FSMContext):
             )
         
         if sent_message:
-            user_states[user_id]['captcha_message_id'] = sent_message.message_id
+            await user_states.update(user_id, captcha_message_id=sent_message.message_id)
 
         return
     
 
-    config = get_start_message_config()
+    config = await get_start_message_config()
 
-    update_subscription_status(user_id, "✅Подписан")
+    await update_subscription_status(user_id, "✅Подписан")
     
     start_message = config["message"]
     media_type = config["media_type"]
@@ -143,14 +137,14 @@ async def start(message: types.Message, state: FSMContext):
         if media_type == "photo":
             if media_url.startswith(('http://', 'https://')):
                 await message.answer_photo(
-                    photo=media_url,
+                    photo=await cached_media('photo', media_url),
                     caption=start_message,
                     parse_mode="HTML",
                     reply_markup=combined_keyboard
                 )
             else:
                 await message.answer_photo(
-                    photo=media_url,
+                    photo=await cached_media('photo', media_url),
                     caption=start_message,
                     parse_mode="HTML",
                     reply_markup=combined_keyboard
@@ -183,11 +177,11 @@ async def start(message: types.Message, state: FSMContext):
 
 @router.callback_query(lambda c: c.data == "back_to_welcome")
 async def back_to_welcome_handler(callback: types.CallbackQuery):
-    config = get_start_message_config()
+    config = await get_start_message_config()
 
     await callback.message.delete()
 
-    update_subscription_status(callback.from_user.id, "✅Подписан")
+    await update_subscription_status(callback.from_user.id, "✅Подписан")
     
     start_message = config["message"]
     media_type = config["media_type"]
@@ -204,14 +198,14 @@ async def back_to_welcome_handler(callback: types.CallbackQuery):
         if media_type == "photo":
             if media_url.startswith(('http://', 'https://')):
                 await callback.message.answer_photo(
-                    photo=media_url,
+                    photo=await cached_media('photo', media_url),
                     caption=start_message,
                     parse_mode="HTML",
                     reply_markup=combined_keyboard
                 )
             else:
                 await callback.message.answer_photo(
-                    photo=media_url,
+                    photo=await cached_media('photo', media_url),
                     caption=start_message,
                     parse_mode="HTML",
                     reply_markup=combined_keyboard
@@ -414,7 +408,7 @@ async def cancel_media_id(message: types.Message, state: FSMContext):
 
 async def send_subscription_success_message(bot, user_id: int) -> bool:
     try:
-        subscription_message = get_subscription_message()
+        subscription_message = await get_subscription_message()
         
         if not subscription_message:
             return False
@@ -427,7 +421,7 @@ async def send_subscription_success_message(bot, user_id: int) -> bool:
         if media_type == 'photo' and media_url:
             await bot.send_photo(
                 chat_id=user_id,
-                photo=media_url,
+                photo=await cached_media('photo', media_url),
                 caption=message_text,
                 parse_mode='HTML',
                 reply_markup=keyboard
@@ -461,9 +455,9 @@ async def send_subscription_success_message(bot, user_id: int) -> bool:
 @router.callback_query(lambda c: c.data == "back_to_start")
 async def back_to_start_handler(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    update_user_activity(user_id)
+    await update_user_activity(user_id)
     
-    config = get_start_message_config()
+    config = await get_start_message_config()
     
     start_message = config["message"]
     media_type = config["media_type"]
@@ -481,7 +475,7 @@ async def back_to_start_handler(callback: types.CallbackQuery):
             # Перевіряємо чи це file_id або URL
             if media_url.startswith(('http://', 'https://')):
                 await callback.message.answer_photo(
-                    photo=media_url,
+                    photo=await cached_media('photo', media_url),
                     caption=start_message,
                     parse_mode="HTML",
                     reply_markup=combined_keyboard
@@ -489,7 +483,7 @@ async def back_to_start_handler(callback: types.CallbackQuery):
             else:
                 # Це file_id
                 await callback.message.answer_photo(
-                    photo=media_url,
+                    photo=await cached_media('photo', media_url),
                     caption=start_message,
                     parse_mode="HTML",
                     reply_markup=combined_keyboard
@@ -521,8 +515,8 @@ async def handle_captcha_text(message: types.Message):
     user_text = message.text.strip() if message.text else None
 
     
-    user_data = user_states.get(user_id, {})
-    current_state = user_data.get('state')
+    user_state = user_states.get(user_id)
+    current_state = user_state.state if user_state else None
     
     if current_state != UserStates.WAITING_FOR_CAPTCHA:
         return
@@ -532,28 +526,28 @@ async def handle_captcha_text(message: types.Message):
             await message.answer("❌ Пожалуйста, нажмите кнопку на клавиатуре для прохождения капчи.", parse_mode="HTML")
             return
         
-        captcha_settings = get_captcha_settings()
+        captcha_settings = await get_captcha_settings()
         captcha_button_text = captcha_settings["captcha_button_text"]
         
         if user_text == captcha_button_text:
-            chat_id = user_data.get('chat_id')
+            chat_id = user_state.chat_id
             
             if chat_id:
-                captcha_message_id = user_data.get('captcha_message_id')
+                captcha_message_id = user_state.captcha_message_id
                 if captcha_message_id:
                     try:
                         await bot.delete_message(chat_id=user_id, message_id=captcha_message_id)
                     except Exception as e:
                         print(f"Не вдалося видалити повідомлення капчі: {e}")
                 
-                user_states[user_id]['state'] = UserStates.CAPTCHA_VERIFIED
+                # Повторне натискання кнопки, поки йде відправка, вже не пройде перевірку стану
+                user_state.state = UserStates.CAPTCHA_VERIFIED
                 
-                update_user_status_by_action(user_id, "answers_viewed")
+                await update_user_status_by_action(user_id, "answers_viewed")
                 
                 await send_answers_message_with_sequence(message)
                 
-                if user_id in user_states:
-                    del user_states[user_id]
+                await user_states.pop(user_id)
             else:
                 print("❌ Error: chat_id not found in state data")
                 await message.answer("❌ Произошла ошибка при проверке капчи. Попробуйте еще раз.", parse_mode="HTML")
@@ -572,21 +566,16 @@ async def handle_captcha_text(message: types.Message):
 async def handle_chat_join_request(chat_join_request: types.ChatJoinRequest):
     user_id = chat_join_request.from_user.id
     user_name = chat_join_request.from_user.username or "Пользователь без юзернейма"
-    add_user(user_id, user_name)
+    await add_user(user_id, user_name)
 
     chat = chat_join_request.chat
 
     try:
-        # Инициализируем состояние пользователя
-        if user_id not in user_states:
-            user_states[user_id] = {}
-        
         # Устанавливаем состояние ожидания капчи сразу
-        user_states[user_id]['state'] = UserStates.WAITING_FOR_CAPTCHA
-        user_states[user_id]['chat_id'] = chat.id
+        await user_states.set(user_id, UserStates.WAITING_FOR_CAPTCHA, chat_id=chat.id)
         
         # Получаем настройки пригласительной ссылки для данного канала
-        invite_link_config = get_channel_invite_link_by_chat_id(chat.id)
+        invite_link_config = await get_channel_invite_link_by_chat_id(chat.id)
         
         # Если есть сообщение для пригласительной ссылки, отправляем его
         if invite_link_config and invite_link_config['message_text'].strip():
@@ -599,7 +588,7 @@ async def handle_chat_join_request(chat_join_request: types.ChatJoinRequest):
                     if media_type == "photo":
                         await bot.send_photo(
                             chat_id=user_id,
-                            photo=media_url,
+                            photo=await cached_media('photo', media_url),
                             caption=message_text,
                             parse_mode="HTML"
                         )
@@ -622,7 +611,7 @@ async def handle_chat_join_request(chat_join_request: types.ChatJoinRequest):
                 print(f"❌ Error sending invite link message: {e}")
         
         # Отправляем капчу (всегда)
-        captcha_settings = get_captcha_settings()
+        captcha_settings = await get_captcha_settings()
         
         captcha_message = captcha_settings["captcha_message"]
         captcha_media_type = captcha_settings["captcha_media_type"]
@@ -637,7 +626,7 @@ async def handle_chat_join_request(chat_join_request: types.ChatJoinRequest):
                 if captcha_media_url.startswith(('http://', 'https://')):
                     sent_message = await bot.send_photo(
                         chat_id=user_id,
-                        photo=captcha_media_url,
+                        photo=await cached_media('photo', captcha_media_url),
                         caption=captcha_message,
                         parse_mode="HTML",
                         reply_markup=captcha_keyboard
@@ -645,7 +634,7 @@ async def handle_chat_join_request(chat_join_request: types.ChatJoinRequest):
                 else:
                     sent_message = await bot.send_photo(
                         chat_id=user_id,
-                        photo=captcha_media_url,
+                        photo=await cached_media('photo', captcha_media_url),
                         caption=captcha_message,
                         parse_mode="HTML",
                         reply_markup=captcha_keyboard
@@ -675,13 +664,13 @@ async def handle_chat_join_request(chat_join_request: types.ChatJoinRequest):
             )
         
         if sent_message:
-            user_states[user_id]['captcha_message_id'] = sent_message.message_id
+            await user_states.update(user_id, captcha_message_id=sent_message.message_id)
         
         await bot.approve_chat_join_request(
             chat_id=chat.id,
             user_id=user_id
         )
-        update_subscription_status(user_id, "✅Подписан")
+        await update_subscription_status(user_id, "✅Подписан")
         return
             
     except Exception as e:
@@ -694,7 +683,7 @@ async def handle_chat_join_request(chat_join_request: types.ChatJoinRequest):
 
 async def send_channel_leave_message(bot, user_id: int) -> bool:
     try:
-        config = get_channel_leave_config()
+        config = await get_channel_leave_config()
         message_text = config["message"]
         media_type = config["media_type"]
         media_url = config["media_url"]
@@ -737,7 +726,7 @@ async def send_channel_leave_message(bot, user_id: int) -> bool:
                 if media_url.startswith(('http://', 'https://')):
                     await bot.send_photo(
                         chat_id=user_id,
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -745,7 +734,7 @@ async def send_channel_leave_message(bot, user_id: int) -> bool:
                 else:
                     await bot.send_photo(
                         chat_id=user_id,
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -780,7 +769,7 @@ async def handle_channel_leave_leave(callback: types.CallbackQuery):
     try:
         await callback.message.delete()
         
-        config = get_channel_leave_config()
+        config = await get_channel_leave_config()
         message_text = config.get("leave_message", "Вы уверены, что хотите уйти?")
         media_type = config.get("leave_media_type", "none")
         media_url = config.get("leave_media_url", "")
@@ -792,14 +781,14 @@ async def handle_channel_leave_leave(callback: types.CallbackQuery):
             if media_type == "photo":
                 if media_url.startswith(('http://', 'https://')):
                     await callback.message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
                     )
                 else:
                     await callback.message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -846,11 +835,11 @@ async def handle_chat_member_update(update: types.ChatMemberUpdated):
         if new_status == "left":
             print(f"❌ Користувач {user_name} покинув канал")
             await send_channel_leave_message(bot, user_id)
-            update_subscription_status(user_id, "❌Не подписан")
+            await update_subscription_status(user_id, "❌Не подписан")
         elif new_status == "kicked":
             print(f"🚫 Користувач {user_name} був вигнаний з каналу")   
             await send_channel_leave_message(bot, user_id)
-            update_subscription_status(user_id, "❌Не подписан")
+            await update_subscription_status(user_id, "❌Не подписан")
     elif old_status == "restricted" and new_status == "member":
         print(f"✅ Заявку користувача {user_name} прійнято")
 
@@ -867,7 +856,7 @@ async def handle_chat_member_update(update: types.ChatMemberUpdated):
 @router.callback_query(lambda c: c.data == "answers")
 async def handle_answers_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    update_user_status_by_action(user_id, "answers_viewed")
+    await update_user_status_by_action(user_id, "answers_viewed")
     await callback.message.delete()
     await send_answers_message_with_sequence(callback.message, from_welcome=True)
 
@@ -875,7 +864,7 @@ async def handle_answers_callback(callback: types.CallbackQuery):
 @router.callback_query(lambda c: c.data == "private_lesson")
 async def handle_private_lesson_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    update_user_status_by_action(user_id, "private_lesson_viewed")
+    await update_user_status_by_action(user_id, "private_lesson_viewed")
     await callback.message.delete()
     await send_private_lesson_message_with_sequence(callback.message, from_welcome=True)
 
@@ -883,7 +872,7 @@ async def handle_private_lesson_callback(callback: types.CallbackQuery):
 @router.callback_query(lambda c: c.data == "tariffs")
 async def handle_tariffs_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    update_user_status_by_action(user_id, "tariffs_viewed")
+    await update_user_status_by_action(user_id, "tariffs_viewed")
     await callback.message.delete()
     await send_tariffs_message_with_sequence(callback.message, from_welcome=True)
 
@@ -891,7 +880,7 @@ async def handle_tariffs_callback(callback: types.CallbackQuery):
 @router.callback_query(lambda c: c.data == "private_lesson_sequence")
 async def handle_private_lesson_sequence_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    update_user_status_by_action(user_id, "private_lesson_viewed")
+    await update_user_status_by_action(user_id, "private_lesson_viewed")
     await callback.message.delete()
     await send_private_lesson_message_with_sequence(callback.message)
 
@@ -899,7 +888,7 @@ async def handle_private_lesson_sequence_callback(callback: types.CallbackQuery)
 @router.callback_query(lambda c: c.data == "tariffs_sequence")
 async def handle_tariffs_sequence_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    update_user_status_by_action(user_id, "tariffs_viewed")
+    await update_user_status_by_action(user_id, "tariffs_viewed")
     await callback.message.delete()
     await send_tariffs_message_with_sequence(callback.message)
 
@@ -907,7 +896,7 @@ async def handle_tariffs_sequence_callback(callback: types.CallbackQuery):
 @router.callback_query(lambda c: c.data == "clothes")
 async def handle_clothes_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    update_user_status_by_action(user_id, "clothes_tariff_viewed")
+    await update_user_status_by_action(user_id, "clothes_tariff_viewed")
     await callback.message.delete()
     await send_clothes_tariff_message(callback.message)
 
@@ -915,7 +904,7 @@ async def handle_clothes_callback(callback: types.CallbackQuery):
 @router.callback_query(lambda c: c.data == "tech")
 async def handle_tech_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    update_user_status_by_action(user_id, "tech_tariff_viewed")
+    await update_user_status_by_action(user_id, "tech_tariff_viewed")
     await callback.message.delete()
     await send_tech_tariff_message(callback.message)
 
@@ -923,7 +912,7 @@ async def handle_tech_callback(callback: types.CallbackQuery):
 @router.callback_query(lambda c: c.data == "pay_clothes")
 async def handle_pay_clothes_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
-    update_user_status_by_action(user_id, "clothes_payment_clicked")
+    await update_user_status_by_action(user_id, "clothes_payment_clicked")
     await callback.message.delete()
     await send_clothes_payment_message(callback.message)
 
@@ -932,7 +921,7 @@ async def handle_pay_clothes_callback(callback: types.CallbackQuery):
 async def handle_pay_tech(callback_query: types.CallbackQuery):
     user_id = callback_query.from_user.id
     await callback_query.message.delete()
-    update_user_status_by_action(user_id, "tech_payment_clicked")
+    await update_user_status_by_action(user_id, "tech_payment_clicked")
     
     await send_tech_payment_message(callback_query.message)
     await callback_query.answer()
@@ -956,21 +945,17 @@ async def handle_back_to_tariffs(callback_query: types.CallbackQuery):
 
 async def on_startup(router):
     me = await bot.get_me()
-    create_settings_table()
-    create_table()
-
-    create_mailings_table()
-    create_recurring_mailings_table()
-
-    create_admin_credentials_table()
-    create_start_params_table()
+    run_migrations()
 
-    create_welcome_without_subscription_table()
-    create_subscription_messages_table()
+    user_updates.start()
+    await user_states.start()
 
 
     print(f'Bot: @{me.username} запущений!')
 
 async def on_shutdown(router):
     me = await bot.get_me()
+    await user_states.stop()
+    await user_updates.stop()
+    await flush_db()
     print(f'Bot: @{me.username} зупинений!')
@@ -2,10 +2,10 @@ import asyncio
 import logging
 from aiogram import types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database.client_db import update_user_status_by_action
-from utils.video_cache import send_video_with_caching
+from database.async_db import update_user_status_by_action
+from utils.video_cache import send_video_with_caching, cached_media
 from keyboards.client_keyboards import create_channel_keyboard, create_inline_only_keyboard
-from database.settings_db import get_answers_config, get_private_lesson_config, get_tariffs_config, get_clothes_tariff_config, get_tech_tariff_config, get_clothes_payment_config, get_tech_payment_config
+from database.async_db import get_answers_config, get_private_lesson_config, get_tariffs_config, get_clothes_tariff_config, get_tech_tariff_config, get_clothes_payment_config, get_tech_payment_config, get_tariff_selection_buttons_config
 
 async def check_user_subscription(bot, user_id: int, channel_id: str) -> bool:
     try:
@@ -32,14 +32,14 @@ async def send_welcome_without_subscription(message: types.Message, welcome_conf
             if media_type == "photo":
                 if media_url.startswith(('http://', 'https://')):
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=channel_keyboard
                     )
                 else:
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=channel_keyboard
@@ -78,7 +78,7 @@ async def send_welcome_without_subscription(message: types.Message, welcome_conf
 
 async def send_answers_message_with_sequence(message: types.Message, from_welcome: bool = False):
     try:
-        config = get_answers_config()
+        config = await get_answers_config()
         
         message_text = config["message"]
         media_type = config["media_type"]
@@ -98,7 +98,7 @@ async def send_answers_message_with_sequence(message: types.Message, from_welcom
             if media_type == "photo":
                 if media_url.startswith(('http://', 'https://')):
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -106,7 +106,7 @@ async def send_answers_message_with_sequence(message: types.Message, from_welcom
                 else:
                     # Це file_id
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -135,8 +135,8 @@ async def send_answers_message_with_sequence(message: types.Message, from_welcom
 
 async def send_private_lesson_message_with_sequence(message: types.Message, from_welcome: bool = False):
     try:
-        config = get_private_lesson_config()
-        update_user_status_by_action(message.from_user.id, "private_lesson_viewed")
+        config = await get_private_lesson_config()
+        await update_user_status_by_action(message.from_user.id, "private_lesson_viewed")
         
         message_text = config["message"]
         media_type = config["media_type"]
@@ -157,7 +157,7 @@ async def send_private_lesson_message_with_sequence(message: types.Message, from
                 # Перевіряємо чи це file_id або URL
                 if media_url.startswith(('http://', 'https://')):
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -165,7 +165,7 @@ async def send_private_lesson_message_with_sequence(message: types.Message, from
                 else:
                     # Це file_id
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -194,18 +194,16 @@ async def send_private_lesson_message_with_sequence(message: types.Message, from
 
 async def send_tariffs_message_with_sequence(message: types.Message, from_welcome: bool = False):
     try:
-        from database.settings_db import get_tariffs_config, get_clothes_tariff_config, get_tech_tariff_config
-        config = get_tariffs_config()
-        clothes_config = get_clothes_tariff_config()
-        tech_config = get_tech_tariff_config()
+        config = await get_tariffs_config()
+        clothes_config = await get_clothes_tariff_config()
+        tech_config = await get_tech_tariff_config()
         
         message_text = config["message"]
         media_type = config["media_type"]
         media_url = config["media_url"]
         
         # Отримуємо назви кнопок ВИБОРУ тарифів з бази даних
-        from database.settings_db import get_tariff_selection_buttons_config
-        selection_buttons_config = get_tariff_selection_buttons_config()
+        selection_buttons_config = await get_tariff_selection_buttons_config()
         
         clothes_button_text = selection_buttons_config.get("clothes_selection_button_text", "👗 Тариф Одежда")
         tech_button_text = selection_buttons_config.get("tech_selection_button_text", "🔧 Тариф Техника")
@@ -225,7 +223,7 @@ async def send_tariffs_message_with_sequence(message: types.Message, from_welcom
             if media_type == "photo":
                 if media_url.startswith(('http://', 'https://')):
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -233,7 +231,7 @@ async def send_tariffs_message_with_sequence(message: types.Message, from_welcom
                 else:
                     # Це file_id
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -264,9 +262,9 @@ async def send_tariffs_message_with_sequence(message: types.Message, from_welcom
 
 async def send_clothes_tariff_message(message: types.Message):
     try:
-        config = get_clothes_tariff_config()
+        config = await get_clothes_tariff_config()
         
-        update_user_status_by_action(message.from_user.id, "clothes_tariff_viewed")
+        await update_user_status_by_action(message.from_user.id, "clothes_tariff_viewed")
         
         message_text = config.get("message", "👗 <b>Тариф 'Одежда'</b>\n\nОпис тарифу для категорії одягу...")
         media_type = config.get("media_type", "none")
@@ -284,7 +282,7 @@ async def send_clothes_tariff_message(message: types.Message):
                 # Перевіряємо чи це file_id або URL
                 if media_url.startswith(('http://', 'https://')):
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -292,7 +290,7 @@ async def send_clothes_tariff_message(message: types.Message):
                 else:
                     # Це file_id
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -321,9 +319,9 @@ async def send_clothes_tariff_message(message: types.Message):
 
 async def send_tech_tariff_message(message: types.Message):
     try:
-        config = get_tech_tariff_config()
+        config = await get_tech_tariff_config()
         
-        update_user_status_by_action(message.from_user.id, "tech_tariff_viewed")
+        await update_user_status_by_action(message.from_user.id, "tech_tariff_viewed")
         
         message_text = config.get("message", "🔧 <b>Тариф 'Техника'</b>\n\nОпис тарифу для технічних товарів...")
         media_type = config.get("media_type", "none")
@@ -340,14 +338,14 @@ async def send_tech_tariff_message(message: types.Message):
             if media_type == "photo":
                 if media_url.startswith(('http://', 'https://')):
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
                     )
                 else:
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -376,9 +374,9 @@ async def send_tech_tariff_message(message: types.Message):
 
 async def send_clothes_payment_message(message: types.Message):
     try:
-        config = get_clothes_payment_config()
+        config = await get_clothes_payment_config()
         
-        update_user_status_by_action(message.from_user.id, "clothes_payment_clicked")
+        await update_user_status_by_action(message.from_user.id, "clothes_payment_clicked")
         
         message_text = config.get("message", "💳 <b>Оплата тарифу 'Одежда'</b>\n\nІнформація про оплату...")
         media_type = config.get("media_type", "none")
@@ -398,14 +396,14 @@ async def send_clothes_payment_message(message: types.Message):
             if media_type == "photo":
                 if media_url.startswith(('http://', 'https://')):
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
                     )
                 else:
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
@@ -434,9 +432,9 @@ async def send_clothes_payment_message(message: types.Message):
 
 async def send_tech_payment_message(message: types.Message):
     try:
-        config = get_tech_payment_config()
+        config = await get_tech_payment_config()
         
-        update_user_status_by_action(message.from_user.id, "tech_payment_clicked")
+        await update_user_status_by_action(message.from_user.id, "tech_payment_clicked")
         
         message_text = config.get("message", "💳 <b>Оплата тарифу 'Техника'</b>\n\nІнформація про оплату...")
         media_type = config.get("media_type", "none")
@@ -456,14 +454,14 @@ async def send_tech_payment_message(message: types.Message):
             if media_type == "photo":
                 if media_url.startswith(('http://', 'https://')):
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
                     )
                 else:
                     await message.answer_photo(
-                        photo=media_url,
+                        photo=await cached_media('photo', media_url),
                         caption=message_text,
                         parse_mode="HTML",
                         reply_markup=keyboard
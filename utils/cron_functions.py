@@ -1,38 +1,46 @@
-import asyncio
 import json
+import time
 from aiogram import Bot
-from database.settings_db import get_mailing_by_id, update_mailing_users_count
-from database.client_db import get_all_users, get_users_by_status
+from aiogram.types import URLInputFile
+from database.settings_db import (
+    get_mailing_by_id, update_mailing_users_count, fill_mailing_deliveries, reset_mailing_deliveries,
+    has_pending_deliveries, get_pending_deliveries, mark_mailing_deliveries, get_mailing_delivery_stats,
+    start_mailing_progress, update_mailing_progress, set_mailing_template
+)
 from keyboards.client_keyboards import create_custom_keyboard
-from utils.video_cache import send_video_with_caching_for_mailing
+from utils.video_cache import (
+    media_cache, materialize_media, send_media, media_from_message, url_input_file, MEDIA_TYPES
+)
+from utils.mailing_engine import BroadcastEngine, SENT, BLOCKED
+from utils.mailing_audience import get_mailing_audience
+from config import MEDIA_STORAGE_CHAT_ID, MAILING_TEMPLATE_CHAT_ID
 
 
-def get_filtered_users(mailing):
-    """Отримує користувачів з урахуванням фільтрів розсилки"""
-    user_filter = mailing.get("user_filter", "all")
+RECIPIENTS_CHUNK_SIZE = 1000
+RESULTS_BATCH_SIZE = 100
+MEDIA_UPLOAD_ATTEMPTS = 3
+
+
+async def prepare_mailing_template(bot: Bot, mailing: dict, media_type: str, media_url: str):
+    """Для режиму copy_message: (chat_id, message_id) шаблону розсилки у службовому чаті.
+    Шаблон публікується один раз і перевикористовується, поки розсилку не змінили."""
+    if mailing.get("template_message_id") and mailing.get("template_chat_id") == MAILING_TEMPLATE_CHAT_ID:
+        return mailing["template_chat_id"], mailing["template_message_id"]
     
-    if user_filter == "all":
-        return get_all_users()
-    elif user_filter == "status":
-        user_status = mailing.get("user_status", "")
-        if user_status:
-            statuses = user_status.split(',')
-            users = []
-            for status in statuses:
-                status_users = get_users_by_status(status.strip())
-                users.extend(status_users)
-            # Видаляємо дублікати користувачів
-            unique_users = []
-            seen_ids = set()
-            for user in users:
-                if user[0] not in seen_ids:  # user[0] - це Telegram ID
-                    unique_users.append(user)
-                    seen_ids.add(user[0])
-            return unique_users
-        return get_all_users()
+    if media_type:
+        media = media_url
+        if media_url.startswith(('http://', 'https://')):
+            media = await media_cache.get(bot.id, media_type, media_url) or url_input_file(media_url, media_type)
+        sent_message = await send_media(bot, MAILING_TEMPLATE_CHAT_ID, media_type, media,
+                                        caption=mailing["message_text"], parse_mode="HTML")
+        uploaded = media_from_message(sent_message, media_type)
+        if uploaded is not None and isinstance(media, URLInputFile):
+            await media_cache.set(bot.id, media_type, media_url, uploaded)
+    else:
+        sent_message = await bot.send_message(MAILING_TEMPLATE_CHAT_ID, mailing["message_text"], parse_mode="HTML")
     
-    return get_all_users()
-
+    set_mailing_template(mailing["id"], MAILING_TEMPLATE_CHAT_ID, sent_message.message_id)
+    return MAILING_TEMPLATE_CHAT_ID, sent_message.message_id
 
 
 async def send_mailing_to_users(bot: Bot, mailing_id: int) -> bool:
@@ -42,31 +50,20 @@ async def send_mailing_to_users(bot: Bot, mailing_id: int) -> bool:
             print(f"Mailing with ID {mailing_id} not found")
             return False
         
-        # Отримуємо користувачів з урахуванням фільтрів
-        users = get_filtered_users(mailing)
-        if not users:
-            print("❌ No users found after filtering")
-            return False
-        
-        print(f"🔍 Отримано {len(users)} користувачів після фільтрації")
-        if users:
-            print(f"🔍 Приклад структури користувача: {users[0]}")
-            print(f"🔍 user[0] (Telegram ID): {users[0][0]}")
-            print(f"🔍 user[1] (username): {users[0][1]}")
-        
-        # Фільтруємо користувачів з валідними ID
-        valid_users = []
-        for user in users:
-            if user and len(user) > 0 and user[0] is not None:
-                valid_users.append(user)
-            else:
-                print(f"⚠️ Пропускаємо користувача з невалідними даними: {user}")
-        
-        if not valid_users:
-            print("❌ No valid users found after ID validation")
-            return False
-        
-        print(f"📊 Знайдено {len(valid_users)} валідних користувачів для розсилки")
+        if has_pending_deliveries(mailing_id):
+            # Попередній запуск перервався - продовжуємо з невідправлених
+            print(f"🔁 Продовжуємо розсилку {mailing_id} з місця зупинки")
+        else:
+            # Заповнюємо чергу порціями, не тримаючи всіх користувачів у пам'яті
+            reset_mailing_deliveries(mailing_id)
+            users_found = 0
+            for chunk in get_mailing_audience(mailing, chunk_size=RECIPIENTS_CHUNK_SIZE):
+                users_found += fill_mailing_deliveries(mailing_id, chunk)
+            
+            if not users_found:
+                print("❌ No users found after filtering")
+                return False
+            print(f"📊 Знайдено {users_found} валідних користувачів для розсилки")
         
         keyboard = None
         
@@ -77,92 +74,144 @@ async def send_mailing_to_users(bot: Bot, mailing_id: int) -> bool:
             except json.JSONDecodeError as e:
                 keyboard = None
         
-        success_count = 0
-        error_count = 0
+        media_type = mailing.get("media_type")
+        media_url = (mailing.get("media_url") or "").strip()
+        if media_type not in MEDIA_TYPES or not media_url:
+            media_type = None
         
-        for user in valid_users:
-            user_id = user[0]  # user_id - це Telegram ID, знаходиться в позиції [0]
+        template = None
+        if mailing.get("broadcast_mode") == "copy":
+            if MAILING_TEMPLATE_CHAT_ID:
+                try:
+                    template = await prepare_mailing_template(bot, mailing, media_type, media_url)
+                except Exception as e:
+                    print(f"⚠️ Розсилка {mailing_id}: не вдалося опублікувати шаблон, відправляємо звичайно: {e}")
+            else:
+                print(f"⚠️ Розсилка {mailing_id}: MAILING_TEMPLATE_CHAT_ID не задано, відправляємо звичайно")
+        
+        # Медіа за URL один раз перетворюємо на file_id ще до розсилки,
+        # щоб Telegram не тягнув файл з нашого хостингу для кожного отримувача
+        media = {'ref': media_url}
+        if not template and media_type and media_url.startswith(('http://', 'https://')):
+            media['ref'] = await media_cache.get(bot.id, media_type, media_url)
+            if not media['ref'] and MEDIA_STORAGE_CHAT_ID:
+                try:
+                    media['ref'] = await materialize_media(bot, MEDIA_STORAGE_CHAT_ID, media_type, media_url)
+                except Exception as e:
+                    print(f"⚠️ Розсилка {mailing_id}: не вдалося завантажити медіа в службовий чат: {e}")
+        
+        async def send_to_user(user_id: int):
+            if template:
+                # Копія шаблону: у запиті лише посилання на повідомлення і клавіатура
+                await bot.copy_message(
+                    chat_id=user_id,
+                    from_chat_id=template[0],
+                    message_id=template[1],
+                    reply_markup=keyboard
+                )
+            elif media_type:
+                await send_media(
+                    bot,
+                    user_id,
+                    media_type,
+                    media['ref'],
+                    caption=mailing["message_text"],
+                    parse_mode="HTML",
+                    reply_markup=keyboard
+                )
+            else:
+                # Відправляємо текст без медіа
+                await bot.send_message(
+                    chat_id=user_id,
+                    text=mailing["message_text"],
+                    parse_mode="HTML",
+                    reply_markup=keyboard
+                )
+        
+        async def upload_to_user(user_id: int):
+            # Файлу ще немає в Telegram: завантажуємо його першому отримувачу і беремо file_id
+            sent_message = await send_media(
+                bot,
+                user_id,
+                media_type,
+                url_input_file(media_url, media_type),
+                caption=mailing["message_text"],
+                parse_mode="HTML",
+                reply_markup=keyboard
+            )
+            uploaded = media_from_message(sent_message, media_type)
+            if uploaded is not None:
+                media['ref'] = await media_cache.set(bot.id, media_type, media_url, uploaded)
+        
+        # Лічильники для панелі прогресу: стартуємо з уже записаних результатів,
+        # щоб при продовженні розсилки відправлені раніше теж враховувались
+        counters = get_mailing_delivery_stats(mailing_id)
+        total = sum(counters.values())
+        start_mailing_progress(mailing_id, counters)
+        window = {'at': time.monotonic(), 'done': total - counters['pending'], 'rate': 0.0}
+        results_batch = []
+        
+        def flush_results():
+            mark_mailing_deliveries(mailing_id, results_batch)
             
-            # Пропускаємо користувачів з невалідним ID
-            if not user_id or user_id is None:
-                print(f"⚠️ Пропускаємо користувача з невалідним ID: {user}")
-                error_count += 1
-                continue
+            # Швидкість за останню пачку, згладжена, щоб ETA не стрибав
+            now = time.monotonic()
+            done = counters['sent'] + counters['failed'] + counters['blocked']
+            elapsed = now - window['at']
+            if elapsed > 0 and done > window['done']:
+                current = (done - window['done']) / elapsed
+                window['rate'] = current if not window['rate'] else 0.3 * current + 0.7 * window['rate']
+            window['at'], window['done'] = now, done
             
-            try:
-                if mailing.get("media_type") == "photo" and mailing.get("media_url"):
-                    media_url = mailing["media_url"].strip()
-                    if not media_url:
-                        print(f"⚠️ Пропускаємо фото без URL/file_id для користувача {user_id}")
-                        error_count += 1
-                        continue
-                    
-                    # Перевіряємо чи це file_id або URL
-                    if media_url.startswith(('http://', 'https://')):
-                        # Це URL - відправляємо по посиланню
-                        await bot.send_photo(
-                            chat_id=user_id,
-                            photo=media_url,
-                            caption=mailing["message_text"],
-                            parse_mode="HTML",
-                            reply_markup=keyboard
-                        )
-                        print(f"✅ Фото відправлено користувачу {user_id} по URL")
-                    else:
-                        # Це file_id - відправляємо по file_id
-                        await bot.send_photo(
-                            chat_id=user_id,
-                            photo=media_url,
-                            caption=mailing["message_text"],
-                            parse_mode="HTML",
-                            reply_markup=keyboard
-                        )
-                        print(f"✅ Фото відправлено користувачу {user_id} по file_id")
-                        
-                elif mailing.get("media_type") == "video" and mailing.get("media_url"):
-                    media_url = mailing["media_url"].strip()
-                    if not media_url:
-                        print(f"⚠️ Пропускаємо відео без URL/file_id для користувача {user_id}")
-                        error_count += 1
-                        continue
-                    
-                    cache_key = f"mailing_video_{mailing_id}"
-                    success = await send_video_with_caching_for_mailing(
-                        bot,
-                        user_id,
-                        media_url,  # media_url або file_id
-                        mailing["message_text"],
-                        keyboard,
-                        cache_key
-                    )
-                    
-                    if not success:
-                        print(f"❌ Не вдалося відправити відео користувачу {user_id}")
-                        error_count += 1
-                        continue
-                    else:
-                        print(f"✅ Відео відправлено користувачу {user_id}")
-                        
-                else:
-                    # Відправляємо текст без медіа
-                    await bot.send_message(
-                        chat_id=user_id,
-                        text=mailing["message_text"],
-                        parse_mode="HTML",
-                        reply_markup=keyboard
-                    )
-                    print(f"✅ Текст відправлено користувачу {user_id}")
-                
-                success_count += 1
-                
-                await asyncio.sleep(0.1)
-                
-            except Exception as e:
-                print(f"❌ Помилка відправки користувачу {user_id}: {e}")
-                error_count += 1
-                continue
+            update_mailing_progress(mailing_id, counters['sent'], counters['failed'], counters['blocked'],
+                                    window['rate'])
+            if results_batch:
+                print(f"📤 Розсилка {mailing_id}: {done}/{total} (⚡ {window['rate']:.1f} повідомлень/с)")
+            results_batch.clear()
+        
+        def record_result(user_id, outcome, error):
+            counters[outcome if outcome in (SENT, BLOCKED) else 'failed'] += 1
+            results_batch.append((user_id, outcome, str(error) if error else None))
+            if len(results_batch) >= RESULTS_BATCH_SIZE:
+                flush_results()
+        
+        def pending_recipients():
+            last_user_id = 0
+            while True:
+                chunk = get_pending_deliveries(mailing_id, last_user_id, RECIPIENTS_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield from chunk
+                last_user_id = chunk[-1]
+        
+        engine = BroadcastEngine()
+        recipients = pending_recipients()
+        
+        try:
+            # Без file_id завантажуємо файл по одному отримувачу, поки не отримаємо file_id,
+            # інакше кожен воркер завантажував би той самий файл паралельно
+            attempts = 0
+            while media['ref'] is None and attempts < MEDIA_UPLOAD_ATTEMPTS:
+                first = next(recipients, None)
+                if first is None:
+                    break
+                attempts += 1
+                await engine.run([first], upload_to_user, record_result)
+            if media['ref'] is None:
+                # Не вдалося - далі Telegram завантажуватиме файл за URL сам
+                media['ref'] = media_url
+            
+            result = await engine.run(recipients, send_to_user, record_result)
+        finally:
+            flush_results()
         
-        update_mailing_users_count(mailing_id, success_count)
+        update_mailing_progress(mailing_id, counters['sent'], counters['failed'], counters['blocked'],
+                                result.rate, finished=True)
+        
+        stats = get_mailing_delivery_stats(mailing_id)
+        success_count = stats['sent']
+        
+        update_mailing_users_count(mailing_id)
         
         if success_count > 0 and mailing.get("is_recurring"):
             from database.settings_db import schedule_next_recurring
@@ -176,95 +225,14 @@ async def send_mailing_to_users(bot: Bot, mailing_id: int) -> bool:
             print(f"✅ Розсилка {mailing_id} завершена успішно")
         
         print(f"📊 Результати розсилки {mailing_id}:")
-        print(f"   ✅ Успішно відправлено: {success_count}")
-        print(f"   ❌ Помилки: {error_count}")
-        print(f"   📊 Всього користувачів: {len(valid_users)}")
+        print(f"   ✅ Успішно відправлено: {stats['sent']}")
+        print(f"   ❌ Помилки: {stats['failed']}")
+        print(f"   🚫 Заблокували бота: {stats['blocked']}")
+        print(f"   📊 Всього користувачів: {sum(stats.values())}")
+        print(f"   ⚡ Швидкість: {result.rate:.1f} повідомлень/с")
         
         return True
         
     except Exception as e:
         print(f"❌ Розсилка {mailing_id}: {e}")
         return False
-
-
-async def process_pending_mailings(bot: Bot) -> None:
-    from database.settings_db import get_scheduled_mailings, update_mailing_status, schedule_next_recurring
-    from datetime import datetime
-    import pytz
-    
-    try:
-        kyiv_tz = pytz.timezone('Europe/Kiev')
-        current_time = datetime.now(kyiv_tz)
-        
-        scheduled_mailings = get_scheduled_mailings()
-        print(f"📅 Знайдено {len(scheduled_mailings)} запланованих розсилок")
-        
-        for mailing in scheduled_mailings:
-            mailing_id = mailing[0]
-            scheduled_at_str = mailing[10]
-            is_recurring = mailing[13] if len(mailing) > 13 else False
-            next_scheduled_str = mailing[17] if len(mailing) > 17 else None
-            
-            print(f"📋 Розсилка {mailing_id}: scheduled_at={scheduled_at_str}, is_recurring={is_recurring}, next_scheduled={next_scheduled_str}")
-            
-            if is_recurring and next_scheduled_str:
-                try:
-                    if 'T' in next_scheduled_str:
-                        next_scheduled = datetime.fromisoformat(next_scheduled_str.replace('Z', '+00:00'))
-                        next_scheduled = pytz.utc.localize(next_scheduled).astimezone(kyiv_tz)
-                    else:
-                        next_scheduled = datetime.strptime(next_scheduled_str, '%Y-%m-%d %H:%M:%S')
-                        next_scheduled = kyiv_tz.localize(next_scheduled)
-                    
-                    if current_time >= next_scheduled:
-                        print(f"🔄 Запускаємо повторювану розсилку {mailing_id}")
-                        success = await send_mailing_to_users(bot, mailing_id)
-                        
-                        if success:
-                            update_mailing_status(mailing_id, 'sent')
-                            print(f"✅ Повторювана розсилка {mailing_id} успішно відправлена")
-                            
-                            try:
-                                next_scheduled = schedule_next_recurring(mailing_id)
-                                if next_scheduled:
-                                    print(f"✅ Наступна повторювана розсилка {mailing_id} запланована успішно")
-                            except Exception as e:
-                                print(f"❌ Помилка при плануванні наступної повторюваної розсилки {mailing_id}: {e}")
-                        else:
-                            update_mailing_status(mailing_id, 'failed')
-                            print(f"❌ Повторювана розсилка {mailing_id} не вдалася")
-                    
-                except Exception as e:
-                    print(f"❌ Помилка при обробці розсилки {mailing_id}: {e}")
-                    continue
-            
-            elif scheduled_at_str:
-                try:
-                    if 'T' in scheduled_at_str:
-                        scheduled_at = datetime.fromisoformat(scheduled_at_str.replace('Z', '+00:00'))
-                        scheduled_at = pytz.utc.localize(scheduled_at).astimezone(kyiv_tz)
-                    else:
-                        scheduled_at = datetime.strptime(scheduled_at_str, '%Y-%m-%d %H:%M:%S')
-                        scheduled_at = kyiv_tz.localize(scheduled_at)
-                    
-                    if current_time >= scheduled_at:
-                        print(f"📅 Запускаємо заплановану розсилку {mailing_id}")
-                        success = await send_mailing_to_users(bot, mailing_id)
-                        
-                        if success:
-                            update_mailing_status(mailing_id, 'sent')
-                            print(f"✅ Запланована розсилка {mailing_id} успішно відправлена")
-                        else:
-                            update_mailing_status(mailing_id, 'failed')
-                            print(f"❌ Запланована розсилка {mailing_id} не вдалася")
-                    
-                except Exception as e:
-                    print(f"❌ Помилка при обробці звичайної розсилки {mailing_id}: {e}")
-                    continue
-        
-    except Exception as e:
-        print(f"❌ Помилка при обробці запланованих розсилок: {e}")
-
-
-async def check_and_send_scheduled_mailings(bot: Bot) -> None:
-    await process_pending_mailings(bot)
@@ -0,0 +1,36 @@
+import json
+from database.client_db import iter_user_id_chunks, compile_audience_filter, count_users_where
+
+
+def _split_filter(value) -> list:
+    return [item.strip() for item in (value or "").split(',') if item.strip()]
+
+
+def compile_mailing_audience(mailing) -> tuple:
+    """Перетворює фільтри розсилки на умову WHERE для таблиці users"""
+    statuses = _split_filter(mailing.get("user_status")) if mailing.get("user_filter") == "status" else None
+    
+    try:
+        extra = json.loads(mailing.get("audience_filter") or "{}")
+    except json.JSONDecodeError:
+        extra = {}
+    
+    return compile_audience_filter(
+        statuses=statuses,
+        start_params=_split_filter(mailing.get("start_param_filter")),
+        subscription_statuses=extra.get("subscription_statuses"),
+        joined_from=extra.get("joined_from"),
+        joined_to=extra.get("joined_to"),
+        active_from=extra.get("active_from"),
+        active_to=extra.get("active_to")
+    )
+
+
+def get_mailing_audience(mailing, count_only: bool = False, chunk_size: int = 1000):
+    """Аудиторія розсилки одним запитом: кількість (count_only=True)
+    або порції user_id для заповнення черги відправки
+    """
+    where, params = compile_mailing_audience(mailing)
+    if count_only:
+        return count_users_where(where, params)
+    return iter_user_id_chunks(where, params, chunk_size)
@@ -0,0 +1,168 @@
+import asyncio
+import time
+from typing import AsyncIterable, Awaitable, Callable, Iterable, Optional, Union
+
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+    TelegramRetryAfter, TelegramServerError
+)
+
+
+# Telegram дозволяє боту ~30 повідомлень на секунду різним чатам.
+# Ліміт ~1 повідомлення на секунду в один чат розсилку не стосується: кожен
+# отримувач трапляється в ній один раз, а повтор іде лише після паузи
+GLOBAL_RATE_LIMIT = 28
+MAX_IN_FLIGHT = 20
+MAX_ATTEMPTS = 3
+
+SENT = "sent"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+
+class TokenBucket:
+    """Глобальний лімітер швидкості відправки (token bucket)"""
+
+    def __init__(self, rate: float = GLOBAL_RATE_LIMIT, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def pause(self, seconds: float) -> None:
+        """Зупиняє видачу токенів для всіх воркерів (після RetryAfter)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    self.updated_at = time.monotonic()
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastResult:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        return self.total / self.elapsed if self.elapsed > 0 else 0.0
+
+    def add(self, outcome: str) -> None:
+        if outcome == SENT:
+            self.sent += 1
+        elif outcome == BLOCKED:
+            self.blocked += 1
+        else:
+            self.failed += 1
+
+
+class BroadcastEngine:
+    """Розсилка з обмеженим пулом одночасних відправок.
+
+    Воркери беруть chat_id з черги, чекають на токен глобального лімітера,
+    а на TelegramRetryAfter зупиняють весь пул на вказаний Telegram час
+    і повторюють спробу.
+    """
+
+    def __init__(self, rate: float = GLOBAL_RATE_LIMIT, concurrency: int = MAX_IN_FLIGHT,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+    async def _deliver(self, chat_id: int, send: Callable[[int], Awaitable]) -> tuple:
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            await self.bucket.acquire()
+            try:
+                await send(chat_id)
+                return SENT, None
+            except TelegramRetryAfter as e:
+                print(f"⏳ Flood control: пауза {e.retry_after} с (чат {chat_id})")
+                self.bucket.pause(e.retry_after)
+                error = e
+            except TelegramForbiddenError as e:
+                return BLOCKED, e
+            except TelegramBadRequest as e:
+                return FAILED, e
+            except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+                error = e
+                await asyncio.sleep(attempt)
+            except Exception as e:
+                return FAILED, e
+        return FAILED, error
+
+    async def run(self, recipients: Union[Iterable[int], AsyncIterable[int]],
+                  send: Callable[[int], Awaitable],
+                  on_result: Optional[Callable[[int, str, Optional[Exception]], None]] = None) -> BroadcastResult:
+        result = BroadcastResult()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if chat_id is None:
+                        return
+                    outcome, error = await self._deliver(chat_id, send)
+                    result.add(outcome)
+                    if on_result:
+                        on_result(chat_id, outcome, error)
+                finally:
+                    queue.task_done()
+
+        async def producer():
+            if hasattr(recipients, '__aiter__'):
+                async for chat_id in recipients:
+                    await queue.put(chat_id)
+            else:
+                for chat_id in recipients:
+                    await queue.put(chat_id)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        tasks = [asyncio.create_task(producer())]
+        tasks += [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            # Падіння будь-якого воркера зупиняє всю розсилку, а не блокує продюсера
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if not task.cancelled() and task.exception():
+                    raise task.exception()
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        result.finished_at = time.monotonic()
+        return result
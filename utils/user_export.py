@@ -0,0 +1,53 @@
+import csv
+import io
+import os
+import tempfile
+from typing import Iterator
+
+from openpyxl import Workbook
+
+from database.client_db import iter_users_for_export
+
+
+EXPORT_COLUMNS = ['user_id', 'user_name', 'join_date', 'last_activity', 'start_param', 'status', 'subscription_status']
+
+
+def iter_users_csv(chunk_size: int = 1000) -> Iterator[str]:
+    """CSV з користувачами порціями рядків - для потокової відповіді Flask.
+    Пам'ять не залежить від кількості користувачів.
+    """
+    # BOM, щоб Excel відкрив кирилицю в UTF-8
+    buffer = io.StringIO()
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+
+    for rows in iter_users_for_export(chunk_size):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_users_xlsx(chunk_size: int = 1000) -> str:
+    """Пише користувачів у власний тимчасовий .xlsx і повертає шлях (файл видаляє викликач).
+    write_only-книга скидає рядки на диск, тож пам'ять не росте з розміром таблиці.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Users')
+    sheet.append(EXPORT_COLUMNS)
+    for rows in iter_users_for_export(chunk_size):
+        for row in rows:
+            sheet.append(row)
+
+    fd, path = tempfile.mkstemp(prefix='users_export_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
@@ -0,0 +1,171 @@
+import asyncio
+import heapq
+import time
+from typing import Optional
+from database.async_db import run_db
+from database.user_states_db import save_user_state, delete_user_state, load_user_states, delete_expired_user_states
+
+
+USER_STATE_TTL = 24 * 3600
+SWEEP_INTERVAL = 60
+STATS_LOG_INTERVAL = 3600
+
+
+class UserState:
+    __slots__ = ('state', 'chat_id', 'channel_id', 'captcha_message_id', 'expires_at')
+
+    def __init__(self, state: str, chat_id: int = None, channel_id=None,
+                 captcha_message_id: int = None, expires_at: int = 0):
+        self.state = state
+        self.chat_id = chat_id
+        self.channel_id = channel_id
+        self.captcha_message_id = captcha_message_id
+        self.expires_at = expires_at
+
+
+class UserStateStore:
+    """Стани користувачів (капча, очікування заявки в канал) з терміном дії.
+
+    Запис живе ttl секунд від останнього set(): користувачі, що не пройшли
+    капчу, не накопичуються в пам'яті. Прострочені записи прибирає фоновий
+    прохід по купі (expires_at, user_id), а get() їх просто не повертає.
+    З persist=True кожна зміна одразу пишеться в user_states, і після
+    перезапуску бота start() підвантажує непрострочені стани.
+    """
+
+    def __init__(self, ttl: int = USER_STATE_TTL, sweep_interval: float = SWEEP_INTERVAL, persist: bool = True,
+                 stats_interval: float = STATS_LOG_INTERVAL):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.stats_interval = stats_interval
+        self.persist = persist
+        self._states = {}  # user_id -> UserState
+        self._expiry = []  # купа (expires_at, user_id); застарілі елементи пропускаються при проході
+        self._evictions = 0
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    @staticmethod
+    def _now() -> int:
+        return int(time.time())
+
+    def _schedule(self, user_id: int, record: UserState) -> None:
+        heapq.heappush(self._expiry, (record.expires_at, user_id))
+        # Кожен set() додає елемент у купу; якщо застарілих забагато - перебудовуємо
+        if len(self._expiry) > 2 * len(self._states) + 1024:
+            self._expiry = [(r.expires_at, uid) for uid, r in self._states.items()]
+            heapq.heapify(self._expiry)
+
+    async def _save(self, user_id: int, record: UserState) -> None:
+        if not self.persist:
+            return
+        try:
+            await run_db(save_user_state, user_id, record.state, record.chat_id, record.channel_id,
+                         record.captcha_message_id, record.expires_at)
+        except Exception as e:
+            print(f"❌ Не вдалося зберегти стан користувача {user_id}: {e}")
+
+    def get(self, user_id: int) -> Optional[UserState]:
+        record = self._states.get(user_id)
+        if record is None or record.expires_at <= self._now():
+            return None
+        return record
+
+    async def set(self, user_id: int, state: str, **fields) -> UserState:
+        """Новий стан замість попереднього; термін дії відраховується заново"""
+        record = UserState(state, expires_at=self._now() + self.ttl, **fields)
+        self._states[user_id] = record
+        self._schedule(user_id, record)
+        await self._save(user_id, record)
+        return record
+
+    async def update(self, user_id: int, **fields) -> Optional[UserState]:
+        """Змінює поля наявного стану, не продовжуючи термін дії"""
+        record = self.get(user_id)
+        if record is None:
+            return None
+        for name, value in fields.items():
+            setattr(record, name, value)
+        await self._save(user_id, record)
+        return record
+
+    async def pop(self, user_id: int) -> Optional[UserState]:
+        record = self._states.pop(user_id, None)
+        if record is not None and self.persist:
+            try:
+                await run_db(delete_user_state, user_id)
+            except Exception as e:
+                print(f"❌ Не вдалося видалити стан користувача {user_id}: {e}")
+        return record
+
+    def sweep(self, now: int = None) -> int:
+        """Видаляє з пам'яті прострочені записи, повертає їх кількість"""
+        now = self._now() if now is None else now
+        evicted = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, user_id = heapq.heappop(self._expiry)
+            record = self._states.get(user_id)
+            # Запис могли перезаписати або видалити після того, як елемент потрапив у купу
+            if record is not None and record.expires_at == expires_at:
+                del self._states[user_id]
+                evicted += 1
+        self._evictions += evicted
+        return evicted
+
+    def log_stats(self) -> None:
+        stats = self.get_stats()
+        print(f"📊 Стани користувачів: {stats['size']} в пам'яті, {stats['pending_expiry']} у черзі терміну дії, "
+              f"прострочено всього {stats['evictions']}")
+
+    async def _run(self) -> None:
+        stats_logged_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                now = self._now()
+                evicted = self.sweep(now)
+                if self.persist:
+                    await run_db(delete_expired_user_states, now)
+                if evicted:
+                    print(f"🧹 Прострочені стани користувачів: видалено {evicted}, залишилось {len(self._states)}")
+                if time.monotonic() - stats_logged_at >= self.stats_interval:
+                    stats_logged_at = time.monotonic()
+                    self.log_stats()
+            except Exception as e:
+                print(f"❌ Помилка очищення станів користувачів: {e}")
+
+    async def start(self) -> None:
+        """Підвантажує збережені стани і запускає фонове очищення"""
+        if self.persist:
+            for user_id, state, chat_id, channel_id, captcha_message_id, expires_at in \
+                    await run_db(load_user_states, self._now()):
+                record = UserState(state, chat_id, channel_id, captcha_message_id, expires_at)
+                self._states[user_id] = record
+                self._schedule(user_id, record)
+            print(f"✅ Відновлено станів користувачів: {len(self._states)}")
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.log_stats()
+
+    def get_stats(self) -> dict:
+        return {
+            'size': len(self._states),
+            'pending_expiry': len(self._expiry),
+            'evictions': self._evictions,
+            'ttl': self.ttl,
+            'persistent': self.persist,
+        }
+
+
+user_states = UserStateStore()
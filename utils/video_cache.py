@@ -1,31 +1,198 @@
+import asyncio
+import os
+import time
+from urllib.parse import urlparse
+from collections import OrderedDict
+from typing import Optional
 from aiogram import Bot
 from aiogram.types import URLInputFile, Message
 from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from database.async_db import run_db, get_settings_media_file_ids
+from database.media_db import (
+    make_media_cache_key, get_media_cache, save_media_cache, touch_media_cache, delete_media_cache,
+    get_media_cache_stats, enqueue_media_job
+)
 from main import bot
 
-video_cache = {}
 
-def get_video_cache():
-    return video_cache
+MEDIA_LRU_SIZE = 1024
+VERIFY_INTERVAL = 3600
+MEDIA_TYPES = ('photo', 'video', 'document', 'animation')
 
-def set_video_cache(key: str, file_id: str):
-    video_cache[key] = file_id
 
-def get_cached_video(key: str):
-    return video_cache.get(key)
+class MediaCache:
+    """Кеш file_id завантажених медіа.
+
+    Дані лежать у таблиці media_cache (спільна для бота, cron-демона і веб-панелі
+    та переживає перезапуск), а найчастіші file_id тримаються в LRU у пам'яті.
+    Ключ - хеш від бота, типу медіа та URL, тож зміна URL в налаштуваннях
+    не віддасть старе відео.
+    """
+
+    def __init__(self, maxsize: int = MEDIA_LRU_SIZE):
+        self.maxsize = maxsize
+        self._lru = OrderedDict()  # cache_key -> [file_id, час останньої перевірки]
+        self._inflight = {}  # cache_key -> Future з file_id завантаження, що зараз триває
+
+    def _remember(self, key: str, file_id: str, verified_at: float) -> None:
+        self._lru[key] = [file_id, verified_at]
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+
+    async def get(self, bot_id: int, media_type: str, url: str) -> Optional[str]:
+        key = make_media_cache_key(bot_id, media_type, url)
+        entry = self._lru.get(key)
+        if entry is not None:
+            self._lru.move_to_end(key)
+            return entry[0]
+
+        row = await run_db(get_media_cache, key)
+        if row is None:
+            return None
+        # Час перевірки в БД не переносимо: перша успішна відправка оновить last_verified
+        self._remember(key, row['file_id'], 0)
+        return row['file_id']
+
+    async def set(self, bot_id: int, media_type: str, url: str, media) -> str:
+        """Зберігає file_id з об'єкта медіа у відповіді Telegram (Video, PhotoSize, Document...)"""
+        key = make_media_cache_key(bot_id, media_type, url)
+        self._remember(key, media.file_id, time.time())
+        await run_db(save_media_cache, key, bot_id, media_type, url, media.file_id,
+                     media.file_unique_id, media.file_size)
+        return media.file_id
+
+    async def verified(self, bot_id: int, media_type: str, url: str) -> None:
+        """Відмічає, що file_id спрацював; у БД пишемо не частіше ніж раз на VERIFY_INTERVAL"""
+        key = make_media_cache_key(bot_id, media_type, url)
+        entry = self._lru.get(key)
+        now = time.time()
+        if entry is not None and now - entry[1] >= VERIFY_INTERVAL:
+            entry[1] = now
+            await run_db(touch_media_cache, key)
+
+    async def forget(self, bot_id: int, media_type: str, url: str) -> None:
+        key = make_media_cache_key(bot_id, media_type, url)
+        self._lru.pop(key, None)
+        await run_db(delete_media_cache, key)
+
+    async def upload_once(self, bot_id: int, media_type: str, url: str, upload):
+        """Single-flight: файл завантажує лише перший виклик, решта чекає на його file_id.
+
+        upload - корутина, що відправляє файл і повертає об'єкт медіа з відповіді.
+        Повертає (file_id, True), якщо цей виклик завантажив файл сам (тобто вже
+        відправив його), або (file_id, False) з file_id, отриманим від іншого виклику.
+        """
+        key = make_media_cache_key(bot_id, media_type, url)
+        while key in self._inflight:
+            file_id = await asyncio.shield(self._inflight[key])
+            if file_id:
+                return file_id, False
+            # Завантаження не вдалося (наприклад, користувач заблокував бота) - пробує наступний
+
+        entry = self._lru.get(key)
+        if entry is not None:
+            return entry[0], False
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        file_id = None
+        try:
+            media = await upload()
+            if media is not None:
+                file_id = await self.set(bot_id, media_type, url, media)
+            return file_id, True
+        finally:
+            del self._inflight[key]
+            future.set_result(file_id)
+
+    def clear(self) -> None:
+        """Очищає лише кеш у пам'яті, записи в БД залишаються"""
+        self._lru.clear()
+
+
+media_cache = MediaCache()
+_enqueued_media = set()
+
+
+def is_bad_file_id_error(error: Exception) -> bool:
+    """file_id більше не приймається Telegram - запис у кеші треба видалити"""
+    return isinstance(error, TelegramBadRequest) and 'file' in str(error).lower()
+
+
+async def cached_media(media_type: str, url: str) -> str:
+    """file_id для медіа за URL, якщо воно вже завантажене, інакше сам URL.
+
+    Незавантажений URL ставиться в чергу media_jobs, тож наступні відправки
+    підуть за file_id.
+    """
+    if not url or not url.startswith(('http://', 'https://')):
+        return url
+    # Медіа з налаштувань: file_id, який cron_daemon записав поруч з URL
+    file_id = (await get_settings_media_file_ids()).get((media_type, url))
+    if file_id:
+        return file_id
+    file_id = await media_cache.get(bot.id, media_type, url)
+    if file_id:
+        return file_id
+    # Один раз за життя процесу, щоб URL з помилкою не ставився в чергу при кожній відправці
+    if (media_type, url) not in _enqueued_media:
+        _enqueued_media.add((media_type, url))
+        try:
+            await run_db(enqueue_media_job, media_type, url)
+        except Exception as e:
+            print(f"❌ Не вдалося поставити медіа в чергу завантаження: {e}")
+    return url
+
+
+def url_input_file(url: str, media_type: str) -> URLInputFile:
+    filename = os.path.basename(urlparse(url).path) or ("video.mp4" if media_type == 'video' else None)
+    return URLInputFile(url, filename=filename)
+
+
+async def send_media(bot: Bot, chat_id: int, media_type: str, media, **kwargs) -> Message:
+    """Відправляє фото, відео, документ або анімацію (file_id, URL або URLInputFile)"""
+    if media_type == 'photo':
+        return await bot.send_photo(chat_id, media, **kwargs)
+    if media_type == 'video':
+        return await bot.send_video(chat_id, media, supports_streaming=True, **kwargs)
+    if media_type == 'animation':
+        return await bot.send_animation(chat_id, media, **kwargs)
+    if media_type == 'document':
+        return await bot.send_document(chat_id, media, **kwargs)
+    raise ValueError(f"Невідомий тип медіа: {media_type}")
+
+
+def media_from_message(message: Message, media_type: str):
+    """Об'єкт медіа з відправленого повідомлення (для фото - найбільший розмір)"""
+    if media_type == 'photo':
+        return message.photo[-1] if message.photo else None
+    return getattr(message, media_type, None)
+
+
+async def materialize_media(bot: Bot, chat_id: int, media_type: str, url: str) -> str:
+    """Завантажує медіа за URL у службовий чат і зберігає file_id у кеші"""
+    file_id = await media_cache.get(bot.id, media_type, url)
+    if file_id:
+        return file_id
+
+    sent_message = await send_media(bot, chat_id, media_type, url_input_file(url, media_type))
+    media = media_from_message(sent_message, media_type)
+    # Telegram може повернути відео як документ або анімацію - тоді file_id не підійде для send_video
+    if media is None:
+        raise RuntimeError(f"Telegram не розпізнав файл як {media_type}")
+    return await media_cache.set(bot.id, media_type, url, media)
 
-def is_video_cached(key: str):
-    return key in video_cache
 
 def clear_video_cache():
-    global video_cache
-    video_cache.clear()
+    media_cache.clear()
+
 
 def get_cache_stats():
-    return {
-        'total_cached': len(video_cache),
-        'keys': list(video_cache.keys())
-    }
+    stats = get_media_cache_stats()
+    stats['in_memory'] = len(media_cache._lru)
+    return stats
 
 
 async def send_video_with_caching_for_mailing(bot: Bot, user_id: int, video_url: str, caption: str, reply_markup=None, cache_key: str = "mailing_video"):
@@ -39,10 +206,9 @@ async def send_video_with_caching_for_mailing(bot: Bot, user_id: int, video_url:
                 reply_markup=reply_markup
             )
             return True
-        
-        if is_video_cached(cache_key):
-            file_id = get_cached_video(cache_key)
-            
+
+        file_id = await media_cache.get(bot.id, 'video', video_url)
+        if file_id:
             try:
                 await bot.send_video(
                     chat_id=user_id,
@@ -51,54 +217,59 @@ async def send_video_with_caching_for_mailing(bot: Bot, user_id: int, video_url:
                     parse_mode="HTML",
                     reply_markup=reply_markup
                 )
+                await media_cache.verified(bot.id, 'video', video_url)
                 return True
+            except (TelegramRetryAfter, TelegramForbiddenError):
+                raise
             except Exception as e:
-                print(f"Failed to send cached video: {e}, will try to re-upload")
-        
-        await bot.send_chat_action(chat_id=user_id, action="upload_video")
-        
-        try:
-            from aiogram.types import URLInputFile
-            video = URLInputFile(video_url, filename="video.mp4")
-            
-            sent_message = await bot.send_video(
-                chat_id=user_id,
-                video=video,
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=reply_markup,
-                width=1280,
-                    height=720,
-                supports_streaming=True
-            )
-            
-            if sent_message and sent_message.video:
-                set_video_cache(cache_key, sent_message.video.file_id)
-                return True
-                
-        except Exception as e:
-            
+                print(f"Failed to send cached video {cache_key}: {e}, will try to re-upload")
+                if is_bad_file_id_error(e):
+                    await media_cache.forget(bot.id, 'video', video_url)
+
+        async def upload():
+            await bot.send_chat_action(chat_id=user_id, action="upload_video")
             try:
-                video = URLInputFile(video_url, filename="video.mp4")
                 sent_message = await bot.send_video(
                     chat_id=user_id,
-                    video=video,
+                    video=URLInputFile(video_url, filename="video.mp4"),
+                    caption=caption,
+                    parse_mode="HTML",
+                    reply_markup=reply_markup,
+                    width=1280,
+                    height=720,
+                    supports_streaming=True
+                )
+            except (TelegramRetryAfter, TelegramForbiddenError):
+                raise
+            except Exception as e:
+                sent_message = await bot.send_video(
+                    chat_id=user_id,
+                    video=URLInputFile(video_url, filename="video.mp4"),
                     caption=caption,
                     parse_mode="HTML",
                     reply_markup=reply_markup,
                     supports_streaming=True
                 )
-                
-                if sent_message and sent_message.video:
-                    set_video_cache(cache_key, sent_message.video.file_id)
-                    return True
-                    
-            except Exception as e2:
-                return False
-            
+            return sent_message.video if sent_message else None
+
+        file_id, uploaded = await media_cache.upload_once(bot.id, 'video', video_url, upload)
+        if uploaded or not file_id:
+            return bool(file_id)
+
+        await bot.send_video(
+            chat_id=user_id,
+            video=file_id,
+            caption=caption,
+            parse_mode="HTML",
+            reply_markup=reply_markup
+        )
+        return True
+
+    except (TelegramRetryAfter, TelegramForbiddenError):
+        raise
     except Exception as e:
         return False
-    
+
 
 
 async def send_video_with_caching(message: Message, video_url: str, caption: str, reply_markup=None, cache_key: str = "default_video"):
@@ -111,22 +282,30 @@ async def send_video_with_caching(message: Message, video_url: str, caption: str
                 reply_markup=reply_markup
             )
             return True
-            
-        if is_video_cached(cache_key):
-            await message.answer_video(
-                video=get_cached_video(cache_key),
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=reply_markup
-            )
-            return True
-        else:
+
+        bot_id = (message.bot or bot).id
+        file_id = await media_cache.get(bot_id, 'video', video_url)
+        if file_id:
+            try:
+                await message.answer_video(
+                    video=file_id,
+                    caption=caption,
+                    parse_mode="HTML",
+                    reply_markup=reply_markup
+                )
+                await media_cache.verified(bot_id, 'video', video_url)
+                return True
+            except Exception as e:
+                if not is_bad_file_id_error(e):
+                    raise
+                print(f"Failed to send cached video {cache_key}: {e}, will try to re-upload")
+                await media_cache.forget(bot_id, 'video', video_url)
+
+        async def upload():
             await bot.send_chat_action(chat_id=message.chat.id, action=ChatAction.UPLOAD_VIDEO)
-            video = URLInputFile(video_url, filename="video.mp4")
-            
             try:
                 sent_message = await message.answer_video(
-                    video,
+                    URLInputFile(video_url, filename="video.mp4"),
                     caption=caption,
                     parse_mode="HTML",
                     reply_markup=reply_markup,
@@ -134,31 +313,34 @@ async def send_video_with_caching(message: Message, video_url: str, caption: str
                     height=720,
                     supports_streaming=True
                 )
-                
-                if sent_message.video:
-                    set_video_cache(cache_key, sent_message.video.file_id)
-                    return True
-                    
             except Exception as e:
-                
-                video = URLInputFile(video_url, filename="video.mp4")
                 sent_message = await message.answer_video(
-                    video,
+                    URLInputFile(video_url, filename="video.mp4"),
                     caption=caption,
                     parse_mode="HTML",
                     reply_markup=reply_markup,
                     supports_streaming=True
                 )
-                
-                if sent_message.video:
-                    set_video_cache(cache_key, sent_message.video.file_id)
-                    return True
-            
+            return sent_message.video
+
+        # При холодному кеші хвиля користувачів чекає одне завантаження замість сотні паралельних
+        file_id, uploaded = await media_cache.upload_once(bot_id, 'video', video_url, upload)
+        if uploaded or not file_id:
+            return bool(file_id)
+
+        await message.answer_video(
+            video=file_id,
+            caption=caption,
+            parse_mode="HTML",
+            reply_markup=reply_markup
+        )
+        return True
+
     except Exception as e:
         try:
             video = URLInputFile(video_url, filename="video.mp4")
             await message.answer_document(
-                video, 
+                video,
                 caption=caption + " (як документ)",
                 parse_mode="HTML",
                 reply_markup=reply_markup
@@ -166,5 +348,5 @@ async def send_video_with_caching(message: Message, video_url: str, caption: str
             return True
         except Exception as e2:
             return False
-    
-    return False
\ No newline at end of file
+
+    return False
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 import json
 from database.settings_db import (
@@ -10,24 +10,31 @@ from database.settings_db import (
     get_answers_config, save_answers_config, get_private_lesson_config, save_private_lesson_config,
     get_tariffs_config, save_tariffs_config, get_clothes_tariff_config, save_clothes_tariff_config,
     get_tech_tariff_config, save_tech_tariff_config, get_clothes_payment_config, save_clothes_payment_config,
-    get_tech_payment_config, save_tech_payment_config, create_subscription_messages_table
+    get_tech_payment_config, save_tech_payment_config, enqueue_mailing_job, get_mailing_job,
+    get_mailing_delivery_stats, get_mailing_progress, get_active_mailing_ids
 )
 from database.client_db import (
-    get_users_count, get_users_with_statuses, admin_update_user_status,
-    get_subscription_stats, admin_delete_user,
-    get_analytics_counts, get_analytics_timeseries, get_param_distribution, get_status_distribution,
-    get_start_params_stats
+    get_users_count, admin_update_user_status,
+    get_subscription_stats, admin_delete_user, get_users_page,
+    get_analytics_all
 )
+from database.media_db import enqueue_media_job
+from utils.user_export import iter_users_csv
+from database.migrations import run_migrations
 from database.start_params_db import add_start_param, delete_start_param, get_total_start_params, get_users_with_start_params, get_start_params_stats
-from config import token
 from flask import Flask, render_template, request, url_for, flash, redirect
 from werkzeug.security import generate_password_hash
 from database.settings_db import check_password
-from aiogram import Bot
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 
+# Схему оновлюємо при імпорті: під gunicorn (web_admin:app) блок __main__ не виконується
+run_migrations()
+
+USERS_PAGE_SIZE = 100
+USERS_PAGE_MAX = 500
+
 # Функция для получения отображения этапа с ID
 def get_stage_id_display(stage_name):
     stage_map = {
@@ -45,6 +52,37 @@ def get_stage_id_display(stage_name):
     }
     return stage_map.get(stage_name, stage_name)
 
+
+def get_audience_filter_from_form():
+    """Додаткові фільтри аудиторії з форми розсилки: (start_param_filter, audience_filter JSON)"""
+    start_params = [param.strip() for value in request.form.getlist('start_param_filter')
+                    for param in value.split(',') if param.strip()]
+    
+    audience = {}
+    subscription_statuses = [status for status in request.form.get('subscription_status', '').split(',') if status]
+    if subscription_statuses:
+        audience['subscription_statuses'] = subscription_statuses
+    for key in ('joined_from', 'joined_to', 'active_from', 'active_to'):
+        if request.form.get(key):
+            audience[key] = request.form.get(key)
+    
+    return (','.join(start_params) or None,
+            json.dumps(audience, ensure_ascii=False) if audience else None)
+
+PREWARM_MEDIA_TYPES = ('photo', 'video', 'document', 'animation')
+
+
+def enqueue_saved_media(media_type, url):
+    """Ставить медіа за URL, щойно збережене в налаштуваннях, у чергу на завантаження
+    в Telegram (media_jobs), щоб перший користувач не чекав завантаження відео.
+    Отриманий file_id cron_daemon.py записує поруч з налаштуванням."""
+    url = (url or '').strip()
+    if media_type in PREWARM_MEDIA_TYPES and url.startswith(('http://', 'https://')):
+        try:
+            enqueue_media_job(media_type, url)
+        except Exception as e:
+            print(f"❌ Не вдалося поставити медіа в чергу завантаження: {e}")
+
 @app.template_filter('from_json')
 def from_json_filter(value):
     if value and isinstance(value, str):
@@ -176,24 +214,68 @@ def tariffs_settings():
 @app.route('/users')
 @login_required
 def users_list():
-    page = request.args.get('page', 1, type=int)
-    per_page = 100
+    per_page = USERS_PAGE_SIZE
     
-    users, total_users, total_pages, current_page, per_page = get_users_with_statuses(page, per_page)
+    # Первая страница рендерится сразу, следующие подгружаются из /api/users по курсору
+    users, next_cursor = get_users_page(per_page)
+    total_users = get_users_count()
     
     # Получаем статистику по подпискам
     subscription_stats = get_subscription_stats()
     
     return render_template('users.html', 
                          users=users, 
-                         current_page=current_page, 
-                         total_pages=total_pages, 
+                         next_cursor=next_cursor,
                          total_users=total_users,
                          per_page=per_page,
                          subscription_stats=subscription_stats,
-                         get_stage_id_display=get_stage_id_display,
-                         max=max,
-                         min=min)
+                         start_params=get_start_params_stats(),
+                         get_stage_id_display=get_stage_id_display)
+
+
+@app.route('/export/users.csv')
+@login_required
+def export_users_csv():
+    """Вся таблица пользователей потоковым CSV: строки читаются и отдаются порциями"""
+    from datetime import datetime
+    filename = f"users_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return Response(
+        stream_with_context(iter_users_csv()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+@app.route('/api/users')
+@login_required
+def api_users():
+    """Страница пользователей с фильтрами: ?cursor=&limit=&status=&subscription_status=&start_param=&search="""
+    try:
+        limit = min(max(request.args.get('limit', USERS_PAGE_SIZE, type=int), 1), USERS_PAGE_MAX)
+        users, next_cursor = get_users_page(
+            limit,
+            cursor=request.args.get('cursor') or None,
+            status=request.args.get('status') or None,
+            subscription_status=request.args.get('subscription_status') or None,
+            start_param=request.args.get('start_param') or None,
+            search=request.args.get('search') or None
+        )
+        items = [{
+            'user_id': user_id,
+            'user_name': user_name,
+            'join_date': join_date,
+            'last_activity': last_activity,
+            'start_param': start_param,
+            'status': status,
+            'stage': get_stage_id_display(status) if status else None,
+            'subscription_status': subscription_status
+        } for (user_id, user_name, join_date, last_activity, start_param, status, subscription_status) in users]
+        return jsonify({'success': True, 'users': items, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"ERROR in api_users: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 
 @app.route('/analytics')
@@ -210,19 +292,12 @@ def analytics_dashboard():
     if not start_date:
         start_date = (datetime.now() - timedelta(days=29)).strftime('%Y-%m-%d')
 
-    counts = get_analytics_counts(start_date, end_date, param)
-    timeseries = get_analytics_timeseries(start_date, end_date, param)
-    param_dist = get_param_distribution(start_date, end_date, param)
-    status_dist = get_status_distribution(start_date, end_date, param)
+    # Цифры и графики страница загружает одним запросом к /api/analytics/all
     # Get all available start params for dropdown
     all_start_params = get_start_params_stats()
 
     return render_template(
         'analytics.html',
-        counts=counts,
-        timeseries=timeseries,
-        param_dist=param_dist,
-        status_dist=status_dist,
         all_start_params=all_start_params,
         start_date=start_date,
         end_date=end_date,
@@ -395,6 +470,7 @@ def edit_start_message():
     print(f"DEBUG: saving start message config: {config}")
     save_start_message_config(config)
     print("DEBUG: start message config saved successfully")
+    enqueue_saved_media(media_type, media_url)
     flash('Стартовое сообщение обновлено!', 'success')
     
     return redirect(url_for('welcome_settings'))
@@ -439,6 +515,7 @@ def save_welcome_without_subscription_route():
         )
         
         if success:
+            enqueue_saved_media(media_type, media_url)
             flash('Привітальне повідомлення без підписки успішно збережено!', 'success')
         else:
             flash('Помилка при збереженні налаштувань!', 'error')
@@ -487,6 +564,7 @@ def edit_our_chat_message():
     print(f"DEBUG: saving our chat config: {config}")
     save_our_chat_config(config)
     print("DEBUG: our chat config saved successfully")
+    enqueue_saved_media(media_type, media_url)
     flash('Сообщение "Наш чат" обновлено!', 'success')
     
     return redirect(url_for('our_chat_settings'))
@@ -517,6 +595,7 @@ def edit_channel_join_message():
     print(f"DEBUG: saving channel join config: {config}")
     save_channel_join_config(config)
     print("DEBUG: channel join config saved successfully")
+    enqueue_saved_media(media_type, media_url)
     flash('Сообщение при заявке на вступ до каналу оновлено!', 'success')
     
     return redirect(url_for('channel_join_settings'))
@@ -619,6 +698,8 @@ def edit_channel_leave_message():
     print(f"DEBUG: saving channel leave config: {config}")
     save_channel_leave_config(config)
     print("DEBUG: channel leave config saved successfully")
+    enqueue_saved_media(media_type, media_url)
+    enqueue_saved_media(leave_media_type, leave_media_url)
     flash('Сообщение при выходе из канала обновлено!', 'success')
     
     return redirect(url_for('channel_leave_settings'))
@@ -645,6 +726,7 @@ def add_channel_invite_link_route():
     try:
         add_channel_invite_link(invite_link, channel_name, message_text, media_type, media_url)
         print(f"DEBUG: channel invite link added successfully: {invite_link}")
+        enqueue_saved_media(media_type, media_url)
         flash('Запрошувальне посилання успішно додано!', 'success')
     except Exception as e:
         print(f"ERROR in add_channel_invite_link_route: {e}")
@@ -675,6 +757,7 @@ def edit_channel_invite_link_route(link_id):
         success = update_channel_invite_link(link_id, invite_link, channel_name, message_text, media_type, media_url)
         if success:
             print(f"DEBUG: channel invite link updated successfully for ID: {link_id}")
+            enqueue_saved_media(media_type, media_url)
             flash('Запрошувальне посилання успішно оновлено!', 'success')
         else:
             print(f"DEBUG: failed to update channel invite link for ID: {link_id}")
@@ -739,6 +822,7 @@ def edit_start_link():
     print(f"DEBUG: saving start link config: start_param={start_param}, message_text={message_text}, media_type={media_type}, media_url={media_url}, inline_buttons={inline_buttons}")
     save_start_link_config(start_param, message_text, media_type, media_url, inline_buttons)
     print("DEBUG: start link config saved successfully")
+    enqueue_saved_media(media_type, media_url)
     
     flash('Ссылка успешно сохранена!', 'success')
     return redirect(url_for('start_links'))
@@ -788,7 +872,8 @@ def mailing_settings():
     from database.settings_db import get_all_mailings
     mailings = get_all_mailings()
     print(f"DEBUG: mailings count: {len(mailings) if mailings else 0}")
-    return render_template('mailing_settings.html', mailings=mailings)
+    return render_template('mailing_settings.html', mailings=mailings,
+                           active_mailing_ids=get_active_mailing_ids())
 
 
 @app.route('/create_mailing', methods=['POST'])
@@ -855,8 +940,12 @@ def create_mailing_route():
         print(f"🔍 DEBUG: Фільтр користувачів: {user_filter}")
         print(f"🔍 DEBUG: Статус користувачів: '{user_status}'")
         
+        start_param_filter, audience_filter = get_audience_filter_from_form()
+        broadcast_mode = 'copy' if request.form.get('broadcast_mode') == 'copy' else 'send'
         mailing_id = add_mailing(name, message_text, media_type, media_url, inline_buttons_json,
-                                user_filter, user_status, None)
+                                user_filter, user_status, start_param_filter, audience_filter,
+                                broadcast_mode)
+        enqueue_saved_media(media_type, media_url)
         
         # Перевіряємо, чи потрібно зробити розсилку повторюваною
         is_recurring = request.form.get('is_recurring') == 'on'
@@ -897,8 +986,6 @@ def create_and_send_mailing_route():
     print("DEBUG: create_and_send_mailing_route called")
     print(f"DEBUG: form data: {request.form}")
     from database.settings_db import add_mailing, update_mailing_status
-    from utils.cron_functions import send_mailing_to_users
-    import asyncio
     import json
     
     try:
@@ -951,8 +1038,12 @@ def create_and_send_mailing_route():
         user_status = request.form.get('user_status', '')
         
         # Створюємо розсилку
+        start_param_filter, audience_filter = get_audience_filter_from_form()
+        broadcast_mode = 'copy' if request.form.get('broadcast_mode') == 'copy' else 'send'
         mailing_id = add_mailing(name, message_text, media_type, media_url, inline_buttons_json,
-                                user_filter, user_status, None)
+                                user_filter, user_status, start_param_filter, audience_filter,
+                                broadcast_mode)
+        enqueue_saved_media(media_type, media_url)
         
         # Перевіряємо, чи потрібно зробити розсилку повторюваною
         is_recurring = request.form.get('is_recurring') == 'on'
@@ -977,32 +1068,15 @@ def create_and_send_mailing_route():
         
         # Запускаємо розсилку в БД
         update_mailing_status(mailing_id, 'active')
-
-        bot = Bot(token=token)
         
-        # Запускаємо розсилку асинхронно
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # Відправку виконує фоновий воркер (cron_daemon.py)
+        job_id = enqueue_mailing_job(mailing_id)
         
-        try:
-            result = loop.run_until_complete(send_mailing_to_users(bot, mailing_id))
-            if result:
-                if is_recurring:
-                    return jsonify({'success': True, 'message': 'Розсилка успішно створена, запущена та зроблена повторюваною!'})
-                else:
-                    return jsonify({'success': True, 'message': 'Розсилка успішно створена та запущена!'})
-            else:
-                return jsonify({'success': False, 'error': 'Розсилка створена, але виникли помилки при відправці!'})
-        finally:
-            loop.close()
-            # Правильно закриваємо сесію бота
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(bot.session.close())
-                loop.close()
-            except Exception as e:
-                print(f"Помилка при закритті сесії бота: {e}")
+        if is_recurring:
+            message = 'Розсилка успішно створена, поставлена в чергу на відправку та зроблена повторюваною!'
+        else:
+            message = 'Розсилка успішно створена та поставлена в чергу на відправку!'
+        return jsonify({'success': True, 'message': message, 'mailing_id': mailing_id, 'job_id': job_id})
         
     except Exception as e:
         return jsonify({'success': False, 'error': f'Помилка: {str(e)}'})
@@ -1012,8 +1086,6 @@ def create_and_send_mailing_route():
 @login_required
 def start_mailing_route(mailing_id):
     from database.settings_db import update_mailing_status
-    from utils.cron_functions import send_mailing_to_users
-    import asyncio
     
     try:
         # Запускаємо розсилку в БД
@@ -1021,29 +1093,10 @@ def start_mailing_route(mailing_id):
         if not success:
             flash('Помилка при запуску розсилки!', 'error')
             return redirect(url_for('mailing_settings'))
-        from aiogram import Bot
-        bot = Bot(token=token)
         
-        # Запускаємо розсилку асинхронно
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            result = loop.run_until_complete(send_mailing_to_users(bot, mailing_id))
-            if result:
-                flash('Розсилка успішно запущена та відправлена всім користувачам!', 'success')
-            else:
-                flash('Розсилка запущена, але виникли помилки при відправці!', 'error')
-        finally:
-            loop.close()
-            # Правильно закриваємо сесію бота
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(bot.session.close())
-                loop.close()
-            except Exception as e:
-                print(f"Помилка при закритті сесії бота: {e}")
+        # Відправку виконує фоновий воркер (cron_daemon.py)
+        enqueue_mailing_job(mailing_id)
+        flash('Розсилка поставлена в чергу на відправку!', 'success')
         
     except Exception as e:
         flash(f'Помилка при запуску розсилки: {str(e)}', 'error')
@@ -1130,8 +1183,6 @@ def resend_mailing_route(mailing_id):
     """Відправляє розсилку знову"""
     print(f"DEBUG: resend_mailing_route called with mailing_id: {mailing_id}")
     from database.settings_db import resend_mailing
-    from utils.cron_functions import send_mailing_to_users
-    import asyncio
     
     try:
         # Оновлюємо час відправки в БД
@@ -1141,32 +1192,10 @@ def resend_mailing_route(mailing_id):
             flash('Помилка при оновленні часу відправки!', 'error')
             return redirect(url_for('mailing_settings'))
         
-        # Відправляємо розсилку знову
-        from aiogram import Bot
-        bot = Bot(token=token)
-        
-        # Запускаємо розсилку асинхронно
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            result = loop.run_until_complete(send_mailing_to_users(bot, mailing_id))
-            if result:
-                print(f"DEBUG: mailing resent successfully for ID: {mailing_id}")
-                flash('Розсилка успішно відправлена знову!', 'success')
-            else:
-                print(f"DEBUG: mailing updated but failed to send for ID: {mailing_id}")
-                flash('Розсилка оновлена, але виникли помилки при відправці!', 'error')
-        finally:
-            loop.close()
-            # Правильно закриваємо сесію бота
-            try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(bot.session.close())
-                loop.close()
-            except Exception as e:
-                print(f"Помилка при закритті сесії бота: {e}")
+        # Відправляємо розсилку знову всім користувачам через фоновий воркер
+        enqueue_mailing_job(mailing_id, restart=True)
+        print(f"DEBUG: mailing queued for resend, ID: {mailing_id}")
+        flash('Розсилка поставлена в чергу на повторну відправку!', 'success')
         
     except Exception as e:
         flash(f'Помилка при повторній відправці: {str(e)}', 'error')
@@ -1229,8 +1258,12 @@ def create_and_schedule_mailing_route():
         user_status = request.form.get('user_status', '')
         
         # Створюємо розсилку
+        start_param_filter, audience_filter = get_audience_filter_from_form()
+        broadcast_mode = 'copy' if request.form.get('broadcast_mode') == 'copy' else 'send'
         mailing_id = add_mailing(name, message_text, media_type, media_url, inline_buttons_json,
-                                user_filter, user_status, None)
+                                user_filter, user_status, start_param_filter, audience_filter,
+                                broadcast_mode)
+        enqueue_saved_media(media_type, media_url)
         
         # Плануємо розсилку
         schedule_type = request.form.get('schedule_type', 'immediate')
@@ -1527,6 +1560,7 @@ def update_mailing(mailing_id):
         
         if success:
             print(f"DEBUG: mailing updated successfully for ID: {mailing_id}")
+            enqueue_saved_media(media_type, media_url)
             flash('Розсилку успішно оновлено!', 'success')
         else:
             print(f"DEBUG: failed to update mailing for ID: {mailing_id}")
@@ -1590,6 +1624,7 @@ def save_subscription_message_route():
         )
         
         if success:
+            enqueue_saved_media(media_type, media_url)
             flash('Повідомлення після перевірки підписки успішно збережено!', 'success')
         else:
             flash('Помилка при збереженні повідомлення!', 'error')
@@ -1629,6 +1664,7 @@ def save_captcha_settings_route():
         )
         
         if success:
+            enqueue_saved_media(captcha_media_type, captcha_media_url)
             flash('Налаштування капчі успішно збережено!', 'success')
         else:
             flash('Помилка при збереженні налаштувань капчі!', 'error')
@@ -1686,6 +1722,7 @@ def save_answers_settings_route():
         )
         
         if success:
+            enqueue_saved_media(media_type, media_url)
             flash('Налаштування повідомлення "Ответы на вопросы" успішно збережено!', 'success')
         else:
             flash('Помилка при збереженні налаштувань!', 'error')
@@ -1743,6 +1780,7 @@ def save_private_lesson_settings_route():
         )
         
         if success:
+            enqueue_saved_media(media_type, media_url)
             flash('Налаштування повідомлення "Приватный урок" успішно збережено!', 'success')
         else:
             flash('Помилка при збереженні налаштувань!', 'error')
@@ -1812,6 +1850,7 @@ def save_tariffs_settings_route():
         
         # Зберігаємо налаштування кнопок вибору тарифів окремо
         if success:
+            enqueue_saved_media(media_type, media_url)
             from database.settings_db import save_tariff_selection_buttons_config
             
             print(f"DEBUG: Зберігаємо clothes_button_text = '{clothes_button_text}'")
@@ -1880,6 +1919,7 @@ def save_clothes_tariff_settings():
         )
         
         if success:
+            enqueue_saved_media(media_type, media_url)
             flash('Налаштування тарифу "Одежда" успішно збережено!', 'success')
         else:
             flash('Помилка при збереженні налаштувань!', 'error')
@@ -1932,6 +1972,7 @@ def save_tech_tariff_settings():
         )
         
         if success:
+            enqueue_saved_media(media_type, media_url)
             flash('Налаштування тарифу "Техника" успішно збережено!', 'success')
         else:
             flash('Помилка при збереженні налаштувань!', 'error')
@@ -1992,6 +2033,7 @@ def save_clothes_payment_settings():
         )
         
         if success:
+            enqueue_saved_media(media_type, media_url)
             flash('Налаштування оплати тарифу "Одежда" успішно збережено!', 'success')
         else:
             flash('Помилка при збереженні налаштувань!', 'error')
@@ -2051,6 +2093,7 @@ def save_tech_payment_settings():
         )
         
         if success:
+            enqueue_saved_media(media_type, media_url)
             flash('Налаштування оплати тарифу "Техника" успішно збережено!', 'success')
         else:
             flash('Помилка при збереженні налаштувань!', 'error')
@@ -2162,72 +2205,81 @@ def api_get_stats():
         return jsonify({'success': False, 'error': str(e)})
 
 
-@app.route('/api/analytics/summary')
+@app.route('/api/mailing_jobs/<int:job_id>')
 @login_required
-def api_analytics_summary():
+def api_mailing_job(job_id):
+    """Стан задачі розсилки для опитування з браузера"""
     try:
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        param = request.args.get('param')
-        data = get_analytics_counts(start_date, end_date, param)
-        return jsonify({'success': True, 'data': data})
+        job = get_mailing_job(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': 'Задачу не знайдено'}), 404
+        
+        job['deliveries'] = get_mailing_delivery_stats(job['mailing_id'])
+        return jsonify({'success': True, 'job': job})
     except Exception as e:
-        print(f"ERROR in api_analytics_summary: {e}")
+        print(f"ERROR in api_mailing_job: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/analytics/timeseries')
+@app.route('/api/mailings/audience_preview', methods=['POST'])
 @login_required
-def api_analytics_timeseries():
+def api_mailing_audience_preview():
+    """Розмір аудиторії для фільтрів з форми розсилки (без створення розсилки)"""
     try:
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        param = request.args.get('param')
-        series = get_analytics_timeseries(start_date, end_date, param)
-        # Convert tuples to dicts for JSON
-        items = [{
-            'day': d,
-            'joined': j,
-            'to_payment': p,
-            'paid': paid
-        } for (d, j, p, paid) in series]
-        return jsonify({'success': True, 'data': items})
+        from utils.mailing_audience import get_mailing_audience
+        
+        start_param_filter, audience_filter = get_audience_filter_from_form()
+        mailing = {
+            'user_filter': request.form.get('user_filter', 'all'),
+            'user_status': request.form.get('user_status', ''),
+            'start_param_filter': start_param_filter,
+            'audience_filter': audience_filter
+        }
+        return jsonify({'success': True, 'count': get_mailing_audience(mailing, count_only=True)})
     except Exception as e:
-        print(f"ERROR in api_analytics_timeseries: {e}")
+        print(f"ERROR in api_mailing_audience_preview: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/analytics/params')
+@app.route('/api/mailings/<int:mailing_id>/progress')
 @login_required
-def api_analytics_params():
+def api_mailing_progress(mailing_id):
+    """Прогрес розсилки: лічильники, швидкість та ETA"""
     try:
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        dist = get_param_distribution(start_date, end_date)
-        items = [{'param_name': name, 'count': cnt} for (name, cnt) in dist]
-        return jsonify({'success': True, 'data': items})
+        progress = get_mailing_progress(mailing_id)
+        if not progress:
+            return jsonify({'success': False, 'error': 'Розсилка ще не запускалась'}), 404
+        
+        return jsonify({'success': True, 'progress': progress})
     except Exception as e:
-        print(f"ERROR in api_analytics_params: {e}")
+        print(f"ERROR in api_mailing_progress: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/analytics/statuses')
+@app.route('/api/analytics/all')
 @login_required
-def api_analytics_statuses():
+def api_analytics_all():
+    """Все данные дашборда одним запросом к БД (summary, timeseries, params, statuses)"""
     try:
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         param = request.args.get('param')
-        dist = get_status_distribution(start_date, end_date, param)
-        items = [{'status': name, 'count': cnt} for (name, cnt) in dist]
-        return jsonify({'success': True, 'data': items})
+        data = get_analytics_all(start_date, end_date, param)
+        return jsonify({'success': True, 'data': {
+            'summary': data['counts'],
+            'timeseries': [{
+                'day': d,
+                'joined': j,
+                'to_payment': p,
+                'paid': paid
+            } for (d, j, p, paid) in data['timeseries']],
+            'params': [{'param_name': name, 'count': cnt} for (name, cnt) in data['param_dist']],
+            'statuses': [{'status': name, 'count': cnt} for (name, cnt) in data['status_dist']]
+        }})
     except Exception as e:
-        print(f"ERROR in api_analytics_statuses: {e}")
+        print(f"ERROR in api_analytics_all: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
 if __name__ == '__main__':
-    # Ініціалізуємо таблиці
-    create_subscription_messages_table()
-    
     app.run(debug=True, host='0.0.0.0', port=5001)